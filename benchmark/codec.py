@@ -0,0 +1,100 @@
+"""
+### JSON编码解码基准测试
+
+比较标准库 json 与 orjson 在 `userdata.json` 和商品列表接口返回数据上的解析、编码耗时
+
+用法: `python benchmark/codec.py [QQ用户数]`
+"""
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).parent))
+# 导入 models 时会初始化 NoneBot 并加载插件
+from models import sample_account  # noqa: E402
+
+from nonebot_plugin_mystool import codec  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def sample_userdata(count: int) -> str:
+    """
+    生成与插件写入格式相同的 `userdata.json` 内容，每个QQ用户两个账户
+    """
+    userdata = {
+        str(10000 + num): {
+            "accounts": [sample_account(num * 2), sample_account(num * 2 + 1)],
+            "notice": True,
+            "schema_version": 1
+        } for num in range(count)
+    }
+    return json.dumps(userdata, indent=4, ensure_ascii=False)
+
+
+def sample_good_list() -> bytes:
+    """
+    生成一页(20个)商品列表接口的返回数据
+    """
+    goods = [{
+        "goods_id": "2022051" + str(100000 + num),
+        "goods_name": "原神周边 - 角色立牌 第{}弹".format(num),
+        "goods_name_sub": "",
+        "price": 2000 + num * 100,
+        "point_sn": "myb",
+        "type": 1 + num % 2,
+        "next_time": 1672502400 + num * 86400,
+        "next_num": 50,
+        "status": "online",
+        "sale_start_time": "0",
+        "time_limited": True,
+        "account_cycle_limit": 1,
+        "account_cycle_type": "forever",
+        "account_exchange_num": 0,
+        "game_biz": "hk4e_cn",
+        "game": "hk4e",
+        "unlimit": False,
+        "total": 0,
+        "icon": "https://upload-bbs.mihoyo.com/upload/2022/05/11/{}.png".format(num),
+        "detail": "<p>商品详情：本商品为实物商品，兑换后将在15个工作日内发货。</p>" * 5,
+        "rules": "<p>兑换规则：每个米游社账号限兑换1次。</p>" * 3,
+        "user_level_limit": 1,
+        "images": ["https://upload-bbs.mihoyo.com/upload/2022/05/11/{}_{}.png".format(num, i) for i in range(4)],
+    } for num in range(20)]
+    return json.dumps({"retcode": 0, "message": "OK", "data": {"list": goods, "total": 20}},
+                      ensure_ascii=False).encode()
+
+
+def measure(name: str, func: Callable, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"    {name}: {elapsed * 1000:.3f} ms")
+
+
+def compare(title: str, content: bytes, repeat: int):
+    print(f"{title} ({len(content) / 1024:.1f} KiB):")
+    data = json.loads(content)
+    measure("json 解析", lambda: json.loads(content), repeat)
+    measure("json 编码", lambda: json.dumps(data, ensure_ascii=False, separators=(",", ":")), repeat)
+    if orjson is not None:
+        measure("orjson 解析", lambda: orjson.loads(content), repeat)
+        measure("orjson 编码", lambda: orjson.dumps(data), repeat)
+
+
+def main(count: int):
+    print(f"当前使用: {codec.BACKEND}")
+    if orjson is None:
+        print("未安装 orjson，只测试标准库 json (pip install orjson)")
+    compare(f"userdata.json ({count} 个QQ用户)", sample_userdata(count).encode(), 20)
+    compare("商品列表(一页)", sample_good_list(), 2000)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
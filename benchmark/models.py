@@ -0,0 +1,75 @@
+"""
+### 账户数据模型基准测试
+
+测量从用户数据dict读取 `UserAccount` 的耗时，以及内存中保存大量 `UserAccount` 对象时每个账户占用的内存
+
+用法: `python benchmark/models.py [账户数]`
+"""
+import json
+import sys
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+import nonebot
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+nonebot.init()
+nonebot.load_plugin("nonebot_plugin_apscheduler")
+nonebot.load_plugin("nonebot_plugin_mystool")
+
+from nonebot_plugin_mystool.data import UserAccount, migrate_user  # noqa: E402
+
+
+def sample_account(num: int) -> dict:
+    """
+    生成一个包含地址、兑换计划的账户数据
+    """
+    return {
+        "name": None,
+        "phone": 13800000000 + num,
+        "cookie": {"stuid": str(num), "stoken": uuid.uuid4().hex, "cookie_token": uuid.uuid4().hex},
+        "gameUID": {"ys": str(100000000 + num), "bh3": None, "bh2": None, "wd": None},
+        "xrpcDeviceID": str(uuid.uuid4()).upper(),
+        "xrpcDeviceID_2": str(uuid.uuid4()).upper(),
+        "address": {
+            "id": str(num), "province_name": "广东省", "city_name": "广州市", "county_name": "天河区",
+            "addr_ext": "某街道某号", "connect_areacode": "+86", "connect_mobile": "138****0000",
+            "connect_name": "张三", "is_default": True, "status": 1, "province": "44", "city": "4401",
+            "county": "440106", "country": 1
+        },
+        "bbsUID": str(num),
+        "mybMission": True,
+        "gameSign": True,
+        "exchange": [["2022010000" + str(num % 100), str(100000000 + num)]],
+        "platform": "ios",
+        "missionGame": ["ys", "bh3"]
+    }
+
+
+def main(count: int):
+    # 模拟从文件读入：每个字符串都是独立的对象
+    text = json.dumps({"accounts": [sample_account(num) for num in range(count)]})
+    user = json.loads(text)
+    migrate_user(user)
+
+    start = time.perf_counter()
+    for raw in user["accounts"]:
+        UserAccount(raw)
+    elapsed = time.perf_counter() - start
+    print(f"读取 {count} 个账户: {elapsed * 1000:.1f} ms ({elapsed / count * 1e6:.2f} µs/个)")
+
+    # 只统计释放原始数据后账户对象仍然占用的内存
+    del user
+    tracemalloc.start()
+    user = json.loads(text)
+    accounts = [UserAccount(raw) for raw in user["accounts"]]
+    del user
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"保存 {len(accounts)} 个账户对象: {current / 1024 / 1024:.2f} MiB ({current / count:.0f} 字节/个)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -39,7 +39,7 @@ async def check_friend_list():
     """
     bot: Bot = get_bot()
     friend_list = await bot.get_friend_list()
-    user_list = UserData.read_all().keys()
+    user_list = UserData.read_qq_all()
     for user in user_list:
         if user not in str(friend_list):
             UserData.del_user(user)
@@ -5,8 +5,6 @@ import asyncio
 import traceback
 from typing import List, Literal, Union
 
-import httpx
-import tenacity
 from nonebot import on_command, get_driver
 from nonebot.adapters.onebot.v11 import PrivateMessageEvent
 from nonebot.adapters.onebot.v11.message import Message
@@ -16,7 +14,9 @@ from nonebot.params import Arg, ArgPlainText, T_State
 
 from .config import mysTool_config as conf
 from .data import Address, UserAccount, UserData
-from .utils import NtpTime, check_login, custom_attempt_times, logger
+from .retry import request_retrying
+from .session import AccountSession
+from .utils import ApiResponse, NtpTime, logger
 
 HEADERS = {
     "Host": "api-takumi.mihoyo.com",
@@ -46,21 +46,19 @@ async def get(account: UserAccount, retry: bool = True) -> Union[List[Address],
     - 若返回 `-3` 说明请求失败
     """
     address_list = []
-    headers = HEADERS.copy()
-    headers["x-rpc-device_id"] = account.deviceID
     try:
-        async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+        async for attempt in request_retrying(retry, reraise=True):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL.format(
-                        round(NtpTime.time() * 1000)), headers=headers, cookies=account.cookie, timeout=conf.TIME_OUT)
-                    if not check_login(res.text):
-                        logger.info(conf.LOG_HEAD +
-                                    "获取地址数据 - 用户 {} 登录失效".format(account.phone))
-                        logger.debug(conf.LOG_HEAD +
-                                     "网络请求返回: {}".format(res.text))
-                        return -1
-                for address in res.json()["data"]["list"]:
+                res = await AccountSession.of(account).get(URL.format(
+                    round(NtpTime.time() * 1000)), headers=HEADERS, device="deviceID", timeout=conf.TIME_OUT)
+                api_res = ApiResponse(res)
+                if api_res.login_expired:
+                    logger.info(conf.LOG_HEAD +
+                                "获取地址数据 - 用户 {} 登录失效".format(account.phone))
+                    logger.debug(conf.LOG_HEAD +
+                                 "网络请求返回: {}".format(res.text))
+                    return -1
+                for address in api_res.data["list"]:
                     address_list.append(Address(address))
     except KeyError:
         logger.error(conf.LOG_HEAD + "获取地址数据 - 服务器没有正确返回")
@@ -105,13 +103,10 @@ async def _(event: PrivateMessageEvent, matcher: Matcher, state: T_State, phone=
         phone = phone.extract_plain_text().strip()
     if phone == '退出':
         await get_address.finish('🚪已成功退出')
-    user_account = state['user_account']
     qq_account = state['qq_account']
-    phones = [str(user_account[i].phone) for i in range(len(user_account))]
-    if phone in phones:
-        account = UserData.read_account(qq_account, int(phone))
-    else:
-        get_address.reject('⚠️您发送的账号不在以上账号内，请重新发送')
+    account = UserData.read_account(qq_account, int(phone)) if phone.isdigit() else None
+    if account is None:
+        await get_address.reject('⚠️您发送的账号不在以上账号内，请重新发送')
     state['account'] = account
 
     state['address_list']: List[Address] = await get(account)
@@ -144,9 +139,15 @@ async def _(event: PrivateMessageEvent, state: T_State, address_id=ArgPlainText(
     result_address = list(
         filter(lambda address: address.addressID == address_id, state['address_list']))
     if result_address:
-        account: UserAccount = state["account"]
-        account.address = result_address[0]
-        UserData.set_account(account, state['qq_account'], account.phone)
-        await get_address.finish("🎉已成功设置账户 {} 的地址".format(account.phone))
+        phone = state["account"].phone
+        async with UserData.transaction():
+            # 重新读取账户数据，避免覆盖对话期间做出的其他修改
+            account = UserData.read_account(state['qq_account'], phone)
+            if account is not None:
+                account.address = result_address[0]
+                UserData.set_account(account, state['qq_account'], phone)
+        if account is None:
+            await get_address.finish("⚠️账户不存在，请重新选择")
+        await get_address.finish("🎉已成功设置账户 {} 的地址".format(phone))
     else:
         await get_address.reject("⚠️您发送的地址ID与查询结果不匹配，请重新发送")
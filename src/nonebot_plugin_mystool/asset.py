@@ -0,0 +1,232 @@
+"""
+### 图片等资源文件的本地缓存相关
+"""
+import asyncio
+import hashlib
+import os
+import time
+import traceback
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Union
+
+from .circuitBreaker import untrack_rejections
+from .codec import dumps, loads
+from .config import PATH
+from .config import mysTool_config as conf
+from .httpClient import get_client
+from .retry import request_retrying
+from .utils import logger
+
+ASSET_PATH = PATH / "assets"
+'''资源文件缓存目录'''
+CHUNK_SIZE = 64 * 1024
+'''下载时每次写入的大小'''
+
+
+class AssetCache:
+    """
+    资源文件(商品图片、签到奖励图片等)的本地缓存，所有用户共用
+
+    - 以URL的哈希值作为文件名，保存在 `ASSET_PATH` 下，同时保存一个记录 `ETag` 等信息的 `.meta` 文件
+    - 下载时直接写入文件，不在内存中保存完整内容
+    - 所有文件读写都在线程池中进行，不阻塞事件循环
+    - 超过 `ASSET_REVALIDATE_INTERVAL` 秒未检查的文件，使用前会带上 `If-None-Match` / `If-Modified-Since` 向服务器确认是否更新
+    - 总大小超过 `ASSET_CACHE_MAX_SIZE` 时，删除最久未使用的文件
+    """
+
+    def __init__(self, path: Path = ASSET_PATH, max_size: int = None) -> None:
+        self.path = path
+        '''缓存目录'''
+        self.max_size = max_size if max_size is not None else conf.ASSET_CACHE_MAX_SIZE
+        '''缓存的最大占用空间(字节)'''
+        self.__entries: "Union[OrderedDict[str, int], None]" = None
+        '''缓存文件及其大小，按最近使用时间排序(最久未使用的在前)'''
+        self.__downloading: Dict[str, "asyncio.Task[Union[Path, None]]"] = {}
+
+    @staticmethod
+    def key_of(url: str) -> str:
+        """
+        获取URL对应的缓存文件名
+
+        参数:
+            `url`: 资源文件URL
+        """
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    @staticmethod
+    async def __run(func, *args):
+        """
+        在线程池中执行文件操作，避免阻塞事件循环
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def __scan(self) -> "OrderedDict[str, int]":
+        os.makedirs(self.path, exist_ok=True)
+        files = [entry for entry in os.scandir(self.path)
+                 if entry.is_file() and "." not in entry.name]
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        return OrderedDict((entry.name, entry.stat().st_size) for entry in files)
+
+    async def __entries_loaded(self) -> "OrderedDict[str, int]":
+        if self.__entries is None:
+            entries = await self.__run(self.__scan)
+            # 等待期间可能已被其他调用读取
+            if self.__entries is None:
+                self.__entries = entries
+        return self.__entries
+
+    def __read_meta(self, key: str) -> dict:
+        try:
+            with open(self.path / (key + ".meta"), "rb") as fp:
+                return loads(fp.read())
+        except (OSError, ValueError):
+            return {}
+
+    def __write_meta(self, key: str, meta: dict):
+        with open(self.path / (key + ".meta"), "w", encoding="utf-8") as fp:
+            fp.write(dumps(meta))
+
+    def __utime(self, key: str):
+        try:
+            os.utime(self.path / key)
+        except OSError:
+            pass
+
+    def __remove_files(self, *names: str):
+        for name in names:
+            try:
+                os.remove(self.path / name)
+            except FileNotFoundError:
+                pass
+
+    async def __touch(self, key: str):
+        entries = await self.__entries_loaded()
+        # 等待期间可能已被其他下载任务清理
+        if key in entries:
+            entries.move_to_end(key)
+            await self.__run(self.__utime, key)
+
+    async def __evict(self):
+        entries = await self.__entries_loaded()
+        removed = []
+        total = sum(entries.values())
+        # 至少保留最近使用的一个文件，正在下载(或确认是否更新)的文件也不删除
+        for key in list(entries)[:-1]:
+            if total <= self.max_size:
+                break
+            if key in self.__downloading:
+                continue
+            size = entries.pop(key)
+            removed += [key, key + ".meta"]
+            total -= size
+        if removed:
+            await self.__run(self.__remove_files, *removed)
+
+    async def __download(self, url: str, retry: bool) -> Union[Path, None]:
+        # 下载在独立的任务中进行，下载失败不影响调用方的任务结果
+        untrack_rejections()
+        key = self.key_of(url)
+        file = self.path / key
+        entries = await self.__entries_loaded()
+        meta = await self.__run(self.__read_meta, key) if key in entries else {}
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        temp_file = self.path / (key + ".tmp")
+        try:
+            async for attempt in request_retrying(retry, reraise=True):
+                with attempt:
+                    while True:
+                        async with get_client(url).stream("GET", url, headers=headers,
+                                                          timeout=conf.TIME_OUT, follow_redirects=True) as res:
+                            if res.status_code == 304:
+                                if key in entries and await self.__run(os.path.isfile, file):
+                                    meta["checked_at"] = time.time()
+                                    await self.__run(self.__write_meta, key, meta)
+                                    await self.__touch(key)
+                                    return file
+                                if headers:
+                                    # 本地文件已不存在，不带条件重新下载
+                                    headers = {}
+                                    continue
+                            res.raise_for_status()
+                            size = 0
+                            fp = await self.__run(open, temp_file, "wb")
+                            try:
+                                async for chunk in res.aiter_bytes(CHUNK_SIZE):
+                                    await self.__run(fp.write, chunk)
+                                    size += len(chunk)
+                            finally:
+                                await self.__run(fp.close)
+                        break
+                    await self.__run(os.replace, temp_file, file)
+                    await self.__run(self.__write_meta, key, {
+                        "url": url,
+                        "etag": res.headers.get("ETag"),
+                        "last_modified": res.headers.get("Last-Modified"),
+                        "checked_at": time.time()
+                    })
+                    entries[key] = size
+                    await self.__touch(key)
+                    await self.__evict()
+                    return file
+        except:
+            logger.error(conf.LOG_HEAD + "下载文件 - {} 失败".format(url))
+            logger.debug(conf.LOG_HEAD + traceback.format_exc())
+            await self.__run(self.__remove_files, key + ".tmp")
+            if key in entries:
+                # 更新失败时仍使用旧文件
+                await self.__touch(key)
+                return file
+            return None
+
+    async def get(self, url: str, retry: bool = True) -> Union[Path, None]:
+        """
+        获取资源文件的本地缓存路径，若下载失败且没有缓存则返回`None`
+
+        同时请求的相同URL只会下载一次
+
+        参数:
+            `url`: 资源文件URL
+            `retry`: 是否允许重试
+        """
+        key = self.key_of(url)
+        entries = await self.__entries_loaded()
+        if key in entries:
+            meta = await self.__run(self.__read_meta, key)
+            if time.time() - meta.get("checked_at", 0) < conf.ASSET_REVALIDATE_INTERVAL:
+                await self.__touch(key)
+                return self.path / key
+        task = self.__downloading.get(key)
+        if task is None:
+            task = self.__downloading[key] = asyncio.create_task(self.__download(url, retry))
+            task.add_done_callback(lambda _: self.__downloading.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def read(self, url: str, retry: bool = True) -> Union[bytes, None]:
+        """
+        获取资源文件的内容(在线程池中读取缓存文件)，若下载失败且没有缓存则返回`None`
+
+        发送图片时应使用文件内容而不是本地路径：OneBot实现可能运行在其他主机上，且缓存文件随时可能被清理
+
+        参数:
+            `url`: 资源文件URL
+            `retry`: 是否允许重试
+        """
+        for _ in range(2):
+            file = await self.get(url, retry)
+            if file is None:
+                return None
+            try:
+                return await self.__run(file.read_bytes)
+            except FileNotFoundError:
+                # 读取前文件已被清理，重新获取
+                (await self.__entries_loaded()).pop(self.key_of(url), None)
+        return None
+
+
+asset_cache = AssetCache()
+'''所有用户共用的资源文件缓存'''
@@ -1,18 +1,25 @@
 """
 ### 米游社其他API
 """
+import asyncio
+import os
 import traceback
-from typing import Dict, List, Literal, NewType, Tuple, Union
+from typing import Dict, List, Literal, NewType, Set, Tuple, Union
 
-import httpx
 import nonebot
-import tenacity
 from nonebot.log import logger
+from nonebot_plugin_apscheduler import scheduler
 
+from .cache import game_record_cache, public_cache
+from .codec import dumps, loads
+from .config import PATH
 from .config import mysTool_config as conf
 from .data import UserAccount
-from .utils import (check_login, custom_attempt_times, generateDeviceID,
-                    generateDS, logger)
+from .httpClient import shared_get
+from .retry import request_retrying
+from .session import AccountSession
+from .storage import write_durably
+from .utils import ApiResponse, generateDeviceID, generateDS, logger
 
 URL_ACTION_TICKET = "https://api-takumi.mihoyo.com/auth/api/getActionTicketBySToken?action_type=game_role&stoken={stoken}&uid={bbs_uid}"
 URL_GAME_RECORD = "https://api-takumi-record.mihoyo.com/game_record/card/wapi/getGameRecordCard?uid={}"
@@ -21,6 +28,11 @@ URL_MYB = "https://api-takumi.mihoyo.com/common/homutreasure/v1/web/user/point?a
 URL_DEVICE_LOGIN = "https://bbs-api.mihoyo.com/apihub/api/deviceLogin"
 URL_DEVICE_SAVE = "https://bbs-api.mihoyo.com/apihub/api/saveDevice"
 
+GAME_LIST_PATH = PATH / "games.json"
+'''游戏ID与缩写和全称对应关系的快照'''
+GAME_LIST_VERSION = 1
+'''快照的数据格式版本，版本不同的快照不会被读取'''
+
 HEADERS_ACTION_TICKET = {
     "Host": "api-takumi.mihoyo.com",
     "x-rpc-device_model": conf.device.X_RPC_DEVICE_MODEL_MOBILE,
@@ -167,6 +179,61 @@ class GameInfo:
     游戏ID(gameID)与缩写和全称的对应关系
     >>> {游戏ID, (缩写, 全称)}
     '''
+    ABBR_TO_GAME_ID: Dict[Abbr, int] = {}
+    '''游戏缩写与游戏ID的对应关系 `{缩写: 游戏ID}`'''
+    ABBR_TO_NAME: Dict[Abbr, Full_Name] = {}
+    '''游戏缩写与全称的对应关系 `{缩写: 全称}`'''
+    NAME_TO_ABBR: Dict[Full_Name, Abbr] = {}
+    '''游戏全称与缩写的对应关系 `{全称: 缩写}`'''
+    KNOWN_ABBR: Dict[Full_Name, Abbr] = {
+        "原神": "ys",
+        "崩坏3": "bh3",
+        "崩坏学园2": "bh2",
+        "未定事件簿": "wd",
+        "大别野": "bbs",
+        "崩坏：星穹铁道": "xq",
+        "绝区零": "jql"
+    }
+    '''支持的游戏全称与缩写的对应关系'''
+    DEFAULT_GAMES: List[Tuple[int, Abbr, Full_Name]] = [
+        (1, "bh3", "崩坏3"),
+        (2, "ys", "原神"),
+        (3, "bh2", "崩坏学园2"),
+        (4, "wd", "未定事件簿"),
+        (5, "bbs", "大别野"),
+        (6, "xq", "崩坏：星穹铁道"),
+        (8, "jql", "绝区零")
+    ]
+    '''没有快照且获取游戏列表失败时使用的默认对应关系 `[(游戏ID, 缩写, 全称)]`'''
+
+    @classmethod
+    def set_games(cls, games: List[Tuple[int, Abbr, Full_Name]]):
+        """
+        设置游戏ID与缩写和全称的对应关系(替换原有数据)
+
+        参数:
+            `games`: 游戏列表 `[(游戏ID, 缩写, 全称)]`
+        """
+        abbr_to_id = {}
+        for gameID, abbr, name in games:
+            abbr_to_id.setdefault(gameID, (abbr, name))
+        # 原地更新，已经引用这些字典的地方也能得到新数据
+        cls.ABBR_TO_ID.clear()
+        cls.ABBR_TO_ID.update(abbr_to_id)
+        cls.ABBR_TO_GAME_ID.clear()
+        cls.ABBR_TO_NAME.clear()
+        cls.NAME_TO_ABBR.clear()
+        for gameID, (abbr, name) in abbr_to_id.items():
+            cls.ABBR_TO_GAME_ID.setdefault(abbr, gameID)
+            cls.ABBR_TO_NAME.setdefault(abbr, name)
+            cls.NAME_TO_ABBR.setdefault(name, abbr)
+
+    @classmethod
+    def games(cls) -> List[Tuple[int, Abbr, Full_Name]]:
+        """
+        获取游戏ID与缩写和全称的对应关系 `[(游戏ID, 缩写, 全称)]`
+        """
+        return [(gameID, abbr, name) for gameID, (abbr, name) in cls.ABBR_TO_ID.items()]
 
     def __init__(self, gameInfo_dict: dict) -> None:
         self.gameInfo_dict = gameInfo_dict
@@ -234,19 +301,17 @@ async def get_action_ticket(account: UserAccount, retry: bool = True) -> Union[s
     - 若返回 `-2` 说明服务器没有正确返回
     - 若返回 `-3` 说明请求失败
     """
-    headers = HEADERS_ACTION_TICKET.copy()
-    headers["DS"] = generateDS()
     try:
-        async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+        async for attempt in request_retrying(retry, reraise=True):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_ACTION_TICKET.format(stoken=account.cookie["stoken"], bbs_uid=account.bbsUID), headers=headers, cookies=account.cookie, timeout=conf.TIME_OUT)
-                if not check_login(res.text):
+                res = await AccountSession.of(account).get(URL_ACTION_TICKET.format(stoken=account.cookie["stoken"], bbs_uid=account.bbsUID), headers=HEADERS_ACTION_TICKET, ds="ios", timeout=conf.TIME_OUT)
+                api_res = ApiResponse(res)
+                if api_res.login_expired:
                     logger.info(conf.LOG_HEAD +
                                 "获取ActionTicket - 用户 {} 登录失效".format(account.phone))
                     logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
                     return -1
-                return res.json()["data"]["ticket"]
+                return api_res.data["ticket"]
     except KeyError:
         logger.error(conf.LOG_HEAD + "获取ActionTicket - 服务器没有正确返回")
         logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
@@ -262,6 +327,8 @@ async def get_game_record(account: UserAccount, retry: bool = True) -> Union[Lis
     """
     获取用户绑定的游戏账户信息，返回一个GameRecord对象的列表
 
+    结果会按米游社UID缓存 `CACHE_TTL_GAME_RECORD` 秒，登录失效或重新登录时清除
+
     参数:
         `account`: 用户账户数据
         `retry`: 是否允许重试
@@ -270,19 +337,24 @@ async def get_game_record(account: UserAccount, retry: bool = True) -> Union[Lis
     - 若返回 `-2` 说明服务器没有正确返回
     - 若返回 `-3` 说明请求失败
     """
+    cached = game_record_cache.get(account.bbsUID)
+    if cached is not None:
+        return list(cached)
     record_list = []
     try:
-        async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+        async for attempt in request_retrying(retry, reraise=True):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_GAME_RECORD.format(account.bbsUID), headers=HEADERS_GAME_RECORD, cookies=account.cookie, timeout=conf.TIME_OUT)
-                if not check_login(res.text):
+                res = await AccountSession.of(account).get(URL_GAME_RECORD.format(account.bbsUID), headers=HEADERS_GAME_RECORD, timeout=conf.TIME_OUT)
+                api_res = ApiResponse(res)
+                if api_res.login_expired:
                     logger.info(conf.LOG_HEAD +
                                 "获取用户游戏数据 - 用户 {} 登录失效".format(account.phone))
                     logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
+                    game_record_cache.invalidate(account.bbsUID)
                     return -1
-                for record in res.json()["data"]["list"]:
+                for record in api_res.data["list"]:
                     record_list.append(GameRecord(record))
+                game_record_cache.set(account.bbsUID, tuple(record_list))
                 return record_list
     except KeyError:
         logger.error(conf.LOG_HEAD + "获取用户游戏数据 - 服务器没有正确返回")
@@ -295,23 +367,30 @@ async def get_game_record(account: UserAccount, retry: bool = True) -> Union[Lis
         return -3
 
 
-async def get_game_list(retry: bool = True) -> Union[List[GameInfo], None]:
+async def get_game_list(retry: bool = True, refresh: bool = False) -> Union[List[GameInfo], None]:
     """
     获取米哈游游戏的详细信息，若返回`None`说明获取失败
 
+    游戏信息与用户无关，结果缓存 `CACHE_TTL_PUBLIC` 秒
+
     参数:
         `retry`: 是否允许重试
+        `refresh`: 是否忽略缓存重新获取
     """
+    cached = None if refresh else public_cache.get(("game_list",))
+    if cached is not None:
+        return list(cached)
     headers = HEADERS_GAME_LIST.copy()
     headers["DS"] = generateDS()
     info_list = []
     try:
-        async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+        async for attempt in request_retrying(retry, reraise=True):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_GAME_LIST, headers=headers, timeout=conf.TIME_OUT)
-                for info in res.json()["data"]["list"]:
+                res = await shared_get(URL_GAME_LIST, headers=headers, timeout=conf.TIME_OUT)
+                api_res = ApiResponse(res)
+                for info in api_res.data["list"]:
                     info_list.append(GameInfo(info))
+                public_cache.set(("game_list",), tuple(info_list))
                 return info_list
     except KeyError:
         logger.error(conf.LOG_HEAD + "获取游戏信息 - 服务器没有正确返回")
@@ -335,16 +414,16 @@ async def get_user_myb(account: UserAccount, retry: bool = True) -> Union[int, L
     - 若返回 `-3` 说明请求失败
     """
     try:
-        async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+        async for attempt in request_retrying(retry, reraise=True):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_MYB, headers=HEADERS_MYB, cookies=account.cookie, timeout=conf.TIME_OUT)
-                if not check_login(res.text):
+                res = await AccountSession.of(account).get(URL_MYB, headers=HEADERS_MYB, timeout=conf.TIME_OUT)
+                api_res = ApiResponse(res)
+                if api_res.login_expired:
                     logger.info(conf.LOG_HEAD +
                                 "获取用户米游币 - 用户 {} 登录失效".format(account.phone))
                     logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
                     return -1
-                return int(res.json()["data"]["points"])
+                return int(api_res.data["points"])
     except KeyError and ValueError:
         logger.error(conf.LOG_HEAD + "获取用户米游币 - 服务器没有正确返回")
         logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
@@ -377,20 +456,17 @@ async def device_login(account: UserAccount, retry: bool = True) -> Literal[1, -
         "platform": "Android",
         "registration_id": "1a0018970a5c00e814d"
     }
-    headers = HEADERS_DEVICE.copy()
-    headers["DS"] = generateDS(data)
-    headers["x-rpc-device_id"] = account.deviceID_2
     try:
-        async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+        async for attempt in request_retrying(retry, reraise=True):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.post(URL_DEVICE_LOGIN, headers=headers, json=data, cookies=account.cookie, timeout=conf.TIME_OUT)
-                if not check_login(res.text):
+                res = await AccountSession.of(account).post(URL_DEVICE_LOGIN, headers=HEADERS_DEVICE, device="deviceID_2", ds="body", json=data, timeout=conf.TIME_OUT)
+                api_res = ApiResponse(res)
+                if api_res.login_expired:
                     logger.info(conf.LOG_HEAD +
                                 "设备登录 - 用户 {} 登录失效".format(account.phone))
                     logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
                     return -1
-                if res.json()["message"] != "OK":
+                if api_res.message != "OK":
                     raise ValueError
                 else:
                     return 1
@@ -426,20 +502,17 @@ async def device_save(account: UserAccount, retry: bool = True) -> Literal[1, -1
         "platform": "Android",
         "registration_id": "1a0018970a5c00e814d"
     }
-    headers = HEADERS_DEVICE.copy()
-    headers["DS"] = generateDS(data)
-    headers["x-rpc-device_id"] = account.deviceID_2
     try:
-        async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+        async for attempt in request_retrying(retry, reraise=True):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.post(URL_DEVICE_SAVE, headers=headers, json=data, cookies=account.cookie, timeout=conf.TIME_OUT)
-                if not check_login(res.text):
+                res = await AccountSession.of(account).post(URL_DEVICE_SAVE, headers=HEADERS_DEVICE, device="deviceID_2", ds="body", json=data, timeout=conf.TIME_OUT)
+                api_res = ApiResponse(res)
+                if api_res.login_expired:
                     logger.info(conf.LOG_HEAD +
                                 "设备保存 - 用户 {} 登录失效".format(account.phone))
                     logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
                     return -1
-                if res.json()["message"] != "OK":
+                if api_res.message != "OK":
                     raise ValueError
                 else:
                     return 1
@@ -456,27 +529,73 @@ async def device_save(account: UserAccount, retry: bool = True) -> Literal[1, -1
 
 driver = nonebot.get_driver()
 
+refresh_tasks: Set["asyncio.Task[None]"] = set()
+'''正在后台进行的游戏列表更新任务(保存引用，避免任务被回收)'''
+
+
+def load_game_list() -> bool:
+    """
+    从快照读取游戏ID与缩写和全称的对应关系，返回是否读取成功
+    """
+    try:
+        if not os.path.isfile(GAME_LIST_PATH):
+            return False
+        with open(GAME_LIST_PATH, "rb") as fp:
+            snapshot = loads(fp.read())
+        if snapshot.get("version") != GAME_LIST_VERSION:
+            return False
+        GameInfo.set_games([tuple(game) for game in snapshot["games"]])
+        return True
+    except:
+        logger.error(conf.LOG_HEAD + "读取游戏信息快照失败")
+        logger.debug(conf.LOG_HEAD + traceback.format_exc())
+        return False
+
+
+def save_game_list():
+    """
+    保存游戏ID与缩写和全称的对应关系的快照
+    """
+    try:
+        write_durably(GAME_LIST_PATH, dumps({"version": GAME_LIST_VERSION, "games": GameInfo.games()}))
+    except:
+        logger.error(conf.LOG_HEAD + "保存游戏信息快照失败")
+        logger.debug(conf.LOG_HEAD + traceback.format_exc())
+
+
+async def refresh_game_list():
+    """
+    获取游戏列表，更新游戏ID与缩写和全称的对应关系，获取失败时保留原有数据
+    """
+    game_list = await get_game_list(refresh=True)
+    if game_list is None:
+        return
+    games = [(game.gameID, GameInfo.KNOWN_ABBR[game.name], game.name)
+             for game in game_list if game.name in GameInfo.KNOWN_ABBR]
+    if not games:
+        return
+    GameInfo.set_games(games)
+    # 写入时会同步到磁盘，在线程池中进行，避免阻塞事件循环
+    await asyncio.get_running_loop().run_in_executor(None, save_game_list)
+
 
 @driver.on_startup
 async def set_game_list():
     """
     设置游戏ID(gameID)与缩写和全称的对应关系
+
+    先读取快照(没有快照时使用默认数据)，再在后台获取最新的游戏列表
     """
-    game_list = await get_game_list()
-    if game_list is None:
-        return
-    for game in game_list:
-        if game.name == "原神":
-            GameInfo.ABBR_TO_ID.setdefault(game.gameID, ("ys", game.name))
-        elif game.name == "崩坏3":
-            GameInfo.ABBR_TO_ID.setdefault(game.gameID, ("bh3", game.name))
-        elif game.name == "崩坏学园2":
-            GameInfo.ABBR_TO_ID.setdefault(game.gameID, ("bh2", game.name))
-        elif game.name == "未定事件簿":
-            GameInfo.ABBR_TO_ID.setdefault(game.gameID, ("wd", game.name))
-        elif game.name == "大别野":
-            GameInfo.ABBR_TO_ID.setdefault(game.gameID, ("bbs", game.name))
-        elif game.name == "崩坏：星穹铁道":
-            GameInfo.ABBR_TO_ID.setdefault(game.gameID, ("xq", game.name))
-        elif game.name == "绝区零":
-            GameInfo.ABBR_TO_ID.setdefault(game.gameID, ("jql", game.name))
+    if not load_game_list():
+        GameInfo.set_games(GameInfo.DEFAULT_GAMES)
+    task = asyncio.create_task(refresh_game_list())
+    refresh_tasks.add(task)
+    task.add_done_callback(refresh_tasks.discard)
+
+
+@scheduler.scheduled_job("interval", days=1, id="game_list_refresh")
+async def daily_refresh_game_list():
+    """
+    每日更新游戏ID与缩写和全称的对应关系
+    """
+    await refresh_game_list()
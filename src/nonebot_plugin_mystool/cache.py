@@ -0,0 +1,89 @@
+"""
+### 接口数据缓存相关
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Generic, Hashable, Tuple, TypeVar, Union
+
+from .config import mysTool_config as conf
+
+T = TypeVar("T")
+
+
+class TTLCache(Generic[T]):
+    """
+    带有效期的缓存，过期的数据在下次读取时移除
+
+    >>> cache: TTLCache[List[GameRecord]] = TTLCache(600)
+    >>> records = cache.get(account.bbsUID)
+    >>> if records is None:
+    >>>     records = cache.set(account.bbsUID, await ...)
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        '''默认有效期(秒)，不大于0时不缓存(写入时指定有效期也不缓存)'''
+        self.__data: Dict[Hashable, Tuple[float, T]] = {}
+
+    def get(self, key: Hashable) -> Union[T, None]:
+        """
+        读取缓存，不存在或已过期时返回 `None`
+
+        参数:
+            `key`: 缓存键
+        """
+        item = self.__data.get(key)
+        if item is None:
+            return None
+        expire_at, value = item
+        if time.monotonic() >= expire_at:
+            del self.__data[key]
+            return None
+        return value
+
+    def set(self, key: Hashable, value: T, ttl: float = None) -> T:
+        """
+        写入缓存，返回写入的值
+
+        参数:
+            `key`: 缓存键
+            `value`: 缓存的值
+            `ttl`: (可选)覆盖默认有效期(秒)
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if self.ttl > 0 and ttl > 0:
+            self.__data[key] = (time.monotonic() + ttl, value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        """
+        移除缓存
+
+        参数:
+            `key`: 缓存键
+        """
+        self.__data.pop(key, None)
+
+    def clear(self):
+        """
+        移除全部缓存
+        """
+        self.__data.clear()
+
+
+def until_next_month() -> float:
+    """
+    距离下个月开始(北京时间)的秒数，用于缓存按月更新的数据
+    """
+    now = datetime.now(timezone(timedelta(hours=8)))
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    return (next_month - now).total_seconds()
+
+
+game_record_cache: TTLCache[tuple] = TTLCache(conf.CACHE_TTL_GAME_RECORD)
+'''用户游戏数据(`GameRecord` 列表)的缓存 `{米游社UID: 游戏数据列表}`'''
+
+public_cache: TTLCache[tuple] = TTLCache(conf.CACHE_TTL_PUBLIC)
+'''与用户无关的公共数据(签到奖励、米游币任务列表、游戏列表)的缓存，所有用户共用'''
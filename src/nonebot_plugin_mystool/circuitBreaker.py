@@ -0,0 +1,214 @@
+"""
+### 网络请求熔断相关
+"""
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Literal, Set, Union
+from urllib.parse import urlsplit
+
+import httpx
+from nonebot.log import logger
+
+from .config import mysTool_config as conf
+
+
+class CircuitOpenError(httpx.TransportError):
+    """
+    接口已熔断，请求未发送
+    """
+
+
+class CircuitBreaker:
+    """
+    单个接口的熔断器
+
+    - `closed`: 正常请求，记录最近 `CIRCUIT_BREAKER_WINDOW` 次请求结果，失败率达到阈值时熔断
+    - `open`: 熔断中，请求直接失败，持续 `CIRCUIT_BREAKER_OPEN_TIME` 秒后进入 `half_open`
+    - `half_open`: 每次只放行一个探测请求，成功则恢复，失败则重新熔断
+    """
+
+    def __init__(self, endpoint: str) -> None:
+        self.endpoint = endpoint
+        '''接口(主机+路径)'''
+        self.state: Literal["closed", "open", "half_open"] = "closed"
+        '''熔断器状态'''
+        self.results: Deque[bool] = deque(maxlen=conf.CIRCUIT_BREAKER_WINDOW)
+        '''最近的请求结果(是否成功)'''
+        self.opened_at: float = 0
+        '''上次熔断的时间'''
+        self.probing = False
+        '''`half_open` 状态下是否已有探测请求在进行'''
+
+    def allow(self) -> bool:
+        """
+        返回是否允许发送请求
+        """
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < conf.CIRCUIT_BREAKER_OPEN_TIME:
+                return False
+            self.state = "half_open"
+            self.probing = False
+        if self.state == "half_open":
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def record(self, success: bool):
+        """
+        记录请求结果
+
+        参数:
+            `success`: 请求是否成功
+        """
+        if self.state == "half_open":
+            self.probing = False
+            if success:
+                logger.info(conf.LOG_HEAD + "网络请求 - 接口 {} 已恢复".format(self.endpoint))
+                self.state = "closed"
+                self.results.clear()
+            else:
+                self.__open()
+            return
+        self.results.append(success)
+        if self.state == "closed" and len(self.results) >= conf.CIRCUIT_BREAKER_MIN_REQUESTS:
+            failures = self.results.count(False)
+            if failures / len(self.results) >= conf.CIRCUIT_BREAKER_FAILURE_RATE:
+                self.__open()
+
+    def __open(self):
+        logger.warning(conf.LOG_HEAD + "网络请求 - 接口 {} 失败率过高，暂停请求 {} 秒".format(
+            self.endpoint, conf.CIRCUIT_BREAKER_OPEN_TIME))
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.results.clear()
+
+    @property
+    def is_open(self):
+        """
+        是否处于熔断中(尚未到可以探测恢复的时间)
+        """
+        return self.state == "open" and time.monotonic() - self.opened_at < conf.CIRCUIT_BREAKER_OPEN_TIME
+
+
+breakers: Dict[str, CircuitBreaker] = {}
+'''各接口的熔断器 `{接口: 熔断器}`'''
+
+exempt_endpoints: Set[str] = set()
+'''不经过熔断的接口(主机+路径)'''
+
+rejected_endpoints: ContextVar[Union[List[str], None]] = ContextVar("mystool_rejected_endpoints", default=None)
+'''当前任务中因熔断而被拒绝的接口，由 `track_rejections` 设置'''
+
+
+def endpoint_of(url: Union[str, httpx.URL]) -> str:
+    """
+    获取URL对应的接口(主机+路径，不含查询参数)
+
+    参数:
+        `url`: 请求URL
+    """
+    parts = urlsplit(str(url))
+    return parts.netloc + parts.path
+
+
+def exempt_from_circuit_breaker(url: str):
+    """
+    使某个接口的请求不经过熔断，用于预期会集中出现限流或服务器错误、且不能被提前拒绝的请求(如定时兑换)
+
+    参数:
+        `url`: 接口URL
+    """
+    exempt_endpoints.add(endpoint_of(url))
+
+
+def get_breaker(url: Union[str, httpx.URL]) -> CircuitBreaker:
+    """
+    获取URL对应接口的熔断器
+
+    参数:
+        `url`: 请求URL
+    """
+    endpoint = endpoint_of(url)
+    breaker = breakers.get(endpoint)
+    if breaker is None:
+        breaker = breakers[endpoint] = CircuitBreaker(endpoint)
+    return breaker
+
+
+def any_open() -> bool:
+    """
+    是否有接口正处于熔断中
+    """
+    return any(breaker.is_open for breaker in breakers.values())
+
+
+def track_rejections() -> List[str]:
+    """
+    开始记录当前上下文(及其中创建的任务)里因熔断被拒绝的请求，返回记录用的列表
+
+    >>> rejected = track_rejections()
+    >>> await perform(account)
+    >>> if rejected: # 任务受到熔断影响，需要稍后重新执行
+    """
+    rejected: List[str] = []
+    rejected_endpoints.set(rejected)
+    return rejected
+
+
+def rejection_count() -> int:
+    """
+    当前上下文中已记录的因熔断被拒绝的请求数(未开始记录时为0)，可用于判断某一步骤是否受到熔断影响
+
+    >>> before = rejection_count()
+    >>> await step()
+    >>> if rejection_count() > before: # 该步骤受到熔断影响
+    """
+    rejected = rejected_endpoints.get()
+    return len(rejected) if rejected is not None else 0
+
+
+def untrack_rejections():
+    """
+    在当前上下文(及其中创建的任务)中停止记录因熔断被拒绝的请求，
+    用于在任务中创建、但与任务结果无关的后台请求(如下载图片)
+    """
+    rejected_endpoints.set(None)
+
+
+class CircuitBreakerTransport(httpx.AsyncBaseTransport):
+    """
+    带熔断的传输层，包装实际发送请求的传输层(`exempt_endpoints` 中的接口不经过熔断)
+
+    网络错误、超时、限流(429)和服务器错误(5xx)计为失败
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport) -> None:
+        self.transport = transport
+        '''实际发送请求的传输层'''
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if endpoint_of(request.url) in exempt_endpoints:
+            return await self.transport.handle_async_request(request)
+        breaker = get_breaker(request.url)
+        if not breaker.allow():
+            rejected = rejected_endpoints.get()
+            if rejected is not None:
+                rejected.append(breaker.endpoint)
+            raise CircuitOpenError("接口 {} 已熔断".format(breaker.endpoint), request=request)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError:
+            breaker.record(False)
+            raise
+        except BaseException:
+            # 任务被取消等情况，不计入结果
+            if breaker.state == "half_open":
+                breaker.probing = False
+            raise
+        breaker.record(response.status_code != 429 and response.status_code < 500)
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -0,0 +1,54 @@
+"""
+### JSON编码解码相关
+
+安装了 orjson 时使用 orjson，否则使用标准库 json (可通过 pip install orjson 安装)
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+'''当前使用的JSON库'''
+
+JSONDecodeError = json.JSONDecodeError
+'''解析失败时抛出的异常(`orjson.JSONDecodeError` 也是它的子类)'''
+
+
+def loads(data: Union[str, bytes, bytearray]) -> Any:
+    """
+    解析JSON
+
+    参数:
+        `data`: JSON字符串或UTF-8编码的JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    """
+    编码为紧凑的JSON字符串(无空格，非ASCII字符不转义)
+
+    参数:
+        `obj`: 要编码的对象
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def dumps_compatible(obj: Any) -> str:
+    """
+    编码为JSON字符串，结果与标准库 `json.dumps(obj)` 的默认输出完全一致
+
+    用于需要与原格式逐字节一致的场合(如生成DS时的请求内容)，不使用 orjson
+
+    参数:
+        `obj`: 要编码的对象
+    """
+    return json.dumps(obj)
@@ -3,7 +3,7 @@
 """
 from datetime import time, timedelta
 from pathlib import Path
-from typing import TYPE_CHECKING, Tuple, Union
+from typing import TYPE_CHECKING, Literal, Tuple, Union
 
 from nonebot import get_driver
 from pydantic import BaseModel, Extra
@@ -100,6 +100,22 @@ class Config(BaseModel, extra=Extra.ignore):
 
     MAX_USER: int = 10
     '''支持最多用户数'''
+    STORAGE: Literal["json", "journal", "sqlite", "sharded"] = "json"
+    '''
+    用户数据存储方式(`sqlite`、`sharded` 首次使用时会自动导入 userdata.json)
+    - `json`: 单个 userdata.json 文件
+    - `journal`: userdata.json 快照 + 追加写入的修改日志 userdata.journal
+    - `sqlite`: SQLite 数据库
+    - `sharded`: 每个QQ用户一个文件，按需读取
+    '''
+    USER_CACHE_SIZE: int = 100
+    '''按需读取的存储方式(`sharded`)下，内存中最多缓存的QQ用户数'''
+    JOURNAL_COMPACT_RECORDS: int = 500
+    '''`journal` 存储方式下，修改日志达到多少条记录时合并为新的快照'''
+    DATA_FLUSH_DELAY: float = 3
+    '''用户数据修改后延迟写入文件的时间(秒)，期间的多次修改会合并为一次写入'''
+    DATA_FLUSH_RETRY_MAX: float = 300
+    '''用户数据写入失败后重新写入的最长等待时间(秒)，每次失败等待时间翻倍'''
     ADD_FRIEND_ACCEPT: bool = True
     '''是否自动同意好友申请'''
 
@@ -122,11 +138,55 @@ class Config(BaseModel, extra=Extra.ignore):
     MAX_RETRY_TIMES: int = 5
     '''网络请求失败后最多重试次数'''
     SLEEP_TIME: float = 5
-    '''任务操作冷却时间(如米游币任务)'''
+    '''同一帐号两次任务操作(如签到、阅读、点赞)之间的最短间隔'''
+    RATE_LIMIT_ACTION: float = 2
+    '''所有帐号合计每秒最多执行的任务操作次数(为0则不限制)'''
+    RATE_LIMIT_HOST: float = 10
+    '''对每个主机每秒最多发起的网络请求数(为0则不限制)'''
+    TASK_CONCURRENCY: int = 5
+    '''每日自动任务同时执行的帐号数'''
+    READ_STREAM_ABORT: bool = False
+    '''米游币任务阅读文章时，确认阅读已被记录后是否立即断开连接(不再接收剩余内容，节省流量，但该连接无法复用，之后的请求需要重新建立连接)'''
     SLEEP_TIME_RETRY: float = 3
-    '''网络请求出错的重试冷却时间'''
+    '''网络请求出错的重试冷却时间(指数退避的基数，每次重试的冷却时间上限翻倍，并在其中随机取值)'''
+    SLEEP_TIME_RETRY_MAX: float = 30
+    '''网络请求出错的最长重试冷却时间'''
+    RETRY_BUDGET_RATIO: float = 0.1
+    '''重试请求最多占全部网络请求的比例'''
+    RETRY_BUDGET_MIN_PER_SECOND: float = 1
+    '''不论请求多少，每秒至少允许的重试次数'''
+    RETRY_BUDGET_CAPACITY: float = 20
+    '''最多可累积的重试次数'''
+    CIRCUIT_BREAKER_WINDOW: int = 20
+    '''熔断器统计每个接口最近多少次请求的结果'''
+    CIRCUIT_BREAKER_MIN_REQUESTS: int = 10
+    '''统计的请求数至少达到多少时才会熔断'''
+    CIRCUIT_BREAKER_FAILURE_RATE: float = 0.5
+    '''接口请求失败率达到多少时熔断'''
+    CIRCUIT_BREAKER_OPEN_TIME: float = 60
+    '''熔断后暂停请求该接口的时间(秒)，之后放行一个请求探测是否恢复'''
+    CIRCUIT_BREAKER_RETRY_PASSES: int = 3
+    '''每日自动任务中，因熔断而搁置的帐号最多再重新执行几轮'''
     TIME_OUT: Union[float, None] = None
     '''网络请求超时时间'''
+    HTTP_MAX_CONNECTIONS: int = 100
+    '''网络请求客户端对每个主机的最大连接数'''
+    HTTP_MAX_KEEPALIVE: int = 20
+    '''网络请求客户端对每个主机最多保持的空闲连接数'''
+    HTTP_KEEPALIVE_EXPIRY: float = 30
+    '''空闲连接的保持时间(秒)'''
+    HTTP2: bool = False
+    '''是否启用 HTTP/2 (需安装 h2: pip install httpx[http2])'''
+    CACHE_TTL_GAME_RECORD: float = 600
+    '''用户游戏数据(绑定的游戏账户)的缓存时间(秒)，登录失效或重新登录时清除，设为0则不缓存'''
+    CACHE_TTL_PUBLIC: float = 86400
+    '''与用户无关的公共数据(米游币任务列表、游戏列表)的缓存时间(秒)，签到奖励则缓存至当月月底，设为0则不缓存'''
+    ASSET_CACHE_MAX_SIZE: int = 64 * 1024 * 1024
+    '''图片等资源文件本地缓存的最大占用空间(字节)，超出时删除最久未使用的文件'''
+    ASSET_REVALIDATE_INTERVAL: float = 86400
+    '''资源文件缓存向服务器确认是否更新的间隔(秒)'''
+    GOOD_CATALOG_TTL: float = 600
+    '''米游币商品目录的更新间隔(秒)，过期后先使用旧数据，同时在后台更新'''
     GITHUB_PROXY: str = "https://ghproxy.com/"
     '''GitHub代理加速服务器(若为""空字符串则不启用)'''
 
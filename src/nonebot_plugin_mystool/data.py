@@ -1,95 +1,89 @@
 """
 ### 用户数据相关
 """
-from copy import deepcopy
-import json
+import asyncio
 import traceback
-from typing import Dict, List, Literal, Tuple, Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from copy import deepcopy
+from sys import intern
+from typing import (AsyncIterator, Dict, List, Literal, NamedTuple, Set, Tuple,
+                    Union)
 
 import nonebot
 import nonebot.log
+from nonebot.adapters import Event
 from nonebot.log import logger
+from nonebot.matcher import Matcher
+from nonebot.message import run_preprocessor
 
-from .config import PATH
 from .config import mysTool_config as conf
+from .storage import Storage, create_storage
 from .utils import generateDeviceID, logger
 
-ENCODING = "utf-8"
-USERDATA_PATH = PATH / "userdata.json"
-
 driver = nonebot.get_driver()
 
 
 class Address:
     """
     地址数据
+
+    用到的字段单独保存，其余字段原样保存在 `extra` 中，写回时不会丢失
     """
+    KEYS = ("province_name", "city_name", "county_name", "addr_ext",
+            "connect_areacode", "connect_mobile", "connect_name", "id")
+    '''地址数据中用到的字段'''
+    __slots__ = ("province", "city", "county", "detail", "areacode", "mobile", "name", "addressID", "extra")
 
     def __init__(self, adress_dict: dict) -> None:
-        self.address_dict = adress_dict
-        try:
-            for func in dir(Address):
-                if func.startswith("__"):
-                    continue
-                getattr(self, func)
-        except KeyError:
+        if not all(key in adress_dict for key in self.KEYS):
             logger.error(conf.LOG_HEAD + "地址数据 - 初始化对象: dict数据不正确")
-            logger.debug(conf.LOG_HEAD + traceback.format_exc())
-
-    @property
-    def province(self) -> str:
-        """
-        省
-        """
-        return self.address_dict["province_name"]
-
-    @property
-    def city(self) -> str:
-        """
-        市
-        """
-        return self.address_dict["city_name"]
-
-    @property
-    def county(self) -> int:
-        """
-        区/县
-        """
-        return self.address_dict["county_name"]
-
-    @property
-    def detail(self) -> str:
-        """
-        详细地址
-        """
-        return self.address_dict["addr_ext"]
+            logger.debug(conf.LOG_HEAD + "缺少字段: {}".format(
+                [key for key in self.KEYS if key not in adress_dict]))
+        self.province: str = adress_dict.get("province_name")
+        '''省'''
+        self.city: str = adress_dict.get("city_name")
+        '''市'''
+        self.county: str = adress_dict.get("county_name")
+        '''区/县'''
+        self.detail: str = adress_dict.get("addr_ext")
+        '''详细地址'''
+        self.areacode: str = adress_dict.get("connect_areacode")
+        '''联系电话区号'''
+        self.mobile: str = adress_dict.get("connect_mobile")
+        '''联系电话号码'''
+        self.name: str = adress_dict.get("connect_name")
+        '''收货人姓名'''
+        self.addressID: str = adress_dict.get("id")
+        '''地址ID'''
+        self.extra: dict = {key: value for key, value in adress_dict.items() if key not in self.KEYS}
+        '''其他未用到的字段'''
 
     @property
     def phone(self) -> str:
         """
-        联系电话(包含区号)
+        联系电话(包含区号)，缺少的部分会被省略
         """
-        return self.address_dict["connect_areacode"] + " " + self.address_dict["connect_mobile"]
+        return " ".join(part for part in (self.areacode, self.mobile) if part)
 
     @property
-    def name(self) -> int:
+    def address_dict(self) -> dict:
         """
-        收货人姓名
+        地址数据dict(包含未用到的字段)
         """
-        return self.address_dict["connect_name"]
-
-    @property
-    def addressID(self) -> int:
-        """
-        地址ID
-        """
-        return self.address_dict["id"]
+        address_dict = dict(self.extra)
+        address_dict.update(zip(self.KEYS, (self.province, self.city, self.county, self.detail,
+                                            self.areacode, self.mobile, self.name, self.addressID)))
+        return address_dict
 
 
 class AccountUID:
     """
     米哈游游戏UID数据
     """
+    __slots__ = ("ys", "bh3", "bh2", "wd")
 
     def __init__(self) -> None:
         self.ys: str = None
@@ -112,12 +106,28 @@ class AccountUID:
         }
 
 
+class ExchangePlan(NamedTuple):
+    """
+    兑换计划，可直接与 `(商品ID, 游戏UID)` 元组比较
+    """
+    goodID: str
+    '''商品ID'''
+    gameUID: str
+    '''游戏UID'''
+
+
 class UserAccount:
     """
     用户的米哈游账户数据
     """
+    __slots__ = ("name", "phone", "cookie", "gameUID", "deviceID", "deviceID_2", "address", "bbsUID",
+                 "mybMission", "gameSign", "exchange", "platform", "missionGame")
 
-    def __init__(self) -> None:
+    def __init__(self, account: dict = None) -> None:
+        """
+        参数:
+            `account`: (可选)账户数据，传入时直接读取该数据(不会生成新的设备ID)
+        """
         self.name: str = None
         '''备注名'''
         self.phone: int = None
@@ -126,9 +136,9 @@ class UserAccount:
         '''Cookie'''
         self.gameUID: AccountUID = AccountUID()
         '''游戏UID'''
-        self.deviceID: str = generateDeviceID()
+        self.deviceID: str = generateDeviceID() if account is None else None
         '''设备 x-rpc-device_id'''
-        self.deviceID_2: str = generateDeviceID()
+        self.deviceID_2: str = generateDeviceID() if account is None else None
         '''设备第二个 x-rpc-device_id(可用于安卓设备)'''
         self.address: Address = None
         '''地址数据'''
@@ -138,36 +148,28 @@ class UserAccount:
         '''是否开启米游币任务计划'''
         self.gameSign: bool = True
         '''是否开启米游社游戏签到计划'''
-        self.exchange: List[Tuple[str, str]] = []
-        '''计划兑换的商品( 元组(商品ID, 游戏UID) )'''
+        self.exchange: List[ExchangePlan] = []
+        '''计划兑换的商品'''
         self.platform: Literal["ios", "android"] = "ios"
         '''设备平台'''
         self.missionGame: List[Literal["ys", "bh3",
                                        "bh2", "wd", "bbs", "xq", "jql"]] = ["ys"]
         '''在哪些板块执行米游币任务计划'''
+        if account is not None:
+            self.get(account)
 
     def get(self, account: dict):
-        # 适配旧版本的dict
-        sample = UserAccount().to_dict()
-        if account.keys() != sample.keys():
-            add = sample.keys() - account.keys()
-            remove = account.keys() - sample.keys()
-            for key in add:
-                account.setdefault(key, sample[key])
-            for key in remove:
-                account.pop(key)
-        sample = AccountUID().to_dict()
-        if account["gameUID"].keys() != sample.keys():
-            add = sample.keys() - account["gameUID"].keys()
-            remove = account["gameUID"].keys() - sample.keys()
-            for key in add:
-                account["gameUID"].setdefault(key, sample[key])
-            for key in remove:
-                account["gameUID"].pop(key)
+        """
+        读取账户数据(账户数据需已通过`migrate_user`迁移至最新格式)
 
+        参数:
+            `account`: 账户数据
+        """
         self.name: str = account["name"]
         self.phone: int = account["phone"]
-        self.cookie: dict[str, str] = account["cookie"]
+        self.cookie: Dict[str, str] = dict(
+            account["cookie"]) if account["cookie"] is not None else None
+        self.gameUID.get(account["gameUID"])
         self.deviceID: str = account["xrpcDeviceID"]
         self.deviceID_2: str = account["xrpcDeviceID_2"]
         self.address = Address(
@@ -175,20 +177,17 @@ class UserAccount:
         self.bbsUID: str = account["bbsUID"]
         self.mybMission: bool = account["mybMission"]
         self.gameSign: bool = account["gameSign"]
-        self.platform: Literal["ios", "android"] = account["platform"]
+        # 取值有限的字段使用驻留字符串，多个账户共用同一个字符串对象
+        self.platform: Literal["ios", "android"] = intern(account["platform"])
         self.missionGame: List[Literal["ys", "bh3", "bh2",
-                                       "wd", "bbs", "xq", "jql"]] = account["missionGame"]
-
-        exchange = []
-        for plan in account["exchange"]:
-            exchange.append(tuple(plan))
-        self.exchange: List[Tuple[str, str]] = exchange
+                                       "wd", "bbs", "xq", "jql"]] = [intern(game) for game in account["missionGame"]]
+        self.exchange: List[ExchangePlan] = [ExchangePlan(*plan) for plan in account["exchange"]]
 
     def to_dict(self) -> dict:
         data = {
             "name": self.name,
             "phone": self.phone,
-            "cookie": self.cookie,
+            "cookie": dict(self.cookie) if self.cookie is not None else None,
             "gameUID": self.gameUID.to_dict(),
             "xrpcDeviceID": self.deviceID,
             "xrpcDeviceID_2": self.deviceID_2,
@@ -196,32 +195,581 @@ class UserAccount:
             "bbsUID": self.bbsUID,
             "mybMission": self.mybMission,
             "gameSign": self.gameSign,
-            "exchange": self.exchange,
+            "exchange": [list(plan) for plan in self.exchange],
             "platform": self.platform,
-            "missionGame": self.missionGame
+            "missionGame": list(self.missionGame)
         }
         if isinstance(self.address, Address):
             data["address"] = self.address.address_dict
         return data
 
 
+SCHEMA_VERSION = 1
+'''当前的用户数据格式版本'''
+
+
+def migrate_account_v1(account: dict):
+    """
+    版本0 -> 版本1: 补全旧版本缺少的账户字段，移除已废弃的字段
+
+    参数:
+        `account`: 账户数据
+    """
+    sample = UserAccount().to_dict()
+    for key in sample.keys() - account.keys():
+        account[key] = sample[key]
+    for key in account.keys() - sample.keys():
+        account.pop(key)
+    if not isinstance(account["gameUID"], dict):
+        account["gameUID"] = sample["gameUID"]
+    for key in sample["gameUID"].keys() - account["gameUID"].keys():
+        account["gameUID"][key] = sample["gameUID"][key]
+    for key in account["gameUID"].keys() - sample["gameUID"].keys():
+        account["gameUID"].pop(key)
+
+
+MIGRATIONS = [migrate_account_v1]
+'''各版本的账户数据迁移函数，第`n`个函数将版本`n`的数据迁移至版本`n+1`'''
+
+
+def migrate_user(user: dict) -> bool:
+    """
+    将QQ用户数据迁移至最新格式，并记录格式版本`schema_version`。返回是否进行了迁移
+
+    参数:
+        `user`: QQ用户数据
+    """
+    version = user.get(UserData.OPTION_SCHEMA_VERSION, 0)
+    if version >= SCHEMA_VERSION:
+        return False
+    user.setdefault("accounts", [])
+    user.setdefault(UserData.OPTION_NOTICE, True)
+    for migrate in MIGRATIONS[version:]:
+        for account in user["accounts"]:
+            migrate(account)
+    user[UserData.OPTION_SCHEMA_VERSION] = SCHEMA_VERSION
+    return True
+
+
 class UserData:
     """
     用户数据相关
+
+    用户数据通过存储后端(见 `storage.py`)读写，读取后缓存在内存中，之后的读取都直接使用内存中的数据；
+    修改后不会立即写入，而是在 `DATA_FLUSH_DELAY` 秒后合并写入，关闭机器人时也会写入。
+    读入和写入都在专用的I/O线程中进行，且同一时间只有一个读写操作，不会阻塞事件循环
+
+    对于按需加载的存储后端(如按QQ分文件存储)，只有用到某个QQ用户时才会读取该用户的数据，
+    且内存中最多缓存 `USER_CACHE_SIZE` 个没有待写入修改的QQ用户
     """
     OPTION_NOTICE = "notice"
+    OPTION_SCHEMA_VERSION = "schema_version"
     USER_SAMPLE = {
         "accounts": [],
-        OPTION_NOTICE: True
+        OPTION_NOTICE: True,
+        OPTION_SCHEMA_VERSION: SCHEMA_VERSION
     }
     '''QQ用户数据样例'''
 
-    @staticmethod
-    def read_all() -> Dict[str, dict]:
+    __storage: Storage = None
+    '''用户数据存储后端'''
+    __users: "OrderedDict[str, dict]" = OrderedDict()
+    '''内存中已读取的QQ用户数据(按最近使用顺序排列)'''
+    __qq_set: Set[str] = set()
+    '''所有QQ用户的QQ号'''
+    __changed: Set[str] = set()
+    '''有尚未写入的修改的QQ号'''
+    __saving: Set[str] = set()
+    '''正在写入的QQ号(写入完成前不能从缓存中移除，否则会重新读入旧数据)'''
+    __account_index: Dict[str, Dict[Union[int, str], int]] = {}
+    '''内存中QQ用户的帐号索引 `{QQ号: {手机号或备注名: 帐号在列表中的位置}}`'''
+    __user_bbsUIDs: Dict[str, Set[str]] = {}
+    '''各QQ用户绑定的米游社UID'''
+    __bbsUID_index: Dict[str, Set[str]] = {}
+    '''米游社UID索引 `{米游社UID: {QQ号}}`'''
+    __flush_handle: asyncio.TimerHandle = None
+    '''延迟写入的定时器'''
+    __flush_task: asyncio.Task = None
+    '''正在进行的延迟写入任务'''
+    __save_failures: int = 0
+    '''连续写入失败的次数'''
+    __executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mystool-userdata")
+    '''用户数据读写专用的I/O线程'''
+    __io_lock: asyncio.Lock = None
+    '''读写锁，保证同一时间只有一个读写操作'''
+    __transaction_lock: asyncio.Lock = None
+    '''事务锁，同一时间只能有一个事务'''
+    __uncommitted: Set[str] = set()
+    '''正在进行的事务中修改过、尚未提交的QQ号(不写入，也不从缓存中移除)'''
+    __snapshot: ContextVar[Union[Dict[str, Union[dict, None]], None]] = ContextVar(
+        "mystool_userdata_snapshot", default=None)
+    '''当前上下文的事务中修改过的QQ用户在修改前的数据，用于撤销修改(不在事务中时为`None`)'''
+    __last_read: ContextVar[Union[Dict[str, Union[dict, None]], None]] = ContextVar(
+        "mystool_userdata_last_read", default=None)
+    '''当前上下文的事务中各QQ用户最近一次被读取时的数据，修改时作为修改前的数据'''
+
+    @classmethod
+    def __get_io_lock(cls):
+        """
+        获取读写锁(需在事件循环中调用)
+        """
+        if cls.__io_lock is None:
+            cls.__io_lock = asyncio.Lock()
+        return cls.__io_lock
+
+    @classmethod
+    def __read_storage(cls) -> Tuple[Storage, Dict[str, dict], Set[str], Set[str], Dict[str, Set[str]]]:
+        """
+        创建存储后端并读入用户数据(同时迁移旧格式的数据)
+
+        返回存储后端、已读入的用户数据、所有QQ号、进行了迁移的QQ号、各QQ用户绑定的米游社UID。
+        对于按需加载的存储后端，只读出各用户绑定的米游社UID，而不保留用户数据
+        """
+        storage = cls.__storage or create_storage()
+        if storage.LAZY:
+            # 只读取存储后端保存的米游社UID索引，不读取每个QQ用户的数据
+            bbsUIDs = storage.bbsUIDs()
+            return storage, {}, set(bbsUIDs), set(), bbsUIDs
+        userdata = storage.load_all()
+        migrated = {qq for qq, user in userdata.items() if migrate_user(user)}
+        if migrated:
+            logger.info(f"{conf.LOG_HEAD}用户数据 - 已将 {len(migrated)} 个用户的数据迁移至版本 {SCHEMA_VERSION}")
+        bbsUIDs = {qq: {account["bbsUID"] for account in user["accounts"]} for qq, user in userdata.items()}
+        return storage, userdata, set(userdata), migrated, bbsUIDs
+
+    @classmethod
+    def __apply_loaded(cls, storage: Storage, userdata: Dict[str, dict], qq_set: Set[str], migrated: Set[str],
+                       bbsUIDs: Dict[str, Set[str]]):
+        """
+        使用读入的数据替换内存中的用户数据(会丢弃内存中尚未写入的修改)，建立索引，并安排写入迁移后的数据
+        """
+        cls.__storage = storage
+        cls.__users = OrderedDict(userdata)
+        cls.__qq_set = qq_set
+        cls.__changed = set(migrated)
+        cls.__account_index = {}
+        cls.__user_bbsUIDs = {}
+        cls.__bbsUID_index = {}
+        for qq, uids in bbsUIDs.items():
+            cls.__index_bbsUIDs(qq, uids)
+        for qq, user in userdata.items():
+            cls.__index_accounts(qq, user)
+        if migrated:
+            cls.__schedule_flush()
+
+    @classmethod
+    def __index_accounts(cls, qq: str, user: dict):
+        """
+        建立QQ用户的帐号索引(手机号、备注名)
+
+        参数:
+            `qq`: 用户的QQ号
+            `user`: 用户数据
+        """
+        index = {}
+        for position, account in enumerate(user["accounts"]):
+            # 与逐个查找一致，重复时以第一个帐号为准
+            for key in (account["phone"], account["name"]):
+                if key is not None:
+                    index.setdefault(key, position)
+        cls.__account_index[qq] = index
+
+    @classmethod
+    def __index_bbsUIDs(cls, qq: str, bbsUIDs: Set[str]):
+        """
+        更新QQ用户绑定的米游社UID索引
+
+        参数:
+            `qq`: 用户的QQ号
+            `bbsUIDs`: 该用户当前绑定的米游社UID
+        """
+        bbsUIDs = {uid for uid in bbsUIDs if uid is not None}
+        for uid in cls.__user_bbsUIDs.get(qq, set()) - bbsUIDs:
+            cls.__bbsUID_index[uid].discard(qq)
+            if not cls.__bbsUID_index[uid]:
+                cls.__bbsUID_index.pop(uid)
+        for uid in bbsUIDs:
+            cls.__bbsUID_index.setdefault(uid, set()).add(qq)
+        if bbsUIDs:
+            cls.__user_bbsUIDs[qq] = bbsUIDs
+        else:
+            cls.__user_bbsUIDs.pop(qq, None)
+
+    @classmethod
+    def __reindex(cls, qq: str):
+        """
+        QQ用户数据发生变化后，更新该用户的所有索引
+
+        参数:
+            `qq`: 用户的QQ号
+        """
+        user = cls.__users.get(qq)
+        if user is None:
+            cls.__account_index.pop(qq, None)
+            cls.__index_bbsUIDs(qq, set())
+        else:
+            cls.__index_accounts(qq, user)
+            cls.__index_bbsUIDs(qq, {account["bbsUID"] for account in user["accounts"]})
+
+    @classmethod
+    def load(cls):
+        """
+        在当前线程中从存储后端读入用户数据(会丢弃内存中尚未写入的修改)
+
+        一般只在启动前调用，机器人运行期间请使用`async_load`
+        """
+        cls.__apply_loaded(*cls.__read_storage())
+
+    @classmethod
+    async def async_load(cls):
+        """
+        若尚未读入用户数据，则在I/O线程中从存储后端读入
+        """
+        async with cls.__get_io_lock():
+            if cls.__storage is not None:
+                return
+            loaded = await asyncio.get_running_loop().run_in_executor(cls.__executor, cls.__read_storage)
+            # 读入期间可能已有其他操作在当前线程中读入了用户数据
+            if cls.__storage is not None:
+                await asyncio.get_running_loop().run_in_executor(cls.__executor, loaded[0].close)
+                return
+            cls.__apply_loaded(*loaded)
+
+    @classmethod
+    def __take_changed(cls) -> Dict[str, Union[dict, None]]:
+        """
+        取出所有待写入的修改，返回发生变化的QQ用户数据的副本(`None`表示已删除)，供I/O线程写入
+        """
+        changed, cls.__changed = cls.__changed, set()
+        cls.__saving |= changed
+        return {qq: deepcopy(cls.__users.get(qq)) for qq in changed}
+
+    @classmethod
+    def __save(cls, changed: Dict[str, Union[dict, None]]):
+        """
+        在当前线程中写入取出的修改(在I/O线程中调用)，写入结束后(无论成败)才允许从缓存中移除这些QQ用户
+        """
+        try:
+            cls.__storage.save(changed)
+        finally:
+            cls.__saving -= changed.keys()
+
+    @classmethod
+    def __save_failed(cls, changed: Dict[str, Union[dict, None]]):
+        """
+        写入失败时，将修改重新标记为待写入，并按指数退避安排重新写入
+        """
+        cls.__changed |= changed.keys()
+        cls.__save_failures += 1
+        logger.error(conf.LOG_HEAD + "用户数据 - 写入用户数据失败")
+        logger.debug(conf.LOG_HEAD + traceback.format_exc())
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中(如启动前)，在下次写入时重试
+            return
+        delay = min(conf.DATA_FLUSH_DELAY * 2 ** cls.__save_failures, conf.DATA_FLUSH_RETRY_MAX)
+        cls.__cancel_scheduled()
+        cls.__flush_handle = loop.call_later(delay, cls.__start_flush)
+
+    @classmethod
+    def __cancel_scheduled(cls):
+        """
+        取消已安排的延迟写入
+        """
+        if cls.__flush_handle is not None:
+            cls.__flush_handle.cancel()
+            cls.__flush_handle = None
+
+    @classmethod
+    async def flush(cls):
+        """
+        立即将内存中的用户数据修改写入存储后端(在I/O线程中写入)
+        """
+        cls.__cancel_scheduled()
+        if not cls.__changed:
+            return
+        async with cls.__get_io_lock():
+            # 等待锁期间修改可能已被其他写入操作写入
+            if not cls.__changed:
+                return
+            changed = cls.__take_changed()
+            try:
+                await asyncio.get_running_loop().run_in_executor(cls.__executor, cls.__save, changed)
+                cls.__save_failures = 0
+            except Exception:
+                cls.__save_failed(changed)
+        cls.__evict()
+
+    @classmethod
+    def __flush_now(cls):
+        """
+        在当前线程中立即写入修改，仅用于不在事件循环中(如启动前)的情况
+        """
+        cls.__cancel_scheduled()
+        if not cls.__changed:
+            return
+        changed = cls.__take_changed()
+        try:
+            cls.__save(changed)
+            cls.__save_failures = 0
+        except Exception:
+            cls.__save_failed(changed)
+        cls.__evict()
+
+    @classmethod
+    def __start_flush(cls):
+        """
+        延迟写入的定时器回调，创建写入任务
+        """
+        cls.__flush_handle = None
+        cls.__flush_task = asyncio.create_task(cls.flush())
+
+    @classmethod
+    async def close(cls):
+        """
+        写入尚未写入的修改，并关闭存储后端(会等待正在进行的事务结束)
+        """
+        async with cls.__get_transaction_lock():
+            await cls.flush()
+        if cls.__storage is not None:
+            async with cls.__get_io_lock():
+                await asyncio.get_running_loop().run_in_executor(cls.__executor, cls.__storage.close)
+            cls.__storage = None
+
+    @classmethod
+    @asynccontextmanager
+    async def transaction(cls):
+        """
+        在一个事务中进行多次修改，事务中的修改在事务结束时才标记为待写入(随延迟写入一并写入)；
+        若事务中出现异常，则撤销事务中修改过的QQ用户的数据
+
+        事务可以嵌套，内层事务会并入最外层的事务
+
+        >>> async with UserData.transaction():
+        >>>     UserData.set_account(account, qq)
+        >>>     UserData.set_notice(False, qq)
+        """
+        if cls.__snapshot.get() is not None:
+            yield
+            return
+        async with cls.__get_transaction_lock():
+            snapshot: Dict[str, Union[dict, None]] = {}
+            token = cls.__snapshot.set(snapshot)
+            read_token = cls.__last_read.set({})
+            try:
+                yield
+            except BaseException:
+                cls.__rollback(snapshot)
+                raise
+            else:
+                for qq in snapshot:
+                    cls.__mark_changed(qq)
+            finally:
+                cls.__uncommitted -= snapshot.keys()
+                cls.__snapshot.reset(token)
+                cls.__last_read.reset(read_token)
+
+    @classmethod
+    def __get_transaction_lock(cls):
+        """
+        获取事务锁(需在事件循环中调用)
+        """
+        if cls.__transaction_lock is None:
+            cls.__transaction_lock = asyncio.Lock()
+        return cls.__transaction_lock
+
+    @classmethod
+    def __remember(cls, qq: str, user: Union[dict, None]):
+        """
+        若处于事务中，记录QQ用户被读取时的数据(之后修改该用户时作为修改前的数据)
+
+        参数:
+            `qq`: 用户的QQ号
+            `user`: 用户当前的数据，`None`表示用户不存在
+        """
+        last_read = cls.__last_read.get()
+        if last_read is not None:
+            last_read[qq] = deepcopy(user)
+
+    @classmethod
+    def __rollback(cls, snapshot: Dict[str, Union[dict, None]]):
+        """
+        撤销事务中的修改
+
+        参数:
+            `snapshot`: 事务中修改过的QQ用户在修改前的数据
+        """
+        for qq, user in snapshot.items():
+            if user is None:
+                cls.__users.pop(qq, None)
+                cls.__qq_set.discard(qq)
+            else:
+                cls.__users[qq] = user
+                cls.__qq_set.add(qq)
+            # 事务期间其他写入操作可能已写入了修改后的数据，重新写入恢复后的数据
+            cls.__mark_changed(qq)
+        logger.warning(conf.LOG_HEAD + "用户数据 - 事务中出现异常，已撤销事务中的修改")
+
+    @classmethod
+    def __evict(cls, reserve: int = 0):
+        """
+        对于按需加载的存储后端，从内存中移除最久未使用且没有待写入修改的QQ用户，直到不超过缓存上限
+
+        参数:
+            `reserve`: 为即将读入的用户预留的位置数
+        """
+        if not cls.__storage.LAZY:
+            return
+        while len(cls.__users) + reserve > conf.USER_CACHE_SIZE:
+            for qq in cls.__users:
+                if qq not in cls.__changed and qq not in cls.__saving and qq not in cls.__uncommitted:
+                    # 米游社UID索引包含所有用户，不随缓存移除
+                    cls.__users.pop(qq)
+                    cls.__account_index.pop(qq, None)
+                    break
+            else:
+                break
+
+    @classmethod
+    def __get_user(cls, qq: Union[int, str]) -> Union[dict, None]:
+        """
+        获取某个QQ用户的数据(内存中的数据，可直接修改，修改后需调用`__set_changed`)，若不存在用户则返回`None`
+
+        参数:
+            `qq`: 用户的QQ号
+        """
+        if cls.__storage is None:
+            cls.load()
+        qq = str(qq)
+        user = cls.__users.get(qq)
+        if user is not None:
+            cls.__users.move_to_end(qq)
+        elif cls.__storage.LAZY and qq in cls.__qq_set:
+            # 未通过 `load_user` 预先读入时只能在当前线程中读取
+            user = cls.__add_loaded(qq, cls.__storage.load(qq))
+        cls.__remember(qq, user)
+        return user
+
+    @classmethod
+    def __add_loaded(cls, qq: str, user: Union[dict, None]) -> Union[dict, None]:
+        """
+        将按需读入的QQ用户数据放入缓存，返回缓存中该用户的数据
+
+        参数:
+            `qq`: 用户的QQ号
+            `user`: 从存储后端读入的数据，`None`表示用户不存在
+        """
+        if qq in cls.__users:
+            # 读取期间已被其他操作读入
+            return cls.__users[qq]
+        if user is None:
+            cls.__qq_set.discard(qq)
+            return None
+        cls.__evict(reserve=1)
+        cls.__users[qq] = user
+        if migrate_user(user):
+            # 迁移不属于当前事务的修改，直接标记为待写入
+            cls.__mark_changed(qq)
+        else:
+            cls.__index_accounts(qq, user)
+        return user
+
+    @classmethod
+    async def load_user(cls, qq: Union[int, str]):
+        """
+        对于按需加载的存储后端，若QQ用户的数据尚未读入内存，则在I/O线程中读入，
+        之后同步读取该用户的数据时不会阻塞事件循环
+
+        参数:
+            `qq`: 用户的QQ号
+        """
+        if cls.__storage is None:
+            await cls.async_load()
+        qq = str(qq)
+        if not cls.__storage.LAZY or qq in cls.__users or qq not in cls.__qq_set:
+            return
+        user = await asyncio.get_running_loop().run_in_executor(cls.__executor, cls.__storage.load, qq)
+        cls.__add_loaded(qq, user)
+
+    @classmethod
+    async def read_all(cls) -> Dict[str, dict]:
+        """
+        以dict形式获取所有用户数据
+
+        返回的是内存中的数据，请勿直接修改，修改请使用`UserData`的其他方法。
+        对于按需加载的存储后端，会在I/O线程中读取所有用户的数据，如果只需要QQ号请使用`read_qq_all`
+        """
+        if cls.__storage is None:
+            await cls.async_load()
+        if not cls.__storage.LAZY:
+            return cls.__users
+        userdata = {}
+        for qq in list(cls.__qq_set):
+            if qq in cls.__users:
+                user = cls.__users[qq]
+            else:
+                user = await asyncio.get_running_loop().run_in_executor(cls.__executor, cls.__storage.load, qq)
+                if user is not None:
+                    migrate_user(user)
+            if user is not None:
+                userdata[qq] = user
+        return userdata
+
+    @classmethod
+    def read_qq_all(cls) -> List[str]:
+        """
+        获取所有QQ用户的QQ号(不读取用户数据)
+        """
+        if cls.__storage is None:
+            cls.load()
+        return list(cls.__qq_set)
+
+    @classmethod
+    def __set_changed(cls, qq: Union[int, str]):
+        """
+        标记某个QQ用户的数据已修改；处于事务中时只记录修改前的数据，事务提交后才标记为待写入
+
+        参数:
+            `qq`: 用户的QQ号
+        """
+        qq = str(qq)
+        snapshot = cls.__snapshot.get()
+        if snapshot is None:
+            cls.__mark_changed(qq)
+            return
+        if qq not in snapshot:
+            # 修改前都会先通过 `__get_user` 读取，最近一次读取时的数据即为修改前的数据
+            snapshot[qq] = cls.__last_read.get().get(qq)
+        cls.__uncommitted.add(qq)
+        cls.__reindex(qq)
+
+    @classmethod
+    def __mark_changed(cls, qq: str):
         """
-        以dict形式获取userdata.json
+        将某个QQ用户标记为待写入，并安排延迟写入
+
+        参数:
+            `qq`: 用户的QQ号
         """
-        return json.load(open(USERDATA_PATH, encoding=conf.ENCODING))
+        cls.__changed.add(qq)
+        cls.__reindex(qq)
+        cls.__schedule_flush()
+
+    @classmethod
+    def __schedule_flush(cls):
+        """
+        安排延迟写入
+        """
+        if cls.__flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中(如启动前)，直接写入
+            cls.__flush_now()
+            return
+        cls.__flush_handle = loop.call_later(conf.DATA_FLUSH_DELAY, cls.__start_flush)
 
     @classmethod
     def read_account(cls, qq: int, by: Union[int, str]):
@@ -232,19 +780,41 @@ class UserData:
             `qq`: 要查找的用户的QQ号
             `by`: 索引依据，可为备注名或手机号
         """
-        if isinstance(by, str):
-            by_type = "name"
-        else:
-            by_type = "phone"
-        try:
-            for account in cls.read_all()[str(qq)]["accounts"]:
-                if account[by_type] == by:
-                    userAccount = UserAccount()
-                    userAccount.get(account)
-                    return userAccount
-        except KeyError:
-            pass
-        return None
+        user, position = cls.__find_account(qq, by)
+        if position is None:
+            return None
+        return UserAccount(user["accounts"][position])
+
+    @classmethod
+    def __find_account(cls, qq: Union[int, str], by: Union[int, str]) -> Tuple[Union[dict, None], Union[int, None]]:
+        """
+        通过索引查找用户的某个米游社帐号，返回用户数据和帐号在列表中的位置(不存在时为`None`)
+
+        参数:
+            `qq`: 要查找的用户的QQ号
+            `by`: 索引依据，可为备注名(`str`)或手机号(`int`)
+        """
+        qq = str(qq)
+        user = cls.__get_user(qq)
+        if user is None:
+            return None, None
+        index = cls.__account_index.get(qq)
+        if index is None:
+            cls.__index_accounts(qq, user)
+            index = cls.__account_index[qq]
+        return user, index.get(by)
+
+    @classmethod
+    def find_qq_by_bbsUID(cls, bbsUID: str) -> List[int]:
+        """
+        查找绑定了某个米游社UID的所有QQ用户，可用于发现被多个QQ用户绑定的同一米游社帐号
+
+        参数:
+            `bbsUID`: 米游社UID
+        """
+        if cls.__storage is None:
+            cls.load()
+        return [int(qq) for qq in cls.__bbsUID_index.get(str(bbsUID), ())]
 
     @classmethod
     def read_account_all(cls, qq: int) -> List[UserAccount]:
@@ -255,45 +825,66 @@ class UserData:
             `qq`: 要查找的用户的QQ号
         """
         accounts = []
-        try:
-            accounts_raw = cls.read_all()[str(qq)]["accounts"]
-            for account_raw in accounts_raw:
-                account = UserAccount()
-                account.get(account_raw)
-                accounts.append(account)
-        except KeyError:
-            pass
+        user = cls.__get_user(qq)
+        if user is None:
+            return accounts
+        for account in user["accounts"]:
+            accounts.append(UserAccount(account))
         return accounts
 
-    @staticmethod
-    def __set_all(userdata: Dict[str, dict]):
+    @classmethod
+    async def iter_accounts(cls, mybMission: bool = None, gameSign: bool = None,
+                            has_exchange: bool = None) -> AsyncIterator[Tuple[int, UserAccount]]:
         """
-        写入用户数据文件(整体覆盖)
+        遍历所有QQ用户的米游社帐号，依次产生 `(QQ号, 米游社帐号数据)`，只会读取一遍用户数据
+
+        对于按需加载的存储后端，尚未读入内存的用户会在I/O线程中读取，且不会放入缓存
 
         参数:
-            `userdata`: 完整用户数据(包含所有用户)
+            `mybMission`: (可选)只遍历米游币任务计划开启/关闭的帐号
+            `gameSign`: (可选)只遍历游戏签到计划开启/关闭的帐号
+            `has_exchange`: (可选)只遍历有/没有兑换计划的帐号
         """
-        json.dump(userdata, open(USERDATA_PATH, "w",
-                  encoding=ENCODING), indent=4, ensure_ascii=False)
+        if cls.__storage is None:
+            await cls.async_load()
+        for qq in list(cls.__qq_set):
+            user = cls.__users.get(qq)
+            if user is None and cls.__storage.LAZY:
+                user = await asyncio.get_running_loop().run_in_executor(cls.__executor, cls.__storage.load, qq)
+                if user is not None:
+                    migrate_user(user)
+            if user is None:
+                continue
+            # 先按原始数据筛选，只为符合条件的帐号创建对象
+            for account in list(user["accounts"]):
+                if mybMission is not None and account["mybMission"] != mybMission:
+                    continue
+                if gameSign is not None and account["gameSign"] != gameSign:
+                    continue
+                if has_exchange is not None and bool(account["exchange"]) != has_exchange:
+                    continue
+                yield int(qq), UserAccount(account)
 
     @classmethod
-    def __create_user(cls, userdata: Dict[str, dict], qq: int) -> dict:
+    def __create_user(cls, qq: int) -> dict:
         """
-        创建用户数据，返回创建后整体的userdata
+        创建用户数据，返回该用户的数据
         """
-        userdata.setdefault(str(qq), deepcopy(cls.USER_SAMPLE))
-        return userdata
+        user = deepcopy(cls.USER_SAMPLE)
+        cls.__users[str(qq)] = user
+        cls.__qq_set.add(str(qq))
+        return user
 
     @staticmethod
-    def __create_account(userdata: Dict[str, dict], qq: int, name: str = None, phone: int = None) -> dict:
+    def __create_account(user: dict, name: str = None, phone: int = None) -> dict:
         """
-        创建米哈游账户数据，返回创建后整体的userdata
+        创建米哈游账户数据，返回创建的账户数据
         """
         account = UserAccount().to_dict()
         account["name"] = name
         account["phone"] = phone
-        userdata[str(qq)]["accounts"].append(account)
-        return userdata
+        user["accounts"].append(account)
+        return account
 
     @classmethod
     def del_user(cls, qq: int):
@@ -305,12 +896,12 @@ class UserData:
 
         若未找到返回`False`，否则返回`True`
         """
-        userdata = cls.read_all()
-        try:
-            userdata.pop(str(qq))
-        except KeyError:
+        qq = str(qq)
+        if cls.__get_user(qq) is None:
             return False
-        cls.__set_all(userdata)
+        cls.__users.pop(qq, None)
+        cls.__qq_set.discard(qq)
+        cls.__set_changed(qq)
         return True
 
     @classmethod
@@ -323,21 +914,13 @@ class UserData:
             `qq`: 要设置的用户的QQ号
             `by`: (可选)索引依据，可为备注名或手机号
         """
-        account_raw = account.to_dict()
-        userdata = cls.read_all()
-        if isinstance(by, str):
-            by_type = "name"
-        elif isinstance(by, int):
-            by_type = "phone"
-        else:
-            by_type = "phone"
+        if not isinstance(by, (int, str)):
             by = account.phone
-
-        for num in range(0, len(userdata[str(qq)]["accounts"])):
-            if userdata[str(qq)]["accounts"][num][by_type] == by:
-                userdata[str(qq)]["accounts"][num] = account_raw
-                cls.__set_all(userdata)
-                return
+        user, position = cls.__find_account(qq, by)
+        if position is None:
+            return
+        user["accounts"][position] = account.to_dict()
+        cls.__set_changed(qq)
 
     @classmethod
     def del_account(cls, qq: int, by: Union[int, str]):
@@ -350,19 +933,11 @@ class UserData:
 
         若未找到返回`False`，否则返回`True`
         """
-        if isinstance(by, str):
-            by_type = "name"
-        else:
-            by_type = "phone"
-            by = str(by)
-        userdata = cls.read_all()
-        try:
-            account_list: List[dict] = userdata[str(qq)]["accounts"]
-            account_list.remove(
-                list(filter(lambda account: account[by_type] == by, account_list))[0])
-        except KeyError and IndexError:
+        user, position = cls.__find_account(qq, by)
+        if position is None:
             return False
-        cls.__set_all(userdata)
+        user["accounts"].pop(position)
+        cls.__set_changed(qq)
         return True
 
     @classmethod
@@ -375,32 +950,24 @@ class UserData:
             `qq`: 要设置的用户的QQ号
             `by`: 索引依据，可为备注名或手机号
         """
-        userdata = cls.read_all()
-        name, phone = None, None
-        if isinstance(by, str):
-            by_type = "name"
-            name = by
+        user, position = cls.__find_account(qq, by)
+        if user is None:
+            user = cls.__create_user(qq)
+        if position is None:
+            if isinstance(by, str):
+                account = cls.__create_account(user, name=by)
+            else:
+                account = cls.__create_account(user, phone=by)
         else:
-            by_type = "phone"
-            phone = by
-        if qq not in userdata:
-            userdata = cls.__create_user(userdata, qq)
-
-        def action() -> bool:
-            for account in userdata[str(qq)]["accounts"]:
-                if account[by_type] == by:
-                    account["cookie"] = cookie
-                    for item in ("login_uid", "stuid", "ltuid", "account_id"):
-                        if item in cookie:
-                            account["bbsUID"] = cookie[item]
-                            break
-                    account["cookie"].setdefault("stuid", account["bbsUID"])
-                    cls.__set_all(userdata)
-                    return True
-            return False
+            account = user["accounts"][position]
 
-        while not action():
-            userdata = cls.__create_account(userdata, qq, name, phone)
+        account["cookie"] = cookie
+        for item in ("login_uid", "stuid", "ltuid", "account_id"):
+            if item in cookie:
+                account["bbsUID"] = cookie[item]
+                break
+        account["cookie"].setdefault("stuid", account["bbsUID"])
+        cls.__set_changed(qq)
 
     @classmethod
     def isNotice(cls, qq: int) -> Union[bool, None]:
@@ -410,15 +977,11 @@ class UserData:
         参数:
             `qq`: 用户QQ号
         """
-        userdata = cls.read_all()
-        qq = str(qq)
-        if qq not in userdata:
+        user = cls.__get_user(qq)
+        if user is None:
             return None
-        elif cls.OPTION_NOTICE not in userdata[qq]:
-            userdata[qq].setdefault(cls.OPTION_NOTICE, True)
-            return True
         else:
-            return userdata[qq][cls.OPTION_NOTICE]
+            return user.get(cls.OPTION_NOTICE, True)
 
     @classmethod
     def set_notice(cls, isNotice: bool, qq: int):
@@ -432,32 +995,36 @@ class UserData:
             `True`: 成功写入
             `False`: 写入失败，可能是不存在用户
         """
-        userdata = cls.read_all()
-        qq = str(qq)
-        try:
-            if cls.OPTION_NOTICE not in userdata[qq]:
-                userdata[qq].setdefault(cls.OPTION_NOTICE, isNotice)
-            else:
-                userdata[qq][cls.OPTION_NOTICE] = isNotice
-            cls.__set_all(userdata)
-            return True
-        except KeyError:
+        user = cls.__get_user(qq)
+        if user is None:
             return False
+        user[cls.OPTION_NOTICE] = isNotice
+        cls.__set_changed(qq)
+        return True
 
 
 @driver.on_startup
-def create_files():
-    if not USERDATA_PATH.exists():
-        USERDATA_PATH.parent.mkdir(parents=True, exist_ok=True)
-        logger.warning(conf.LOG_HEAD + "用户数据文件不存在，将重新生成...")
-    else:
-        try:
-            if not isinstance(json.load(open(USERDATA_PATH, encoding=ENCODING)), dict):
-                raise ValueError
-            else:
-                return
-        except json.JSONDecodeError and ValueError:
-            logger.warning(conf.LOG_HEAD + "用户数据文件格式错误，将重新生成...")
+async def load_userdata():
+    """
+    启动时将用户数据读入内存
+    """
+    await UserData.async_load()
+
+
+@run_preprocessor
+async def load_event_user(matcher: Matcher, event: Event):
+    """
+    运行本插件的事件响应器前，在I/O线程中读入发送者的用户数据，避免处理过程中读取磁盘阻塞事件循环
+    """
+    if matcher.module_name and matcher.module_name.startswith(__package__):
+        user_id = getattr(event, "user_id", None)
+        if user_id is not None:
+            await UserData.load_user(user_id)
+
 
-    with USERDATA_PATH.open("w", encoding=ENCODING) as fp:
-        json.dump({}, fp, indent=4, ensure_ascii=False)
+@driver.on_shutdown
+async def flush_userdata():
+    """
+    关闭时将尚未写入的用户数据修改写入，并关闭存储后端
+    """
+    await UserData.close()
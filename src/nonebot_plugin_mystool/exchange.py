@@ -12,16 +12,25 @@ import httpx
 import tenacity
 from PIL import Image, ImageDraw, ImageFont
 
+from .asset import asset_cache
 from .bbsAPI import GameRecord, get_game_record
 from .config import PATH
 from .config import mysTool_config as conf
 from .data import UserAccount
-from .utils import (check_login, custom_attempt_times, generateDeviceID,
-                    get_file, logger)
+from .httpClient import shared_get
+from .circuitBreaker import exempt_from_circuit_breaker
+from .rateLimit import exempt_from_rate_limit
+from .retry import request_retrying
+from .session import AccountSession
+from .utils import ApiResponse, generateDeviceID, get_file, logger
 
 URL_GOOD_LIST = "https://api-takumi.mihoyo.com/mall/v1/web/goods/list?app_id=1&point_sn=myb&page_size=20&page={page}&game={game}"
 URL_CHECK_GOOD = "https://api-takumi.mihoyo.com/mall/v1/web/goods/detail?app_id=1&point_sn=myb&goods_id={}"
 URL_EXCHANGE = "https://api-takumi.mihoyo.com/mall/v1/web/goods/exchange"
+# 兑换请求需要在开售时集中发出，不能被按主机限速延后；
+# 抢购时预期会出现大量限流和服务器错误，也不能因此熔断导致其他帐号的兑换被直接拒绝
+exempt_from_rate_limit(URL_EXCHANGE)
+exempt_from_circuit_breaker(URL_EXCHANGE)
 HEADERS_GOOD_LIST = {
     "Host":
         "api-takumi.mihoyo.com",
@@ -196,11 +205,11 @@ async def get_good_detail(goodID: str, retry: bool = True):
     """
 
     try:
-        async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+        async for attempt in request_retrying(retry, reraise=True):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_CHECK_GOOD.format(goodID), timeout=conf.TIME_OUT)
-                return Good(res.json()["data"])
+                res = await shared_get(URL_CHECK_GOOD.format(goodID), timeout=conf.TIME_OUT)
+                api_res = ApiResponse(res)
+                return Good(api_res.data)
     except KeyError and ValueError:
         logger.error(conf.LOG_HEAD + "米游币商品兑换 - 获取商品详细信息: 服务器没有正确返回")
         logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
@@ -233,12 +242,12 @@ async def get_good_list(game: Literal["bh3", "ys", "bh2", "wd", "bbs"], retry: b
     page = 1
 
     try:
-        async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+        async for attempt in request_retrying(retry, reraise=True):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(URL_GOOD_LIST.format(page=page,
-                                                                game=game), headers=HEADERS_GOOD_LIST, timeout=conf.TIME_OUT)
-                goods = res.json()["data"]["list"]
+                res = await shared_get(URL_GOOD_LIST.format(page=page, game=game),
+                                       headers=HEADERS_GOOD_LIST, timeout=conf.TIME_OUT)
+                api_res = ApiResponse(res)
+                goods = api_res.data["list"]
                 # 判断是否已经读完所有商品
                 if goods == []:
                     break
@@ -322,12 +331,12 @@ class Exchange:
                     "米游币商品兑换 - 初始化兑换任务: 开始获取商品 {} 的信息".format(self.goodID))
         res = None
         try:
-            async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+            async for attempt in request_retrying(retry):
                 with attempt:
-                    async with httpx.AsyncClient() as client:
-                        res = await client.get(
-                            URL_CHECK_GOOD.format(self.goodID), timeout=conf.TIME_OUT)
-                    goodInfo = res.json()["data"]
+                    res = await shared_get(
+                        URL_CHECK_GOOD.format(self.goodID), timeout=conf.TIME_OUT)
+                    api_res = ApiResponse(res)
+                    goodInfo = api_res.data
                     if goodInfo["type"] == 2 and goodInfo["game_biz"] != "bbs_cn":
                         self.content.pop("address_id")
                         if "stoken" not in self.account.cookie:
@@ -392,27 +401,29 @@ class Exchange:
                          "商品：{} 未初始化完成，放弃兑换".format(self.goodID))
             return None
         else:
-            headers = HEADERS_EXCHANGE
-            headers["x-rpc-device_id"] = self.account.deviceID
             try:
-                async with httpx.AsyncClient() as client:
-                    res = await client.post(
-                        URL_EXCHANGE, headers=headers, json=self.content, cookies=self.account.cookie, timeout=conf.TIME_OUT)
-                if not check_login(res.text):
+                try:
+                    res = await AccountSession.of(self.account).post(
+                        URL_EXCHANGE, headers=HEADERS_EXCHANGE, device="deviceID", json=self.content, timeout=conf.TIME_OUT)
+                except httpx.HTTPStatusError as e:
+                    # 兑换不重试，限流或服务器错误时仍按服务器返回的数据判断兑换结果
+                    res = e.response
+                api_res = ApiResponse(res)
+                if api_res.login_expired:
                     logger.info(
                         conf.LOG_HEAD + "米游币商品兑换 - 执行兑换: 用户 {} 登录失效".format(self.account.phone))
                     logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
                     return -1
-                if res.json()["message"] == "OK":
+                if api_res.message == "OK":
                     logger.info(
                         conf.LOG_HEAD + "米游币商品兑换 - 执行兑换: 用户 {0} 商品 {1} 兑换成功！可以自行确认。".format(self.account.phone, self.goodID))
                     logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
-                    return (True, res.json())
+                    return (True, api_res.content)
                 else:
                     logger.info(
                         conf.LOG_HEAD + "米游币商品兑换 - 执行兑换: 用户 {0} 商品 {1} 兑换失败，可以自行确认。".format(self.account.phone, self.goodID))
                     logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
-                    return (False, res.json())
+                    return (False, api_res.content)
             except KeyError:
                 logger.error(
                     conf.LOG_HEAD + "米游币商品兑换 - 执行兑换: 用户 {0} 商品 {1} 服务器没有正确返回".format(self.account.phone, self.goodID))
@@ -483,11 +494,11 @@ async def game_list_to_image(good_list: List[Good], retry: bool = True):
         '''商品预览图'''
 
         for good in good_list:
-            async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
-                with attempt:
-                    async with httpx.AsyncClient() as client:
-                        icon = await client.get(good.icon, timeout=conf.TIME_OUT)
-            img = Image.open(io.BytesIO(icon.content))
+            icon = await asset_cache.read(good.icon, retry)
+            if icon is None:
+                logger.error(conf.LOG_HEAD + "商品列表图片生成 - 商品 {} 的图片下载失败".format(good.goodID))
+                return None
+            img = Image.open(io.BytesIO(icon))
             # 调整预览图大小
             img = img.resize(conf.goodListImage.ICON_SIZE)
             # 记录预览图粘贴位置
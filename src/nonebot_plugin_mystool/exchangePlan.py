@@ -6,7 +6,7 @@ import os
 import time
 from copy import deepcopy
 from datetime import datetime
-from typing import List, Set
+from typing import List, Set, Tuple
 
 from nonebot import get_bot, get_driver, on_command
 from nonebot.adapters.onebot.v11 import (Bot, MessageEvent, MessageSegment,
@@ -18,10 +18,11 @@ from nonebot_plugin_apscheduler import scheduler
 
 from .bbsAPI import get_game_record
 from .config import mysTool_config as conf
-from .data import UserData
-from .exchange import (Exchange, Good, UserAccount, get_good_detail,
-                       get_good_list)
+from .data import ExchangePlan, UserData
+from .exchange import Exchange, Good, UserAccount, get_good_detail
 from .gameSign import GameInfo
+from .goodCatalog import good_catalog
+from .session import AccountSession
 from .timing import generate_image
 from .utils import NtpTime
 
@@ -49,12 +50,13 @@ class ExchangeStart:
         """
         执行兑换
         """
-        # 在后台启动兑换操作
-        for plan in self.plans:
-            self.tasks.add(asyncio.create_task(plan.start()))
-        # 等待兑换线程全部结束
-        for task in self.tasks:
-            await task
+        # 在后台启动兑换操作，各兑换线程共用帐号的同一个会话
+        async with AccountSession(self.account):
+            for plan in self.plans:
+                self.tasks.add(asyncio.create_task(plan.start()))
+            # 等待兑换线程全部结束
+            for task in self.tasks:
+                await task
 
         bot: Bot = get_bot()
 
@@ -75,11 +77,15 @@ class ExchangeStart:
                     msg += f"异常，程序返回结果为 {task.result()}"
                 msg += "\n"
             await bot.send_private_msg(user_id=self.qq, message=msg)
-        for plan in self.account.exchange:
-            if plan == (self.plans[0].goodID, self.plans[0].gameUID):
-                self.account.exchange.remove(plan)
-        UserData.set_account(self.account, self.qq,
-                             self.account.phone)
+        # 重新读取账户数据，避免覆盖计划制定后用户做出的其他修改
+        await UserData.load_user(self.qq)
+        async with UserData.transaction():
+            account = UserData.read_account(self.qq, self.account.phone)
+            if account is not None:
+                for plan in account.exchange:
+                    if plan == (self.plans[0].goodID, self.plans[0].gameUID):
+                        account.exchange.remove(plan)
+                UserData.set_account(account, self.qq, account.phone)
 
 
 myb_exchange_plan = on_command(
@@ -147,15 +153,12 @@ async def _(event: PrivateMessageEvent, matcher: Matcher, state: T_State, phone=
     """
     if isinstance(phone, Message):
         phone = phone.extract_plain_text().strip()
-    user_account: List[UserAccount] = state['user_account']
-
     if phone == '退出':
         await matcher.finish('🚪已成功退出')
-    try:
-        state["account"] = list(
-            filter(lambda account: account.phone == int(phone), user_account))[0]
-    except IndexError:
-        myb_exchange_plan.reject('⚠️您发送的账号不在以上账号内，请重新发送')
+    account = UserData.read_account(state['qq_account'], int(phone)) if phone.isdigit() else None
+    if account is None:
+        await myb_exchange_plan.reject('⚠️您发送的账号不在以上账号内，请重新发送')
+    state["account"] = account
 
 
 @myb_exchange_plan.got('content')
@@ -167,27 +170,10 @@ async def _(event: PrivateMessageEvent, matcher: Matcher, state: T_State):
     account: UserAccount = state['account']
     arg = [content[0], content[1:].strip()]
     if arg[0] == '+':
-        good_dict = {
-        'bh3': await get_good_list('bh3'),
-        'ys': await get_good_list('ys'),
-        'bh2': await get_good_list('bh2'),
-        'wd': await get_good_list('wd'),
-        'bbs': await get_good_list('bbs')
-        }
-        Flag = True
-        break_flag = False
-        good: Good = None
-        game: str = None
-        for game, good_list in good_dict.items():
-            for good in good_list:
-                if good.goodID == arg[1]:
-                    Flag = False
-                    break_flag = True
-                    break
-            if break_flag:
-                break
-        if Flag:
+        found = await good_catalog.find(arg[1])
+        if found is None:
             await matcher.finish('⚠️您发送的商品ID不在可兑换的商品列表内，程序已退出')
+        game, good = found
         state['good'] = good
         uids = []
         if good.time:
@@ -198,7 +184,7 @@ async def _(event: PrivateMessageEvent, matcher: Matcher, state: T_State):
                 if isinstance(game_records, int):
                     pass
                 else:
-                    game_name = list(filter(lambda abbr: abbr[0] == game, GameInfo.ABBR_TO_ID.values()))[0][1]                
+                    game_name = GameInfo.ABBR_TO_NAME[game]
                     msg = f'您米游社账户下的『{game_name}』账号：'
                     for record in game_records:
                         if GameInfo.ABBR_TO_ID[record.gameID][0] == game:
@@ -219,14 +205,23 @@ async def _(event: PrivateMessageEvent, matcher: Matcher, state: T_State):
             await matcher.finish(f'⚠️该商品暂时不可以兑换，请重新设置')
 
     elif arg[0] == '-':
-        if account.exchange:
-            for exchange_good in account.exchange:
+        removed = False
+        async with UserData.transaction():
+            # 重新读取账户数据，避免覆盖对话期间做出的其他修改
+            account = UserData.read_account(event.user_id, account.phone)
+            for exchange_good in account.exchange if account else []:
                 if exchange_good[0] == arg[1]:
                     account.exchange.remove(exchange_good)
                     UserData.set_account(account, event.user_id, account.phone)
-                    scheduler.remove_job(job_id=str(
-                        account.phone)+'_'+arg[1])
-                    await matcher.finish('兑换计划删除成功')
+                    removed = True
+                    break
+        if account is None:
+            await matcher.finish("⚠️账户不存在，请重新选择")
+        elif removed:
+            scheduler.remove_job(job_id=str(
+                account.phone)+'_'+arg[1])
+            await matcher.finish('兑换计划删除成功')
+        elif account.exchange:
             await matcher.finish(f"您没有设置商品ID为 {arg[1]} 的兑换哦~")
         else:
             await matcher.finish("您还没有配置兑换计划哦~")
@@ -251,8 +246,6 @@ async def _(event: PrivateMessageEvent, matcher: Matcher, state: T_State, uid=Ar
 
     if account.exchange and (good.goodID, uid) in account.exchange:
         await matcher.send('⚠️您已经配置过该商品的兑换哦！但兑换任务仍会再次初始化。')
-    else:
-        account.exchange.append((good.goodID, uid))
 
     # 初始化兑换任务
     exchange_plan = await Exchange(account, good.goodID, uid).async_init()
@@ -272,7 +265,13 @@ async def _(event: PrivateMessageEvent, matcher: Matcher, state: T_State, uid=Ar
         scheduler.add_job(id=str(account.phone)+'_'+good.goodID, replace_existing=True, trigger='date', func=ExchangeStart(
             account, event.user_id, exchange_plan, conf.EXCHANGE_THREAD).start, next_run_time=datetime.fromtimestamp(good.time))
 
-    UserData.set_account(account, event.user_id, account.phone)
+    async with UserData.transaction():
+        # 重新读取账户数据，避免覆盖对话期间做出的其他修改
+        latest = UserData.read_account(event.user_id, account.phone)
+        if latest is not None:
+            if (good.goodID, uid) not in latest.exchange:
+                latest.exchange.append(ExchangePlan(good.goodID, uid))
+            UserData.set_account(latest, event.user_id, latest.phone)
 
     await matcher.finish(f'🎉设置兑换计划成功！将于 {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(good.time))} 开始兑换，到时将会私聊告知您兑换结果')
 
@@ -321,7 +320,7 @@ async def _(event: MessageEvent, matcher: Matcher, arg=ArgPlainText('content')):
         await get_good_image.finish('商品信息图片刷新成功')
     else:
         await get_good_image.finish('⚠️您的输入有误，请重新输入')
-    good_list = await get_good_list(arg[0])
+    good_list = await good_catalog.get_list(arg[0])
     if good_list:
         img_path = time.strftime(
             f'{conf.goodListImage.SAVE_PATH}/%m-%d-{arg[0]}.jpg', time.localtime())
@@ -342,19 +341,23 @@ async def load_exchange_data():
     """
     启动机器人时自动初始化兑换任务
     """
-    all_accounts = UserData.read_all()
-    for qq in all_accounts.keys():
-        qq = int(qq)
-        accounts = UserData.read_account_all(qq)
-        for account in accounts:
-            exchange_list = account.exchange
-            for exchange_good in exchange_list:
-                good_detail = await get_good_detail(exchange_good[0])
-                if good_detail.time < NtpTime.time():
-                    # 若重启时兑换超时则删除该兑换
-                    account.exchange.remove(exchange_good)
-                    UserData.set_account(account, qq, account.phone)
-                else:
-                    exchange_plan = await Exchange(account, exchange_good[0], exchange_good[1]).async_init()
-                    scheduler.add_job(id=str(account.phone)+'_'+exchange_good[0], replace_existing=True, trigger='date', func=ExchangeStart(
-                        account, qq, exchange_plan, conf.EXCHANGE_THREAD).start, next_run_time=datetime.fromtimestamp(good_detail.time))
+    expired_accounts: List[Tuple[int, UserAccount]] = []
+    async for qq, account in UserData.iter_accounts(has_exchange=True):
+        exchange_list = account.exchange.copy()
+        for exchange_good in exchange_list:
+            good_detail = await get_good_detail(exchange_good[0])
+            if good_detail.time < NtpTime.time():
+                # 若重启时兑换超时则删除该兑换
+                account.exchange.remove(exchange_good)
+                if (qq, account) not in expired_accounts:
+                    expired_accounts.append((qq, account))
+            else:
+                exchange_plan = await Exchange(account, exchange_good[0], exchange_good[1]).async_init()
+                scheduler.add_job(id=str(account.phone)+'_'+exchange_good[0], replace_existing=True, trigger='date', func=ExchangeStart(
+                    account, qq, exchange_plan, conf.EXCHANGE_THREAD).start, next_run_time=datetime.fromtimestamp(good_detail.time))
+
+    # 所有过期的兑换计划一次性写入
+    async with UserData.transaction():
+        for qq, account in expired_accounts:
+            await UserData.load_user(qq)
+            UserData.set_account(account, qq, account.phone)
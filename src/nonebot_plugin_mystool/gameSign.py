@@ -6,12 +6,15 @@ import traceback
 from typing import List, Literal, Union
 
 import httpx
-import tenacity
 
 from .bbsAPI import GameInfo, GameRecord, get_game_record, device_login, device_save
+from .cache import game_record_cache, public_cache, until_next_month
 from .config import mysTool_config as conf
 from .data import UserAccount
-from .utils import check_login, custom_attempt_times, generateDS, logger
+from .httpClient import shared_get
+from .retry import request_retrying
+from .session import AccountSession
+from .utils import ApiResponse, logger
 
 ACT_ID = {
     "ys": "e202009291139501",
@@ -72,6 +75,16 @@ HEADERS_OTHER = {
     "x-rpc-platform": conf.device.X_RPC_PLATFORM,
     "DS": None
 }
+HEADERS_OTHER_ANDROID = {
+    **HEADERS_OTHER,
+    "x-rpc-device_model": conf.device.X_RPC_DEVICE_MODEL_ANDROID,
+    "User-Agent": conf.device.USER_AGENT_ANDROID,
+    "x-rpc-device_name": conf.device.X_RPC_DEVICE_NAME_ANDROID,
+    "x-rpc-channel": conf.device.X_RPC_CHANNEL_ANDROID,
+    "x-rpc-sys_version": conf.device.X_RPC_SYS_VERSION_ANDROID,
+    "x-rpc-client_type": "2"
+}
+HEADERS_OTHER_ANDROID.pop("x-rpc-platform")
 
 
 class Award:
@@ -158,28 +171,34 @@ class GameSign:
     '''目前支持签到的游戏'''
 
     def __init__(self, account: UserAccount) -> None:
-        self.cookie = account.cookie
         self.account = account
         self.signResult: dict = None
         '''签到返回结果'''
 
-    async def reward(self, game: Literal["ys", "bh3"], retry: bool = True):
+    async def reward(self, game: Literal["ys", "bh3"], retry: bool = True, refresh: bool = False):
         """
         获取签到奖励信息，若返回`None`说明失败
 
+        签到奖励每月更新，所有用户共用，结果缓存至当月月底
+
         参数:
             `game`: 目标游戏缩写
             `retry`: 是否允许重试
+            `refresh`: 是否忽略缓存重新获取(如缓存的奖励列表与签到天数不符时)
         """
+        cached = None if refresh else public_cache.get(("reward", game))
+        if cached is not None:
+            return list(cached)
         try:
-            async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+            async for attempt in request_retrying(retry, reraise=True):
                 with attempt:
                     res = None
-                    async with httpx.AsyncClient() as client:
-                        res = await client.get(URLS[game]["reward"], headers=HEADERS_REWARD, timeout=conf.TIME_OUT)
+                    res = await shared_get(URLS[game]["reward"], headers=HEADERS_REWARD, timeout=conf.TIME_OUT)
+                    api_res = ApiResponse(res)
                     award_list: List[Award] = []
-                    for award in res.json()["data"]["awards"]:
+                    for award in api_res.data["awards"]:
                         award_list.append(Award(award))
+                    public_cache.set(("reward", game), tuple(award_list), until_next_month())
                     return award_list
         except KeyError:
             logger.error(conf.LOG_HEAD + "获取签到奖励信息 - 服务器没有正确返回")
@@ -206,9 +225,6 @@ class GameSign:
         - 若返回 `-3` 说明请求失败
         - 若返回 `-4` 未找到对应游戏UID的游戏账户
         """
-        headers = HEADERS_OTHER.copy()
-        headers["x-rpc-device_id"] = self.account.deviceID
-
         game_record: List[GameRecord] = await get_game_record(self.account)
         if game_record == -1:
             return -1
@@ -224,20 +240,20 @@ class GameSign:
         if not region:
             return -4
 
-        headers["DS"] = generateDS()
         try:
-            async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+            async for attempt in request_retrying(retry, reraise=True):
                 with attempt:
                     res = None
-                    async with httpx.AsyncClient() as client:
-                        res = await client.get(URLS[game]["info"].format(region=region, uid=gameUID), headers=headers, cookies=self.cookie, timeout=conf.TIME_OUT)
-                    if not check_login(res.text):
+                    res = await AccountSession.of(self.account).get(URLS[game]["info"].format(region=region, uid=gameUID), headers=HEADERS_OTHER, device="deviceID", ds="ios", timeout=conf.TIME_OUT)
+                    api_res = ApiResponse(res)
+                    if api_res.login_expired:
                         logger.info(
                             conf.LOG_HEAD + "获取签到记录 - 用户 {} 登录失效".format(self.account.phone))
                         logger.debug(conf.LOG_HEAD +
                                      "网络请求返回: {}".format(res.text))
+                        game_record_cache.invalidate(self.account.bbsUID)
                         return -1
-                    return Info(res.json()["data"])
+                    return Info(api_res.data)
         except KeyError:
             logger.error(conf.LOG_HEAD + "获取签到记录 - 服务器没有正确返回")
             logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
@@ -272,22 +288,13 @@ class GameSign:
             logger.info("暂不支持游戏 {} 的游戏签到".format(game))
             return -4
 
-        headers = HEADERS_OTHER.copy()
+        await AccountSession.of(self.account).pace()
         if platform == "ios":
-            headers["x-rpc-device_id"] = self.account.deviceID
-            headers["DS"] = generateDS()
+            headers, device = HEADERS_OTHER, "deviceID"
         else:
-            headers["x-rpc-device_id"] = self.account.deviceID_2
-            headers["x-rpc-device_model"] = conf.device.X_RPC_DEVICE_MODEL_ANDROID
-            headers["User-Agent"] = conf.device.USER_AGENT_ANDROID
-            headers["x-rpc-device_name"] = conf.device.X_RPC_DEVICE_NAME_ANDROID
-            headers["x-rpc-channel"] = conf.device.X_RPC_CHANNEL_ANDROID
-            headers["x-rpc-sys_version"] = conf.device.X_RPC_SYS_VERSION_ANDROID
-            headers["x-rpc-client_type"] = "2"
-            headers.pop("x-rpc-platform")
+            headers, device = HEADERS_OTHER_ANDROID, "deviceID_2"
             await device_login(self.account)
             await device_save(self.account)
-            headers["DS"] = generateDS(platform="android")
 
         record_list: List[GameRecord] = await get_game_record(self.account)
         filter_record = list(filter(lambda record: record.uid ==
@@ -301,18 +308,19 @@ class GameSign:
             "uid": gameUID
         }
         try:
-            async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+            async for attempt in request_retrying(retry, reraise=True):
                 with attempt:
                     res = None
-                    async with httpx.AsyncClient() as client:
-                        res = await client.post(URLS[game]["sign"], headers=headers, cookies=self.cookie, timeout=conf.TIME_OUT, json=data)
-                    if not check_login(res.text):
+                    res = await AccountSession.of(self.account).post(URLS[game]["sign"], headers=headers, device=device, ds=platform, timeout=conf.TIME_OUT, json=data)
+                    api_res = ApiResponse(res)
+                    if api_res.login_expired:
                         logger.info(
                             conf.LOG_HEAD + "签到 - 用户 {} 登录失效".format(self.account.phone))
                         logger.debug(conf.LOG_HEAD +
                                      "网络请求返回: {}".format(res.text))
+                        game_record_cache.invalidate(self.account.bbsUID)
                         return -1
-                    self.signResult = res.json()
+                    self.signResult = api_res.content
                     if game == "ys" and self.signResult["message"] != "旅行者，你已经签到过了":
                         return 1
                     if game not in ["bh3", "wd", "bh2"] and self.signResult["data"]["risk_code"] != 0:
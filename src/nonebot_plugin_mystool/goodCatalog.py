@@ -0,0 +1,181 @@
+"""
+### 米游币商品目录相关
+"""
+import asyncio
+import os
+import time
+import traceback
+from typing import Dict, List, Literal, Tuple, Union
+
+import nonebot
+
+from .codec import dumps, loads
+from .config import PATH
+from .config import mysTool_config as conf
+from .exchange import Good, get_good_list
+from .storage import write_durably
+from .utils import logger
+
+SNAPSHOT_PATH = PATH / "goods.json"
+SNAPSHOT_VERSION = 1
+'''商品目录快照的数据格式版本，版本不同的快照不会被读取'''
+
+Game = Literal["bh3", "ys", "bh2", "wd", "bbs"]
+
+
+class GoodCatalog:
+    """
+    米游币商品目录，在内存中保存所有游戏的可兑换商品，所有用户共用
+
+    - 商品列表缓存 `GOOD_CATALOG_TTL` 秒，过期后在用到时先返回旧数据，同时在后台更新(没有用到时不会更新)
+    - 维护 `商品ID -> (游戏, 商品)` 的索引
+    - 每次更新后保存快照到 `goods.json`，重启或接口出错时仍可使用
+    """
+    GAMES: Tuple[Game, ...] = ("bh3", "ys", "bh2", "wd", "bbs")
+    '''商品目录包含的游戏'''
+
+    def __init__(self, path=SNAPSHOT_PATH) -> None:
+        self.path = path
+        '''快照文件路径'''
+        self.goods: Dict[Game, List[Good]] = {}
+        '''各游戏的商品列表 `{游戏: 商品列表}`'''
+        self.index: Dict[str, Tuple[Game, Good]] = {}
+        '''商品索引 `{商品ID: (游戏, 商品)}`'''
+        self.updated_at: Dict[Game, float] = {}
+        '''各游戏商品列表的更新时间(时间戳)'''
+        self.__refreshing: Dict[Game, "asyncio.Task[Union[List[Good], None]]"] = {}
+
+    def is_fresh(self, game: Game) -> bool:
+        """
+        商品列表是否在有效期内
+
+        参数:
+            `game`: 游戏简称
+        """
+        return time.time() - self.updated_at.get(game, 0) < conf.GOOD_CATALOG_TTL
+
+    def __rebuild_index(self):
+        self.index = {good.goodID: (game, good)
+                      for game, good_list in self.goods.items() for good in good_list}
+
+    async def __fetch(self, game: Game):
+        good_list = await get_good_list(game)
+        if good_list is None:
+            # 获取失败(或没有可兑换商品)时保留原有数据
+            return self.goods.get(game)
+        self.goods[game] = good_list
+        self.updated_at[game] = time.time()
+        self.__rebuild_index()
+        await self.save()
+        return good_list
+
+    def refresh(self, game: Game) -> "asyncio.Task[Union[List[Good], None]]":
+        """
+        更新某个游戏的商品列表，同时进行的更新会合并为一次，返回更新任务
+
+        参数:
+            `game`: 游戏简称
+        """
+        task = self.__refreshing.get(game)
+        if task is None:
+            task = self.__refreshing[game] = asyncio.create_task(self.__fetch(game))
+            task.add_done_callback(lambda _: self.__refreshing.pop(game, None))
+        return task
+
+    async def refresh_all(self):
+        """
+        更新所有游戏的商品列表
+        """
+        await asyncio.gather(*(self.refresh(game) for game in self.GAMES))
+
+    async def get_list(self, game: Game, refresh: bool = False) -> Union[List[Good], None]:
+        """
+        获取某个游戏的可兑换商品列表，若获取失败则返回`None`
+
+        参数:
+            `game`: 游戏简称
+            `refresh`: 是否等待更新完成后再返回(否则过期时先返回旧数据)
+        """
+        good_list = self.goods.get(game)
+        if good_list is None or refresh:
+            return await asyncio.shield(self.refresh(game))
+        if not self.is_fresh(game):
+            self.refresh(game)
+        return good_list
+
+    async def find(self, goodID: str) -> Union[Tuple[Game, Good], None]:
+        """
+        通过商品ID查找商品，返回 `(游戏, 商品)`，若不存在则返回`None`
+
+        参数:
+            `goodID`: 商品ID
+        """
+        if len(self.goods) < len(self.GAMES):
+            await asyncio.gather(*(self.get_list(game) for game in self.GAMES
+                                   if game not in self.goods))
+        result = self.index.get(goodID)
+        if result is None and not all(self.is_fresh(game) for game in self.GAMES):
+            # 可能是新上架的商品，更新后再查找一次
+            await self.refresh_all()
+            result = self.index.get(goodID)
+        return result
+
+    def __read_snapshot(self) -> Union[dict, None]:
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, "rb") as fp:
+            return loads(fp.read())
+
+    async def load(self):
+        """
+        从快照读取商品目录(读取的数据视为已过期，使用时会在后台更新)
+        """
+        try:
+            snapshot = await asyncio.get_running_loop().run_in_executor(None, self.__read_snapshot)
+            if not snapshot or snapshot.get("version") != SNAPSHOT_VERSION:
+                return
+            for game, item in snapshot["games"].items():
+                good_list = []
+                for good_dict, time_by_detail in item["goods"]:
+                    good = Good(good_dict)
+                    good.time_by_detail = time_by_detail
+                    good_list.append(good)
+                self.goods.setdefault(game, good_list)
+                self.updated_at.setdefault(game, min(item["updated_at"], time.time() - conf.GOOD_CATALOG_TTL))
+            self.__rebuild_index()
+        except:
+            logger.error(conf.LOG_HEAD + "商品目录 - 读取快照失败")
+            logger.debug(conf.LOG_HEAD + traceback.format_exc())
+
+    async def save(self):
+        """
+        保存商品目录快照
+        """
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "games": {
+                game: {
+                    "updated_at": self.updated_at.get(game, 0),
+                    "goods": [(good.good_dict, good.time_by_detail) for good in good_list]
+                } for game, good_list in self.goods.items()
+            }
+        }
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write_durably, self.path, dumps(snapshot))
+        except:
+            logger.error(conf.LOG_HEAD + "商品目录 - 保存快照失败")
+            logger.debug(conf.LOG_HEAD + traceback.format_exc())
+
+
+good_catalog = GoodCatalog()
+'''所有用户共用的商品目录'''
+
+driver = nonebot.get_driver()
+
+
+@driver.on_startup
+async def load_good_catalog():
+    """
+    启动机器人时读取商品目录快照
+    """
+    await good_catalog.load()
@@ -0,0 +1,98 @@
+"""
+### 网络请求客户端相关
+"""
+import asyncio
+import importlib.util
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import nonebot
+from nonebot.log import logger
+
+from .circuitBreaker import CircuitBreakerTransport
+from .config import mysTool_config as conf
+from .rateLimit import RateLimitTransport
+from .retry import raise_for_retryable_status
+
+driver = nonebot.get_driver()
+
+clients: Dict[str, httpx.AsyncClient] = {}
+'''各主机共用的客户端 `{主机: 客户端}`'''
+
+in_flight: Dict[Tuple, "asyncio.Task[httpx.Response]"] = {}
+'''正在进行的共享GET请求 `{请求标识: 请求任务}`'''
+SHARED_IGNORED_HEADERS = frozenset(("ds",))
+'''判断是否为相同请求时忽略的请求头(每次请求都会变化，但不影响返回结果)'''
+
+
+def create_client() -> httpx.AsyncClient:
+    """
+    创建一个带连接池的客户端
+    """
+    http2 = conf.HTTP2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning(conf.LOG_HEAD + "网络请求 - 未安装 h2，无法启用 HTTP/2，请使用 pip install httpx[http2] 安装")
+        http2 = False
+    limits = httpx.Limits(max_connections=conf.HTTP_MAX_CONNECTIONS,
+                          max_keepalive_connections=conf.HTTP_MAX_KEEPALIVE,
+                          keepalive_expiry=conf.HTTP_KEEPALIVE_EXPIRY)
+    # 先检查熔断(熔断时直接失败)，再等待主机限速
+    transport = CircuitBreakerTransport(RateLimitTransport(
+        httpx.AsyncHTTPTransport(limits=limits, http2=http2)))
+    # 客户端被所有帐号共用，不能保存服务器返回的Cookie，否则会在不同帐号之间串用
+    cookies = CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+    return httpx.AsyncClient(transport=transport, cookies=cookies,
+                             event_hooks={"response": [raise_for_retryable_status]})
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """
+    获取请求某个URL所用的客户端，同一主机的请求共用一个客户端，以复用连接(Keep-Alive)
+
+    客户端不会保存Cookie，需要时请在每次请求时传入。客户端在关闭机器人时统一关闭，请勿自行关闭
+
+    参数:
+        `url`: 要请求的URL(可以是带有格式化占位符的URL模板)
+    """
+    host = urlsplit(url).netloc
+    client = clients.get(host)
+    if client is None or client.is_closed:
+        client = clients[host] = create_client()
+    return client
+
+
+async def shared_get(url: str, headers: Dict[str, str] = None, **kwargs) -> httpx.Response:
+    """
+    发送与用户无关的GET请求，同时进行的相同请求(方法、URL、请求头均相同)会合并为一次，共享返回结果
+
+    注意不能用于带有用户Cookie等用户相关信息的请求
+
+    参数:
+        `url`: 请求URL
+        `headers`: 请求头
+        `kwargs`: 其他传给`httpx.AsyncClient.get`的参数(`timeout`不影响是否为相同请求)
+    """
+    key = ("GET", url,
+           tuple(sorted((name.lower(), value) for name, value in (headers or {}).items()
+                        if name.lower() not in SHARED_IGNORED_HEADERS)),
+           tuple(sorted((name, repr(value)) for name, value in kwargs.items() if name != "timeout")))
+    task = in_flight.get(key)
+    if task is None:
+        task = asyncio.create_task(get_client(url).get(url, headers=headers, **kwargs))
+        in_flight[key] = task
+        task.add_done_callback(lambda _: in_flight.pop(key, None))
+    # 某个等待者被取消时，不影响其他等待者
+    return await asyncio.shield(task)
+
+
+@driver.on_shutdown
+async def close_clients():
+    """
+    关闭时关闭所有客户端
+    """
+    opened = list(clients.values())
+    clients.clear()
+    for client in opened:
+        await client.aclose()
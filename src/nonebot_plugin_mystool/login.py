@@ -2,7 +2,7 @@
 ### 米游社登录获取Cookie相关
 """
 import traceback
-from typing import Literal
+from typing import Dict, Literal
 
 import httpx
 import requests.utils
@@ -11,9 +11,13 @@ from nonebot import on_command
 from nonebot.adapters.onebot.v11 import PrivateMessageEvent
 from nonebot.params import ArgPlainText, T_State
 
+from .cache import game_record_cache
 from .config import mysTool_config as conf
 from .data import UserData
-from .utils import custom_attempt_times, generateDeviceID, logger
+from .httpClient import get_client
+from .retry import request_retrying
+from .utils import (ApiResponse, cookie_dict_to_str, generateDeviceID,
+                    logger)
 
 URL_1 = "https://webapi.account.mihoyo.com/Api/login_by_mobilecaptcha"
 URL_2 = "https://api-takumi.mihoyo.com/auth/api/getMultiTokenByLoginTicket?login_ticket={0}&token_types=3&uid={1}"
@@ -63,13 +67,31 @@ class GetCookie:
         self.bbsUID: str = None
         self.cookie: dict = None
         '''获取到的Cookie数据'''
-        self.client = httpx.AsyncClient()
+        self.received_cookie: Dict[str, str] = {}
+        '''登录过程中服务器设置的所有Cookie(相当于浏览器保存的Cookie，之后的请求会附带)'''
         account = UserData.read_account(qq, phone)
         if account is None:
             self.deviceID = generateDeviceID()
         else:
             self.deviceID = account.deviceID
 
+    async def __request(self, method: str, url: str, headers: Dict[str, str] = None, **kwargs) -> httpx.Response:
+        """
+        通过共用的连接池发送请求，附带并记录登录过程中服务器设置的Cookie
+
+        参数:
+            `method`: 请求方法
+            `url`: 请求URL
+            `headers`: 请求头
+            `kwargs`: 其他传给`httpx.AsyncClient.request`的参数
+        """
+        headers = dict(headers) if headers else {}
+        if self.received_cookie:
+            headers["Cookie"] = cookie_dict_to_str(self.received_cookie)
+        res = await get_client(url).request(method, url, headers=headers, **kwargs)
+        self.received_cookie.update(requests.utils.dict_from_cookiejar(res.cookies.jar))
+        return res
+
     async def get_1(self, captcha: str, retry: bool = True) -> Literal[1, -1, -2, -3, -4]:
         """
         第一次获取Cookie(目标是login_ticket)
@@ -88,12 +110,12 @@ class GetCookie:
         headers["x-rpc-device_id"] = self.deviceID
         res = None
         try:
-            async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+            async for attempt in request_retrying(retry):
                 with attempt:
-                    res = await self.client.post(URL_1, headers=headers, data="mobile={0}&mobile_captcha={1}&source=user.mihoyo.com".format(self.phone, captcha), timeout=conf.TIME_OUT)
+                    res = await self.__request("POST", URL_1, headers=headers, data="mobile={0}&mobile_captcha={1}&source=user.mihoyo.com".format(self.phone, captcha), timeout=conf.TIME_OUT)
                     try:
-                        res_json = res.json()
-                        if res_json["data"]["msg"] == "验证码错误" or res_json["data"]["info"] == "Captcha not match Err":
+                        api_res = ApiResponse(res)
+                        if api_res.data["msg"] == "验证码错误" or api_res.data["info"] == "Captcha not match Err":
                             logger.info(f"{conf.LOG_HEAD}登录米哈游账号 - 验证码错误")
                             return -4
                     except:
@@ -126,11 +148,11 @@ class GetCookie:
         - 若返回 `False` 说明网络请求失败或服务器没有正确返回
         """
         try:
-            async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+            async for attempt in request_retrying(retry, reraise=True):
                 with attempt:
-                    res = await self.client.get(URL_2.format(self.cookie["login_ticket"], self.bbsUID), timeout=conf.TIME_OUT)
+                    res = await self.__request("GET", URL_2.format(self.cookie["login_ticket"], self.bbsUID), timeout=conf.TIME_OUT)
                     stoken = list(filter(
-                        lambda data: data["name"] == "stoken", res.json()["data"]["list"]))[0]["token"]
+                        lambda data: data["name"] == "stoken", ApiResponse(res).data["list"]))[0]["token"]
                     self.cookie["stoken"] = stoken
                     return True
         except KeyError:
@@ -158,9 +180,9 @@ class GetCookie:
         - 若返回 `-3` 说明验证码错误
         """
         try:
-            async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+            async for attempt in request_retrying(retry):
                 with attempt:
-                    res = await self.client.post(URL_3, headers=HEADERS_2, json={
+                    res = await self.__request("POST", URL_3, headers=HEADERS_2, json={
                         "is_bh2": False,
                         "mobile": str(self.phone),
                         "captcha": captcha,
@@ -168,8 +190,8 @@ class GetCookie:
                         "token_type": 6
                     }, timeout=conf.TIME_OUT)
                     try:
-                        res_json = res.json()
-                        if res_json["data"]["msg"] == "验证码错误" or res_json["data"]["info"] == "Captcha not match Err":
+                        api_res = ApiResponse(res)
+                        if api_res.data["msg"] == "验证码错误" or api_res.data["info"] == "Captcha not match Err":
                             logger.info(f"{conf.LOG_HEAD}登录米哈游账号 - 验证码错误")
                             return -3
                     except:
@@ -177,7 +199,6 @@ class GetCookie:
                     if "cookie_token" not in res.cookies:
                         return -1
                     self.cookie.update(requests.utils.dict_from_cookiejar(res.cookies.jar))
-                    await self.client.aclose()
                     return 1
         except tenacity.RetryError:
             logger.error(
@@ -195,7 +216,7 @@ get_cookie.__help_info__ = '跟随指引，通过电话获取短信方式绑定
 
 @get_cookie.handle()
 async def handle_first_receive(event: PrivateMessageEvent, state: T_State):
-    account_num = len(UserData.read_all())
+    account_num = len(UserData.read_qq_all())
     if account_num < conf.MAX_USER:
         await get_cookie.send("""\
         登录过程概览：\
@@ -279,4 +300,10 @@ async def _(event: PrivateMessageEvent, state: T_State, captcha2: str = ArgPlain
 
     UserData.set_cookie(state['getCookie'].cookie,
                         int(event.user_id), state['phone'])
+    account = UserData.read_account(int(event.user_id), state['phone'])
+    game_record_cache.invalidate(account.bbsUID)
+    other_qq = [qq for qq in UserData.find_qq_by_bbsUID(account.bbsUID) if qq != int(event.user_id)]
+    if other_qq:
+        logger.warning(
+            f"{conf.LOG_HEAD}登录米哈游账号 - 米游社UID {account.bbsUID} 同时被QQ用户 {other_qq} 绑定")
     await get_cookie.finish("🎉米游社账户 {} 绑定成功".format(state['phone']))
@@ -1,16 +1,17 @@
 """
 ### 米游币任务相关
 """
-import asyncio
 import traceback
 from typing import Any, Dict, List, Literal, NewType, Tuple, Union
 
 import httpx
-import tenacity
 
+from .cache import public_cache
 from .config import mysTool_config as conf
 from .data import UserAccount
-from .utils import check_login, custom_attempt_times, generateDS, logger
+from .retry import request_retrying
+from .session import AccountSession
+from .utils import ApiResponse, logger
 from .bbsAPI import device_login, device_save
 
 URL_SIGN = "https://bbs-api.mihoyo.com/apihub/app/api/signIn"
@@ -35,6 +36,12 @@ HEADERS = {
     "Connection": "Keep-Alive",
     "DS": None
 }
+READ_MARKER = b'"self_operation":'
+'''阅读文章返回中表示阅读已被记录的字段(JSON字符串中的引号会被转义，不会误匹配文章内容)'''
+READ_BUFFER_LIMIT = 64 * 1024
+'''流式读取文章时最多保存的返回内容大小，未找到标记时用于解析错误信息'''
+READ_DRAIN_LIMIT = 1024 * 1024
+'''确认阅读已被记录后最多丢弃的剩余内容大小，超过时断开连接(连接无法复用)'''
 HEADERS_MISSION = {
     "Host": "api-takumi.mihoyo.com",
     "Origin": "https://webstatic.mihoyo.com",
@@ -131,6 +138,46 @@ class Mission:
         return self.mission_dict["threshold"]
 
 
+async def read_post_stream(res: httpx.Response) -> Union[ApiResponse, None]:
+    """
+    以流的方式读取阅读文章(getPostFull)的返回，读到 `self_operation` 字段即停止保存和解析
+
+    - 若阅读已被记录，返回 `None`，此时根据配置 `READ_STREAM_ABORT` 立即断开连接，
+      或丢弃剩余内容以便连接放回连接池复用(剩余内容超过 `READ_DRAIN_LIMIT` 时仍会断开连接)
+    - 否则(如登录失效、帖子不存在等较短的返回)读完后解析，返回 `ApiResponse`
+    - 返回内容过长且没有找到标记时抛出 `ValueError`
+
+    参数:
+        `res`: 以 `stream=True` 发送请求得到的返回
+    """
+    buffer = bytearray()
+    tail = b""
+    overflow = False
+    try:
+        chunks = res.aiter_bytes()
+        async for chunk in chunks:
+            window = tail + chunk
+            if READ_MARKER in window:
+                if not conf.READ_STREAM_ABORT:
+                    drained = 0
+                    async for rest in chunks:
+                        drained += len(rest)
+                        if drained > READ_DRAIN_LIMIT:
+                            break
+                return None
+            tail = window[-(len(READ_MARKER) - 1):]
+            if not overflow:
+                buffer += chunk
+                if len(buffer) > READ_BUFFER_LIMIT:
+                    overflow = True
+                    buffer.clear()
+    finally:
+        await res.aclose()
+    if overflow:
+        raise ValueError("返回内容中没有阅读记录")
+    return ApiResponse(res, bytes(buffer))
+
+
 class Action:
     """
     米游币任务相关(需先初始化对象)
@@ -141,9 +188,6 @@ class Action:
 
     def __init__(self, account: UserAccount) -> None:
         self.account = account
-        self.headers = HEADERS.copy()
-        self.headers["x-rpc-device_id"] = account.deviceID_2
-        self.client = httpx.AsyncClient(cookies=account.cookie)
 
     async def async_init(self):
         """
@@ -164,16 +208,17 @@ class Action:
         - 若返回 `-2` 说明服务器没有正确返回
         - 若返回 `-3` 说明请求失败
         """
+        await AccountSession.of(self.account).pace()
         data = {"gids": GAME_ID[game]["gids"]}
-        self.headers["DS"] = generateDS(data)
-        res = await self.client.post(URL_SIGN, headers=self.headers, json=data, timeout=conf.TIME_OUT)
-        if not check_login(res.text):
+        res = await AccountSession.of(self.account).post(URL_SIGN, headers=HEADERS, json=data, device="deviceID_2", ds="body", timeout=conf.TIME_OUT)
+        api_res = ApiResponse(res)
+        if api_res.login_expired:
             logger.info(
                 conf.LOG_HEAD + "米游币任务 - 讨论区签到: 用户 {} 登录失效".format(self.account.phone))
             logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
             return -1
         try:
-            return res.json()["data"]["points"]
+            return api_res.data["points"]
         except KeyError:
             logger.error(conf.LOG_HEAD + "米游币任务 - 讨论区签到: 服务器没有正确返回")
             logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
@@ -194,11 +239,11 @@ class Action:
         """
         postID_list = []
         try:
-            self.headers["DS"] = generateDS(platform="android")
-            async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+            async for attempt in request_retrying(retry, reraise=True):
                 with attempt:
-                    res = await self.client.get(URL_GET_POST.format(GAME_ID[game]["fid"]), headers=self.headers, timeout=conf.TIME_OUT)
-                    data = res.json()["data"]["list"]
+                    res = await AccountSession.of(self.account).get(URL_GET_POST.format(GAME_ID[game]["fid"]), headers=HEADERS, device="deviceID_2", ds="android", timeout=conf.TIME_OUT)
+                    api_res = ApiResponse(res)
+                    data = api_res.data["list"]
                     for post in data:
                         if post["self_operation"]["attitude"] == 0:
                             postID_list.append(post['post']['post_id'])
@@ -237,33 +282,38 @@ class Action:
             for postID in postID_list:
                 if count == readTimes:
                     break
-                self.headers["DS"] = generateDS(platform="android")
+                await AccountSession.of(self.account).pace()
+                api_res = None
                 try:
-                    async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+                    async for attempt in request_retrying(retry, reraise=True):
                         with attempt:
-                            res = await self.client.get(URL_READ.format(postID), headers=self.headers, timeout=conf.TIME_OUT)
-                            if not check_login(res.text):
+                            session = AccountSession.of(self.account)
+                            request = session.build_request("GET", URL_READ.format(postID), headers=HEADERS, device="deviceID_2", ds="android", timeout=conf.TIME_OUT)
+                            api_res = await read_post_stream(await session.send(request, stream=True))
+                            if api_res is None:
+                                count += 1
+                                continue
+                            if api_res.login_expired:
                                 logger.info(
                                     conf.LOG_HEAD + "米游币任务 - 阅读: 用户 {} 登录失效".format(self.account.phone))
                                 logger.debug(conf.LOG_HEAD +
-                                             "网络请求返回: {}".format(res.text))
+                                             "网络请求返回: {}".format(api_res.text))
                                 return -1
-                            if res.json()["message"] == "帖子不存在":
+                            if api_res.message == "帖子不存在":
                                 continue
-                            if "self_operation" not in res.json()["data"]["post"]:
+                            if "self_operation" not in api_res.data["post"]:
                                 raise ValueError
                             count += 1
                 except KeyError and ValueError:
                     logger.error(conf.LOG_HEAD + "米游币任务 - 阅读: 服务器没有正确返回")
                     logger.debug(conf.LOG_HEAD +
-                                 "网络请求返回: {}".format(res.text))
+                                 "网络请求返回: {}".format(api_res.text if api_res is not None else None))
                     logger.debug(conf.LOG_HEAD + traceback.format_exc())
                     return -2
                 except:
                     logger.error(conf.LOG_HEAD + "米游币任务 - 阅读: 网络请求失败")
                     logger.debug(conf.LOG_HEAD + traceback.format_exc())
                     return -3
-                await asyncio.sleep(conf.SLEEP_TIME)
             postID_list = await self.get_posts(game)
             if postID_list is None:
                 return -4
@@ -293,20 +343,21 @@ class Action:
             for postID in postID_list:
                 if count == likeTimes:
                     break
-                self.headers["DS"] = generateDS(platform="android")
+                await AccountSession.of(self.account).pace()
                 try:
-                    async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+                    async for attempt in request_retrying(retry, reraise=True):
                         with attempt:
-                            res = await self.client.post(URL_LIKE, headers=self.headers, json={'is_cancel': False, 'post_id': postID}, timeout=conf.TIME_OUT)
-                            if not check_login(res.text):
+                            res = await AccountSession.of(self.account).post(URL_LIKE, headers=HEADERS, json={'is_cancel': False, 'post_id': postID}, device="deviceID_2", ds="android", timeout=conf.TIME_OUT)
+                            api_res = ApiResponse(res)
+                            if api_res.login_expired:
                                 logger.info(
                                     conf.LOG_HEAD + "米游币任务 - 点赞: 用户 {} 登录失效".format(self.account.phone))
                                 logger.debug(conf.LOG_HEAD +
                                              "网络请求返回: {}".format(res.text))
                                 return -1
-                            if res.json()["message"] == "帖子不存在":
+                            if api_res.message == "帖子不存在":
                                 continue
-                            elif res.json()["message"] != "OK":
+                            elif api_res.message != "OK":
                                 raise ValueError
                             count += 1
                 except KeyError and ValueError:
@@ -319,7 +370,6 @@ class Action:
                     logger.error(conf.LOG_HEAD + "米游币任务 - 点赞: 网络请求失败")
                     logger.debug(conf.LOG_HEAD + traceback.format_exc())
                     return -3
-                await asyncio.sleep(conf.SLEEP_TIME)
             postID_list = await self.get_posts(game)
             if postID_list is None:
                 return -4
@@ -344,20 +394,21 @@ class Action:
         postID_list = await self.get_posts(game)
         if postID_list is None:
             return -5
+        await AccountSession.of(self.account).pace()
         try:
-            async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), reraise=True, wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+            async for attempt in request_retrying(retry, reraise=True):
                 with attempt:
-                    self.headers["DS"] = generateDS(platform="android")
-                    res = await self.client.get(URL_SHARE.format(postID_list[0]), headers=self.headers, timeout=conf.TIME_OUT)
-                    if not check_login(res.text):
+                    res = await AccountSession.of(self.account).get(URL_SHARE.format(postID_list[0]), headers=HEADERS, device="deviceID_2", ds="android", timeout=conf.TIME_OUT)
+                    api_res = ApiResponse(res)
+                    if api_res.login_expired:
                         logger.info(
                             conf.LOG_HEAD + "米游币任务 - 分享: 用户 {} 登录失效".format(self.account.phone))
                         logger.debug(conf.LOG_HEAD +
                                      "网络请求返回: {}".format(res.text))
                         return -1
-                    if res.json()["message"] == "帖子不存在":
+                    if api_res.message == "帖子不存在":
                         continue
-                    elif res.json()["message"] != "OK":
+                    elif api_res.message != "OK":
                         return -4
         except KeyError and ValueError:
             logger.error(conf.LOG_HEAD + "米游币任务 - 分享: 服务器没有正确返回")
@@ -378,25 +429,35 @@ class Action:
     }
 
 
-async def get_missions(account: UserAccount):
+async def get_missions(account: UserAccount, refresh: bool = False):
     """
     获取米游币任务信息
 
+    任务信息与用户无关，所有用户共用，结果缓存 `CACHE_TTL_PUBLIC` 秒
+
+    参数:
+        `account`: 用户账户数据
+        `refresh`: 是否忽略缓存重新获取
+
     - 若返回 `-1` 说明用户登录失效
     - 若返回 `-2` 说明服务器没有正确返回
     - 若返回 `-3` 说明请求失败
     """
+    cached = None if refresh else public_cache.get(("missions",))
+    if cached is not None:
+        return list(cached)
     try:
-        async with httpx.AsyncClient() as client:
-            res = await client.get(URL_MISSION, headers=HEADERS_MISSION, cookies=account.cookie, timeout=conf.TIME_OUT)
-        if not check_login(res.text):
+        res = await AccountSession.of(account).get(URL_MISSION, headers=HEADERS_MISSION, timeout=conf.TIME_OUT)
+        api_res = ApiResponse(res)
+        if api_res.login_expired:
             logger.info(conf.LOG_HEAD +
                         "获取米游币任务列表 - 用户 {} 登录失效".format(account.phone))
             logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
             return -1
         mission_list: List[Mission] = []
-        for mission in res.json()["data"]["missions"]:
+        for mission in api_res.data["missions"]:
             mission_list.append(Mission(mission))
+        public_cache.set(("missions",), tuple(mission_list))
         return mission_list
     except KeyError:
         logger.error(conf.LOG_HEAD + "获取米游币任务列表 - 服务器没有正确返回")
@@ -419,6 +480,7 @@ async def get_missions_state(account: UserAccount) -> Tuple[List[Tuple[Mission,
     - 若返回 `-2` 说明服务器没有正确返回
     - 若返回 `-3` 说明请求失败
     """
+    from_cache = public_cache.get(("missions",)) is not None
     missions: List[Mission] = await get_missions(account)
     if isinstance(missions, int):
         if missions == -1:
@@ -428,15 +490,21 @@ async def get_missions_state(account: UserAccount) -> Tuple[List[Tuple[Mission,
         elif missions == -3:
             return -3
     try:
-        async with httpx.AsyncClient() as client:
-            res = await client.get(URL_MISSION_STATE, headers=HEADERS_MISSION, cookies=account.cookie, timeout=conf.TIME_OUT)
-        if not check_login(res.text):
+        res = await AccountSession.of(account).get(URL_MISSION_STATE, headers=HEADERS_MISSION, timeout=conf.TIME_OUT)
+        api_res = ApiResponse(res)
+        if api_res.login_expired:
             logger.info(conf.LOG_HEAD +
                         "获取米游币任务完成情况 - 用户 {} 登录失效".format(account.phone))
             logger.debug(conf.LOG_HEAD + "网络请求返回: {}".format(res.text))
             return -1
         state_list: List[Tuple[Mission, Prograss_Now]] = []
-        data = res.json()["data"]
+        data = api_res.data
+        known_keys = set(mission.keyName for mission in missions)
+        if from_cache and any(state["mission_key"] not in known_keys for state in data["states"]):
+            # 出现了缓存的任务列表中没有的任务，说明任务已更新，重新获取
+            refreshed = await get_missions(account, refresh=True)
+            if not isinstance(refreshed, int):
+                missions = refreshed
         for mission in missions:
             try:
                 state_list.append((mission, list(filter(lambda state: state["mission_key"] ==
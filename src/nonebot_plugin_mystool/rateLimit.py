@@ -0,0 +1,104 @@
+"""
+### 网络请求限速相关
+"""
+import asyncio
+import time
+from typing import Dict, Set, Union
+
+import httpx
+
+from .circuitBreaker import endpoint_of
+from .config import mysTool_config as conf
+
+
+class TokenBucket:
+    """
+    令牌桶限速器，每秒补充 `rate` 个令牌，最多累积 `capacity` 个，每次操作前需取得一个令牌
+    """
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate = rate
+        '''每秒补充的令牌数'''
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        '''令牌数上限'''
+        self.tokens = self.capacity
+        '''当前令牌数'''
+        self.__last_refill = time.monotonic()
+        self.__lock: Union[asyncio.Lock, None] = None
+
+    def __get_lock(self):
+        """
+        获取锁(需在事件循环中调用，避免在导入时创建的锁绑定到其他事件循环)
+        """
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        return self.__lock
+
+    def __refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.__last_refill) * self.rate)
+        self.__last_refill = now
+
+    async def acquire(self):
+        """
+        等待并取得一个令牌(等待者按先后顺序取得)
+        """
+        if self.rate <= 0:
+            return
+        async with self.__get_lock():
+            self.__refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.__refill()
+            self.tokens -= 1
+
+
+host_buckets: Dict[str, TokenBucket] = {}
+'''各主机的限速器 `{主机: 限速器}`'''
+
+action_bucket = TokenBucket(conf.RATE_LIMIT_ACTION)
+'''任务操作(签到、阅读、点赞、分享)的限速器，所有帐号共用'''
+
+exempt_endpoints: Set[str] = set()
+'''不受按主机限速限制的接口(主机+路径)'''
+
+
+def exempt_from_rate_limit(url: str):
+    """
+    使某个接口的请求不受按主机限速的限制，用于需要准时发出的请求(如定时兑换)
+
+    参数:
+        `url`: 接口URL
+    """
+    exempt_endpoints.add(endpoint_of(url))
+
+
+def get_host_bucket(host: str) -> TokenBucket:
+    """
+    获取主机的限速器
+
+    参数:
+        `host`: 主机
+    """
+    bucket = host_buckets.get(host)
+    if bucket is None:
+        bucket = host_buckets[host] = TokenBucket(conf.RATE_LIMIT_HOST)
+    return bucket
+
+
+class RateLimitTransport(httpx.AsyncBaseTransport):
+    """
+    按主机限速的传输层，包装实际发送请求的传输层(`exempt_endpoints` 中的接口不限速)
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport) -> None:
+        self.transport = transport
+        '''实际发送请求的传输层'''
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if endpoint_of(request.url) not in exempt_endpoints:
+            await get_host_bucket(request.url.netloc.decode("ascii")).acquire()
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
@@ -0,0 +1,170 @@
+"""
+### 网络请求重试相关
+"""
+import time
+
+import httpx
+import tenacity
+from nonebot.log import logger
+
+from .circuitBreaker import CircuitOpenError
+from .config import mysTool_config as conf
+
+RETRYABLE_STATUS = frozenset((429, 500, 502, 503, 504))
+'''可以重试的HTTP状态码'''
+
+
+class RetryBudget:
+    """
+    重试预算，限制重试请求占全部请求的比例，避免上游出错时重试成倍放大请求量
+
+    每次尝试成功(包括重试成功)存入 `ratio` 个令牌，每次重试取出一个令牌，令牌不足时不再重试。
+    上游持续出错时没有令牌存入，重试很快会被限制。
+    此外令牌每秒至少补充 `min_per_second` 个，保证请求较少时仍可正常重试。
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, capacity: float) -> None:
+        self.ratio = ratio
+        '''每次尝试成功存入的令牌数'''
+        self.min_per_second = min_per_second
+        '''每秒最少补充的令牌数'''
+        self.capacity = capacity
+        '''令牌数上限'''
+        self.balance = capacity
+        '''当前令牌数'''
+        self.__last_refill = time.monotonic()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.balance = min(self.capacity, self.balance +
+                           (now - self.__last_refill) * self.min_per_second)
+        self.__last_refill = now
+
+    def deposit(self):
+        """
+        记录一次成功的尝试
+        """
+        self.__refill()
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        尝试取出一次重试的令牌，返回是否允许重试
+        """
+        self.__refill()
+        if self.balance >= 1:
+            self.balance -= 1
+            return True
+        return False
+
+
+budget = RetryBudget(conf.RETRY_BUDGET_RATIO, conf.RETRY_BUDGET_MIN_PER_SECOND, conf.RETRY_BUDGET_CAPACITY)
+'''所有网络请求共用的重试预算'''
+
+
+class BudgetedAttempt(tenacity.AttemptManager):
+    """
+    一次尝试，没有抛出异常(尝试成功)时向重试预算存入令牌
+    """
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            budget.deposit()
+        return super().__exit__(exc_type, exc_value, tb)
+
+
+class BudgetedRetrying(tenacity.AsyncRetrying):
+    """
+    每次尝试成功时向重试预算存入令牌的 `tenacity.AsyncRetrying`
+    """
+
+    async def __anext__(self) -> BudgetedAttempt:
+        attempt = await super().__anext__()
+        return BudgetedAttempt(retry_state=attempt.retry_state)
+
+
+async def raise_for_retryable_status(response: httpx.Response):
+    """
+    客户端的响应钩子，遇到限流(429)或服务器错误(5xx)时抛出 `httpx.HTTPStatusError`，以便重试
+
+    抛出前会读取响应内容，不重试的调用方仍可从 `error.response` 获取服务器返回的数据
+    """
+    if response.status_code in RETRYABLE_STATUS:
+        await response.aread()
+        response.raise_for_status()
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    判断请求出错后是否值得重试
+
+    - 网络错误、超时、限流(429)和服务器错误(5xx)可以重试
+    - 返回数据不完整或无法解析(`KeyError`、`IndexError`、`ValueError`)可以重试
+    - 其他HTTP状态错误(如403)和程序错误重试也不会成功，不重试
+    - 接口已熔断时直接失败，不重试
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS
+    return isinstance(error, (httpx.TransportError, httpx.DecodingError, LookupError, ValueError))
+
+
+def retry_after(error: BaseException):
+    """
+    获取限流响应中 `Retry-After` 要求等待的秒数，没有则返回 `None`
+
+    参数:
+        `error`: 请求出错时的异常
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        value = error.response.headers.get("Retry-After", "")
+        if value.isdigit():
+            return float(value)
+    return None
+
+
+def request_retrying(retry: bool = True, *, attempts: int = None, wait_max: float = None, reraise: bool = False):
+    """
+    网络请求的重试机制，用法同 `tenacity.AsyncRetrying`:
+
+    >>> async for attempt in request_retrying(retry):
+    >>>     with attempt:
+    >>>         res = await ...
+
+    - 两次尝试之间按指数退避并加入随机抖动，避免大量帐号同时以相同节奏重试
+    - 只重试可以恢复的错误(见 `is_retryable`)，遇到限流时遵循 `Retry-After`
+    - 所有请求共用重试预算(见 `RetryBudget`)，每次尝试成功时存入，预算耗尽时直接失败
+
+    参数:
+        `retry`: 是否允许重试
+        `attempts`: (可选)覆盖配置中的最多尝试次数(包括第一次)
+        `wait_max`: (可选)覆盖配置中两次尝试之间的最长等待时间
+        `reraise`: 重试结束时是否直接抛出最后一次的异常(否则抛出 `tenacity.RetryError`)
+    """
+    if not retry:
+        attempts = 1
+    elif attempts is None:
+        attempts = conf.MAX_RETRY_TIMES + 1
+    if wait_max is None:
+        wait_max = conf.SLEEP_TIME_RETRY_MAX
+    backoff = tenacity.wait_random_exponential(multiplier=conf.SLEEP_TIME_RETRY, max=wait_max)
+
+    def stop(retry_state: tenacity.RetryCallState):
+        if retry_state.attempt_number >= attempts:
+            return True
+        if not is_retryable(retry_state.outcome.exception()):
+            return True
+        if not budget.withdraw():
+            logger.warning(conf.LOG_HEAD + "网络请求 - 重试过于频繁，已超出重试预算，放弃重试")
+            return True
+        return False
+
+    def wait(retry_state: tenacity.RetryCallState):
+        delay = backoff(retry_state)
+        requested = retry_after(retry_state.outcome.exception())
+        if requested is not None:
+            delay = max(delay, min(requested, wait_max))
+        return delay
+
+    return BudgetedRetrying(stop=stop, wait=wait, reraise=reraise)
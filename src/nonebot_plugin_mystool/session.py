@@ -0,0 +1,175 @@
+"""
+### 米游社帐号网络请求会话相关
+"""
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Literal, Tuple, Union
+
+import httpx
+
+from .codec import dumps_compatible
+from .config import mysTool_config as conf
+from .data import UserAccount
+from .httpClient import get_client
+from .rateLimit import action_bucket
+from .utils import cookie_dict_to_str, generateDS
+
+
+class AccountSession:
+    """
+    米游社帐号的网络请求会话
+
+    会话持有帐号的Cookie(以请求头`Cookie`发送，不使用客户端的Cookie Jar)和设备ID，
+    请求通过各主机共用的连接池发送。一次帐号任务中的各个请求共用同一个会话，任务结束后关闭:
+
+    >>> async with AccountSession(account):
+    >>>     await perform(account) # 其中通过 AccountSession.of(account) 获取到的都是该会话
+    """
+    __current: ContextVar[Union["AccountSession", None]] = ContextVar("mystool_account_session", default=None)
+    '''当前上下文中正在进行的会话'''
+
+    def __init__(self, account: UserAccount) -> None:
+        self.account = account
+        '''会话所属的帐号'''
+        self.cookie: str = cookie_dict_to_str(account.cookie) if account.cookie else ""
+        '''请求头中的Cookie'''
+        self.closed = False
+        '''会话是否已关闭'''
+        self.last_action: float = 0
+        '''上次执行任务操作的时间(`time.monotonic()`)'''
+        self.__templates: Dict[Tuple[int, Union[str, None]], Tuple[Dict[str, str], Dict[str, str]]] = {}
+        '''已附带Cookie和设备ID的请求头模板 `{(原请求头id, 设备ID类型): (原请求头, 请求头模板)}`'''
+        self.__token = None
+
+    @classmethod
+    def of(cls, account: UserAccount) -> "AccountSession":
+        """
+        获取帐号在当前上下文中的会话，若没有正在进行的会话，则创建一个临时会话(无需关闭)
+
+        参数:
+            `account`: 米游社帐号
+        """
+        session = cls.__current.get()
+        if session is not None and not session.closed and session.account.phone == account.phone \
+                and session.account.bbsUID == account.bbsUID:
+            return session
+        return cls(account)
+
+    async def __aenter__(self):
+        self.__token = self.__current.set(self)
+        return self
+
+    async def __aexit__(self, *_):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        关闭会话，之后不能再通过该会话发送请求
+        """
+        if self.__token is not None:
+            self.__current.reset(self.__token)
+            self.__token = None
+        self.closed = True
+        self.cookie = ""
+
+    async def pace(self):
+        """
+        执行任务操作(签到、阅读、点赞、分享)前调用，代替固定的冷却等待
+
+        - 同一帐号的两次操作之间至少间隔 `SLEEP_TIME` 秒，和App中的操作节奏相近
+        - 所有帐号的操作合计不超过每秒 `RATE_LIMIT_ACTION` 次
+        """
+        wait = self.last_action + conf.SLEEP_TIME - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await action_bucket.acquire()
+        self.last_action = time.monotonic()
+
+    def headers(self, headers: Dict[str, str] = None,
+                device: Literal["deviceID", "deviceID_2", None] = None) -> Dict[str, str]:
+        """
+        返回附带Cookie和设备ID的请求头(每次返回新的dict，不会修改传入的请求头)
+
+        同一个请求头模板(如模块中的 `HEADERS_*` 常量)附带Cookie和设备ID的结果会在会话中缓存，
+        因此传入的请求头在之后不能再被修改
+
+        参数:
+            `headers`: 原请求头
+            `device`: 使用帐号的哪个设备ID作为`x-rpc-device_id`，为`None`时不设置
+        """
+        key = (id(headers), device)
+        cached = self.__templates.get(key)
+        if cached is None or cached[0] is not headers:
+            # 模板中值为None的项是占位符(如DS、设备ID)，未被填入时不发送
+            template = {name: value for name, value in headers.items() if value is not None} if headers else {}
+            if self.cookie:
+                template["Cookie"] = self.cookie
+            if device is not None:
+                template["x-rpc-device_id"] = getattr(self.account, device)
+            cached = self.__templates[key] = (headers, template)
+        return cached[1].copy()
+
+    def build_request(self, method: str, url: str, headers: Dict[str, str] = None,
+                      device: Literal["deviceID", "deviceID_2", None] = None,
+                      ds: Literal["ios", "android", "body", None] = None, json: Any = None,
+                      **kwargs) -> httpx.Request:
+        """
+        构建请求，请求内容只序列化一次，DS按实际发送的请求内容生成
+
+        参数:
+            `method`: 请求方法
+            `url`: 请求URL
+            `headers`: 请求头模板(会附带Cookie和设备ID)
+            `device`: 使用帐号的哪个设备ID作为`x-rpc-device_id`，为`None`时不设置
+            `ds`: 请求头中DS的生成方式，为`None`时不设置
+                - `ios`、`android`: 对应平台的DS
+                - `body`: 根据请求内容(`json`)生成的DS
+            `json`: 以JSON发送的请求内容
+            `kwargs`: 其他传给`httpx.AsyncClient.build_request`的参数
+        """
+        headers = self.headers(headers, device)
+        if json is not None:
+            body = dumps_compatible(json)
+            kwargs["content"] = body.encode()
+            if not any(name.lower() == "content-type" for name in headers):
+                headers["Content-Type"] = "application/json"
+        else:
+            body = ""
+        if ds == "body":
+            headers["DS"] = generateDS(body)
+        elif ds is not None:
+            headers["DS"] = generateDS(platform=ds)
+        return get_client(url).build_request(method, url, headers=headers, **kwargs)
+
+    async def send(self, request: httpx.Request, stream: bool = False) -> httpx.Response:
+        """
+        发送已构建的请求
+
+        参数:
+            `request`: 通过 `build_request` 构建的请求
+            `stream`: 是否以流的方式读取返回内容(需自行读取并关闭返回的 `httpx.Response`)
+        """
+        if self.closed:
+            raise RuntimeError("会话已关闭")
+        return await get_client(str(request.url)).send(request, stream=stream)
+
+    async def request(self, method: str, url: str, headers: Dict[str, str] = None,
+                      device: Literal["deviceID", "deviceID_2", None] = None,
+                      ds: Literal["ios", "android", "body", None] = None, **kwargs) -> httpx.Response:
+        """
+        构建并发送请求，参数同 `build_request`
+        """
+        return await self.send(self.build_request(method, url, headers, device, ds, **kwargs))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        """
+        发送GET请求，参数同`request`
+        """
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        """
+        发送POST请求，参数同`request`
+        """
+        return await self.request("POST", url, **kwargs)
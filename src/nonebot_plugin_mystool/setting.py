@@ -1,8 +1,6 @@
 """
 ### 用户设置相关
 """
-from typing import List
-
 from nonebot import get_driver, on_command
 from nonebot.adapters.onebot.v11 import PrivateMessageEvent
 from nonebot.adapters.onebot.v11.message import Message
@@ -11,7 +9,7 @@ from nonebot.params import Arg, ArgPlainText, T_State
 
 from .bbsAPI import GameInfo
 from .config import mysTool_config as conf
-from .data import UserAccount, UserData
+from .data import UserData
 
 COMMAND = list(get_driver().config.command_start)[0] + conf.COMMAND_START
 
@@ -66,12 +64,9 @@ async def _(event: PrivateMessageEvent, matcher: Matcher, state: T_State, phone=
         phone = phone.extract_plain_text().strip()
     if phone == '退出':
         await matcher.finish('🚪已成功退出')
-    user_account: List[UserAccount] = state['user_account']
     qq = state['qq']
-    phones = [str(user_account[i].phone) for i in range(len(user_account))]
-    if phone in phones:
-        account = UserData.read_account(qq, int(phone))
-    else:
+    account = UserData.read_account(qq, int(phone)) if phone.isdigit() else None
+    if account is None:
         await matcher.reject('⚠️您输入的账号不在以上账号内，请重新输入')
     state['account'] = account
     user_setting = ""
@@ -82,9 +77,8 @@ async def _(event: PrivateMessageEvent, matcher: Matcher, state: T_State, phone=
 
     # 筛选出用户数据中的missionGame对应的游戏全称
     user_setting += "4️⃣ 执行米游币任务的频道：『" + \
-        "、".join([game_tuple[1] for game_tuple in list(filter(
-            lambda game_tuple: game_tuple[0] in account.missionGame,
-            GameInfo.ABBR_TO_ID.values()))]) + "』\n"
+        "、".join([name for abbr, name in GameInfo.ABBR_TO_NAME.items()
+                  if abbr in account.missionGame]) + "』\n"
 
     await account_setting.send(user_setting+'\n您要更改哪一项呢？请发送 1 / 2 / 3 / 4\n🚪发送“退出”即可退出')
 
@@ -95,29 +89,32 @@ async def _(event: PrivateMessageEvent, state: T_State, arg=ArgPlainText('arg'))
     根据所选更改相应账户的相应设置
     """
     arg = arg.strip()
-    account: UserAccount = state['account']
+    phone = state['account'].phone
     if arg == '退出':
         await account_setting.finish('🚪已成功退出')
-    elif arg == '1':
-        account.mybMission = not account.mybMission
-        UserData.set_account(account, event.user_id, account.phone)
-        await account_setting.finish(f"📅米游币任务自动执行已 {'☑️开启' if account.mybMission else '⬛️关闭'}")
-    elif arg == '2':
-        account.gameSign = not account.gameSign
-        UserData.set_account(account, event.user_id, account.phone)
-        await account_setting.finish(f"📅米哈游游戏自动签到已 {'☑️开启' if account.gameSign else '⬛️关闭'}")
-    elif arg == '3':
-        if account.platform == "ios":
-            account.platform = "android"
-            platform_show = "安卓"
+    elif arg in ('1', '2', '3'):
+        async with UserData.transaction():
+            # 重新读取账户数据，避免覆盖对话期间做出的其他修改
+            account = UserData.read_account(event.user_id, phone)
+            if account is not None:
+                if arg == '1':
+                    account.mybMission = not account.mybMission
+                elif arg == '2':
+                    account.gameSign = not account.gameSign
+                else:
+                    account.platform = "android" if account.platform == "ios" else "ios"
+                UserData.set_account(account, event.user_id, phone)
+        if account is None:
+            await account_setting.finish("⚠️账户不存在，请重新选择")
+        elif arg == '1':
+            await account_setting.finish(f"📅米游币任务自动执行已 {'☑️开启' if account.mybMission else '⬛️关闭'}")
+        elif arg == '2':
+            await account_setting.finish(f"📅米哈游游戏自动签到已 {'☑️开启' if account.gameSign else '⬛️关闭'}")
         else:
-            account.platform = "ios"
-            platform_show = "iOS"
-        UserData.set_account(account, event.user_id, account.phone)
-        await account_setting.finish(f"📲设备平台已更改为 {platform_show}")
+            platform_show = "安卓" if account.platform == "android" else "iOS"
+            await account_setting.finish(f"📲设备平台已更改为 {platform_show}")
     elif arg == '4':
-        games_show = "、".join([name_tuple[1]
-                              for name_tuple in GameInfo.ABBR_TO_ID.values()])
+        games_show = "、".join(GameInfo.ABBR_TO_NAME.values())
         await account_setting.send(
             "请发送你想要执行米游币任务的频道：\n"
             "❕多个频道请用空格分隔，如 “原神 崩坏3 大别野”\n"
@@ -134,26 +131,25 @@ async def _(event: PrivateMessageEvent, state: T_State, arg=ArgPlainText('missio
     arg = arg.strip()
     if arg == '退出':
         await account_setting.finish('🚪已成功退出')
-    account: UserAccount = state['account']
+    phone = state['account'].phone
     games_input = arg.split()
     for game in arg.split():
-        if game not in [name_tuple[1]
-                        for name_tuple in GameInfo.ABBR_TO_ID.values()]:
+        if game not in GameInfo.NAME_TO_ABBR:
             await account_setting.reject("⚠️您的输入有误，请重新输入")
 
     # 查找输入的内容是否有不在游戏(频道)列表里的
-    incorrect = list(filter(lambda game: game not in [name_tuple[1]
-                                                      for name_tuple in GameInfo.ABBR_TO_ID.values()], games_input))
+    incorrect = list(filter(lambda game: game not in GameInfo.NAME_TO_ABBR, games_input))
     if incorrect:
         await account_setting.reject("⚠️您的输入有误，请重新输入")
-    else:
-        account.missionGame = []
-
-        # 查找输入的每个游戏全名的对应缩写
-        for game_input in games_input:
-            account.missionGame.append(list(filter(
-                lambda game_tuple: game_tuple[1] == game_input, GameInfo.ABBR_TO_ID.values()))[0][0])
-    UserData.set_account(account, event.user_id, account.phone)
+    async with UserData.transaction():
+        # 重新读取账户数据，避免覆盖对话期间做出的其他修改
+        account = UserData.read_account(event.user_id, phone)
+        if account is not None:
+            # 查找输入的每个游戏全名的对应缩写
+            account.missionGame = [GameInfo.NAME_TO_ABBR[game_input] for game_input in games_input]
+            UserData.set_account(account, event.user_id, phone)
+    if account is None:
+        await account_setting.finish("⚠️账户不存在，请重新选择")
     arg = arg.replace(" ", "、")
     await account_setting.finish(f"💬执行米游币任务的频道已更改为『{arg}』")
 
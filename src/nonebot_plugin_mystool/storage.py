@@ -0,0 +1,534 @@
+"""
+### 用户数据存储后端相关
+"""
+import json
+import os
+import sqlite3
+from typing import Dict, List, Set, Tuple, Union
+
+from .codec import dumps, loads
+from .config import PATH
+from .config import mysTool_config as conf
+from .utils import logger
+
+ENCODING = "utf-8"
+USERDATA_PATH = PATH / "userdata.json"
+SQLITE_PATH = PATH / "userdata.db"
+SHARDED_PATH = PATH / "users"
+SHARDED_INDEX_PATH = PATH / "users_index.json"
+JOURNAL_PATH = PATH / "userdata.journal"
+
+
+def fsync_dir(path):
+    """
+    将目录的变化(文件的创建、替换、删除)同步到磁盘，不支持的平台(如Windows)会忽略
+
+    参数:
+        `path`: 目录路径
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_durably(path, content: str, sync_dir: bool = True):
+    """
+    先写入临时文件并同步到磁盘，再替换目标文件，避免写入中途出错或断电导致文件损坏
+
+    参数:
+        `path`: 目标文件路径
+        `content`: 文件内容
+        `sync_dir`: 是否同步所在目录(批量写入同一目录时可在最后统一调用 `fsync_dir`)
+    """
+    temp_path = path.with_suffix(".tmp")
+    with temp_path.open("w", encoding=ENCODING) as fp:
+        fp.write(content)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(temp_path, path)
+    if sync_dir:
+        fsync_dir(path.parent)
+
+
+class Storage:
+    """
+    用户数据存储后端基类
+
+    用户数据的格式为 `{QQ号: QQ用户数据}`，与`userdata.json`一致
+
+    除`__init__`外，存储后端的方法都会在专用的I/O线程中调用，不会阻塞事件循环
+    """
+    LAZY = False
+    '''是否按需读取单个QQ用户的数据，为`False`时启动时会通过`load_all`读取所有用户数据'''
+
+    def load_all(self) -> Dict[str, dict]:
+        """
+        读取所有用户数据
+        """
+        raise NotImplementedError
+
+    def users(self) -> List[str]:
+        """
+        获取所有QQ用户的QQ号
+        """
+        return list(self.load_all())
+
+    def bbsUIDs(self) -> Dict[str, Set[str]]:
+        """
+        获取所有QQ用户绑定的米游社UID `{QQ号: 米游社UID集合}`，用于建立米游社UID索引
+        """
+        return {qq: {account.get("bbsUID") for account in user.get("accounts", [])}
+                for qq, user in self.load_all().items()}
+
+    def load(self, qq: str) -> Union[dict, None]:
+        """
+        读取某个QQ用户的数据，若不存在则返回`None`
+
+        参数:
+            `qq`: 用户的QQ号
+        """
+        return self.load_all().get(qq)
+
+    def save(self, changed: Dict[str, Union[dict, None]]):
+        """
+        保存发生变化的QQ用户的数据
+
+        参数:
+            `changed`: 发生变化的QQ用户的数据(为调用方复制的副本)，值为`None`表示该用户已被删除
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        关闭存储后端
+        """
+        pass
+
+
+class JsonStorage(Storage):
+    """
+    以单个JSON文件(`userdata.json`)保存用户数据，每次保存都会整体覆盖
+
+    每个QQ用户编码后的JSON片段会被缓存，保存时只重新编码发生变化的用户，再将所有片段拼接写入
+    """
+
+    def __init__(self, path=USERDATA_PATH) -> None:
+        self.path = path
+        self.fragments: Dict[str, str] = {}
+        '''各QQ用户编码后的JSON片段'''
+
+    @staticmethod
+    def encode(user: dict) -> str:
+        """
+        将QQ用户数据编码为`userdata.json`中对应位置的JSON片段(缩进与整体`json.dump`一致)
+
+        参数:
+            `user`: QQ用户数据
+        """
+        return json.dumps(user, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+
+    def load_all(self) -> Dict[str, dict]:
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            logger.warning(conf.LOG_HEAD + "用户数据文件不存在，将重新生成...")
+        else:
+            try:
+                with self.path.open(encoding=ENCODING) as fp:
+                    userdata = loads(fp.read())
+                if not isinstance(userdata, dict):
+                    raise ValueError
+                self.fragments = {qq: self.encode(user) for qq, user in userdata.items()}
+                return userdata
+            except (json.JSONDecodeError, ValueError):
+                # 保留损坏的文件，以便手动恢复
+                corrupted_path = self.path.with_suffix(".json.corrupted")
+                os.replace(self.path, corrupted_path)
+                logger.warning(
+                    f"{conf.LOG_HEAD}用户数据文件格式错误，已将原文件重命名为 {corrupted_path.name}，将重新生成...")
+
+        self.fragments = {}
+        self.write()
+        return {}
+
+    def update(self, changed: Dict[str, Union[dict, None]]):
+        """
+        更新发生变化的QQ用户的JSON片段
+
+        参数:
+            `changed`: 发生变化的QQ用户的数据，值为`None`表示该用户已被删除
+        """
+        for qq, user in changed.items():
+            if user is None:
+                self.fragments.pop(qq, None)
+            else:
+                self.fragments[qq] = self.encode(user)
+
+    def write(self):
+        """
+        将所有JSON片段拼接写入数据文件
+        """
+        if self.fragments:
+            content = "{\n" + ",\n".join(f"    {json.dumps(qq)}: {fragment}"
+                                          for qq, fragment in self.fragments.items()) + "\n}"
+        else:
+            content = "{}"
+        write_durably(self.path, content)
+
+    def save(self, changed: Dict[str, Union[dict, None]]):
+        self.update(changed)
+        self.write()
+
+
+class JournalStorage(JsonStorage):
+    """
+    以`userdata.json`作为快照，另将每次修改以一行紧凑JSON记录追加写入日志文件`userdata.journal`
+
+    - 保存时只追加发生变化的QQ用户的记录 `{"qq": QQ号, "user": QQ用户数据或null(已删除)}`
+    - 读取时在快照的基础上重放日志，日志末尾不完整的记录(如写入中途崩溃)会被忽略
+    - 日志记录数达到 `JOURNAL_COMPACT_RECORDS` 时，将当前数据写入新的快照并清空日志
+    """
+
+    def __init__(self, path=USERDATA_PATH, journal_path=JOURNAL_PATH) -> None:
+        super().__init__(path)
+        self.journal_path = journal_path
+        self.journal = None
+        '''以追加模式打开的日志文件'''
+        self.records = 0
+        '''日志中的记录数'''
+
+    def load_all(self) -> Dict[str, dict]:
+        userdata = super().load_all()
+        if not self.journal_path.exists():
+            return userdata
+        replayed = 0
+        broken = False
+        with self.journal_path.open(encoding=ENCODING) as fp:
+            for line in fp:
+                try:
+                    record = loads(line)
+                    qq, user = record["qq"], record["user"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    broken = True
+                    logger.warning(conf.LOG_HEAD + "用户数据 - 日志中存在不完整的记录，已忽略该记录及之后的内容")
+                    break
+                if user is None:
+                    userdata.pop(qq, None)
+                else:
+                    userdata[qq] = user
+                self.update({qq: user})
+                replayed += 1
+        if replayed or broken:
+            logger.info(f"{conf.LOG_HEAD}用户数据 - 已重放 {replayed} 条日志记录")
+            self.compact()
+        return userdata
+
+    def save(self, changed: Dict[str, Union[dict, None]]):
+        self.update(changed)
+        if self.journal is None:
+            self.journal = self.journal_path.open("a", encoding=ENCODING)
+        for qq, user in changed.items():
+            self.journal.write(dumps({"qq": qq, "user": user}) + "\n")
+            self.records += 1
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        if self.records >= conf.JOURNAL_COMPACT_RECORDS:
+            self.compact()
+
+    def compact(self):
+        """
+        将完整用户数据写入快照，并清空日志
+        """
+        # 快照同步到磁盘后才能清空日志，否则断电时可能同时丢失快照和日志
+        self.write()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        self.journal_path.open("w", encoding=ENCODING).close()
+        self.records = 0
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+
+class SqliteStorage(Storage):
+    """
+    以SQLite数据库保存用户数据
+
+    QQ用户、米游社账户、兑换计划分别存放于`users`、`accounts`、`exchange_plans`表，
+    并按QQ号、手机号、备注名、米游社UID建立索引。保存时只改写发生变化的QQ用户的行
+
+    首次使用时若存在`userdata.json`，会自动导入并将其重命名为`userdata.json.bak`
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        qq TEXT PRIMARY KEY,
+        notice INTEGER NOT NULL DEFAULT 1,
+        schema_version INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS accounts (
+        qq TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        phone INTEGER,
+        name TEXT,
+        bbsUID TEXT,
+        data TEXT NOT NULL,
+        PRIMARY KEY (qq, position)
+    );
+    CREATE INDEX IF NOT EXISTS idx_accounts_phone ON accounts (phone);
+    CREATE INDEX IF NOT EXISTS idx_accounts_name ON accounts (name);
+    CREATE INDEX IF NOT EXISTS idx_accounts_bbsUID ON accounts (bbsUID);
+    CREATE TABLE IF NOT EXISTS exchange_plans (
+        qq TEXT NOT NULL,
+        account INTEGER NOT NULL,
+        phone INTEGER,
+        position INTEGER NOT NULL,
+        goodID TEXT NOT NULL,
+        gameUID TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_exchange_plans_qq ON exchange_plans (qq, phone);
+    CREATE INDEX IF NOT EXISTS idx_exchange_plans_goodID ON exchange_plans (goodID);
+    """
+
+    def __init__(self, path=SQLITE_PATH, json_path=USERDATA_PATH) -> None:
+        self.path = path
+        self.json_path = json_path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+        self.__upgrade_schema()
+        self.connection.commit()
+        self.__import_json()
+
+    def __upgrade_schema(self):
+        """
+        为旧版本创建的数据库补充缺少的列
+        """
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(users)")}
+        if "schema_version" not in columns:
+            self.connection.execute(
+                "ALTER TABLE users ADD COLUMN schema_version INTEGER NOT NULL DEFAULT 0")
+
+    def __import_json(self):
+        """
+        若数据库为空且存在`userdata.json`，则导入其中的数据
+        """
+        if not self.json_path.exists():
+            return
+        if self.connection.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None:
+            return
+        try:
+            with self.json_path.open(encoding=ENCODING) as fp:
+                userdata = loads(fp.read())
+            if not isinstance(userdata, dict):
+                raise ValueError
+        except (json.JSONDecodeError, ValueError):
+            logger.warning(conf.LOG_HEAD + "用户数据 - userdata.json 格式错误，跳过导入")
+            return
+        self.save(userdata)
+        os.replace(self.json_path, self.json_path.with_suffix(".json.bak"))
+        logger.info(
+            f"{conf.LOG_HEAD}用户数据 - 已将 userdata.json 导入数据库 {self.path}，原文件已重命名为 userdata.json.bak")
+
+    def load_all(self) -> Dict[str, dict]:
+        userdata: Dict[str, dict] = {}
+        for qq, notice, schema_version in self.connection.execute(
+                "SELECT qq, notice, schema_version FROM users"):
+            userdata[qq] = {"accounts": [], "notice": bool(notice), "schema_version": schema_version}
+
+        plans: Dict[Tuple[str, int], List[list]] = {}
+        for qq, account, goodID, gameUID in self.connection.execute(
+                "SELECT qq, account, goodID, gameUID FROM exchange_plans ORDER BY qq, account, position"):
+            plans.setdefault((qq, account), []).append([goodID, gameUID])
+
+        for qq, position, data in self.connection.execute(
+                "SELECT qq, position, data FROM accounts ORDER BY qq, position"):
+            if qq not in userdata:
+                continue
+            account = loads(data)
+            account["exchange"] = plans.get((qq, position), [])
+            userdata[qq]["accounts"].append(account)
+        return userdata
+
+    def save(self, changed: Dict[str, Union[dict, None]]):
+        with self.connection:
+            for qq, user in changed.items():
+                self.connection.execute("DELETE FROM users WHERE qq = ?", (qq,))
+                self.connection.execute("DELETE FROM accounts WHERE qq = ?", (qq,))
+                self.connection.execute("DELETE FROM exchange_plans WHERE qq = ?", (qq,))
+                if user is None:
+                    continue
+                self.connection.execute(
+                    "INSERT INTO users (qq, notice, schema_version) VALUES (?, ?, ?)",
+                    (qq, int(user.get("notice", True)), user.get("schema_version", 0)))
+                for position, account in enumerate(user.get("accounts", [])):
+                    data = dict(account)
+                    exchange = data.pop("exchange", [])
+                    self.connection.execute(
+                        "INSERT INTO accounts (qq, position, phone, name, bbsUID, data) VALUES (?, ?, ?, ?, ?, ?)",
+                        (qq, position, data.get("phone"), data.get("name"), data.get("bbsUID"),
+                         dumps(data)))
+                    self.connection.executemany(
+                        "INSERT INTO exchange_plans (qq, account, phone, position, goodID, gameUID) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(qq, position, data.get("phone"), num, plan[0], plan[1]) for num, plan in enumerate(exchange)])
+
+    def close(self):
+        self.connection.close()
+
+
+class ShardedStorage(Storage):
+    """
+    每个QQ用户的数据单独保存为 `users/<QQ号>.json`，只在用到某个QQ用户时读取其文件，
+    保存时只写入发生变化的QQ用户的文件
+
+    各QQ用户绑定的米游社UID另外保存在 `users_index.json` 中，启动时只需读取该文件即可建立米游社UID索引，
+    只有索引中缺失或比索引文件更新的用户文件才会被读取
+
+    首次使用时若存在`userdata.json`，会自动拆分导入并将其重命名为`userdata.json.bak`
+    """
+    LAZY = True
+
+    def __init__(self, path=SHARDED_PATH, json_path=USERDATA_PATH, index_path=SHARDED_INDEX_PATH) -> None:
+        self.path = path
+        self.json_path = json_path
+        self.index_path = index_path
+        self.index: Union[Dict[str, List[str]], None] = None
+        '''各QQ用户绑定的米游社UID `{QQ号: 米游社UID列表}`，在首次用到时读取'''
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.__import_json()
+
+    def __import_json(self):
+        """
+        若目录为空且存在`userdata.json`，则拆分导入其中的数据
+        """
+        if not self.json_path.exists() or self.users():
+            return
+        try:
+            with self.json_path.open(encoding=ENCODING) as fp:
+                userdata = loads(fp.read())
+            if not isinstance(userdata, dict):
+                raise ValueError
+        except (json.JSONDecodeError, ValueError):
+            logger.warning(conf.LOG_HEAD + "用户数据 - userdata.json 格式错误，跳过导入")
+            return
+        self.save(userdata)
+        os.replace(self.json_path, self.json_path.with_suffix(".json.bak"))
+        logger.info(
+            f"{conf.LOG_HEAD}用户数据 - 已将 userdata.json 拆分导入目录 {self.path}，原文件已重命名为 userdata.json.bak")
+
+    def __file(self, qq: str):
+        return self.path / f"{qq}.json"
+
+    def users(self) -> List[str]:
+        return [file.stem for file in self.path.glob("*.json")]
+
+    def load(self, qq: str) -> Union[dict, None]:
+        file = self.__file(qq)
+        if not file.exists():
+            return None
+        try:
+            with file.open(encoding=ENCODING) as fp:
+                user = loads(fp.read())
+            if not isinstance(user, dict):
+                raise ValueError
+            return user
+        except (json.JSONDecodeError, ValueError):
+            logger.error(f"{conf.LOG_HEAD}用户数据 - 用户 {qq} 的数据文件格式错误，已忽略该用户")
+            return None
+
+    @staticmethod
+    def __uids_of(user: dict) -> List[str]:
+        return [account.get("bbsUID") for account in user.get("accounts", [])]
+
+    def __read_index(self) -> Dict[str, List[str]]:
+        """
+        读取米游社UID索引文件，并用缺失或有变化的用户文件更正
+        """
+        index = {}
+        index_mtime = 0
+        try:
+            with self.index_path.open(encoding=ENCODING) as fp:
+                index = loads(fp.read())
+            if not isinstance(index, dict):
+                raise ValueError
+            index_mtime = os.stat(self.index_path).st_mtime
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, ValueError):
+            logger.warning(conf.LOG_HEAD + "用户数据 - 米游社UID索引文件格式错误，将重新生成")
+            index = {}
+
+        shards = {entry.name[:-len(".json")]: entry.stat().st_mtime for entry in os.scandir(self.path)
+                  if entry.is_file() and entry.name.endswith(".json")}
+        stale = False
+        for qq in set(index) - set(shards):
+            index.pop(qq)
+            stale = True
+        for qq, mtime in shards.items():
+            if qq in index and mtime <= index_mtime:
+                continue
+            user = self.load(qq)
+            index[qq] = self.__uids_of(user) if user is not None else []
+            stale = True
+        if stale:
+            self.__write_index(index)
+        return index
+
+    def __write_index(self, index: Dict[str, List[str]]):
+        write_durably(self.index_path, json.dumps(index, ensure_ascii=False))
+
+    def bbsUIDs(self) -> Dict[str, Set[str]]:
+        if self.index is None:
+            self.index = self.__read_index()
+        return {qq: set(uids) for qq, uids in self.index.items()}
+
+    def load_all(self) -> Dict[str, dict]:
+        userdata = {}
+        for qq in self.users():
+            user = self.load(qq)
+            if user is not None:
+                userdata[qq] = user
+        return userdata
+
+    def save(self, changed: Dict[str, Union[dict, None]]):
+        if self.index is None:
+            self.index = self.__read_index()
+        for qq, user in changed.items():
+            file = self.__file(qq)
+            if user is None:
+                file.unlink(missing_ok=True)
+                self.index.pop(qq, None)
+                continue
+            write_durably(file, json.dumps(user, indent=4, ensure_ascii=False), sync_dir=False)
+            self.index[qq] = self.__uids_of(user)
+        fsync_dir(self.path)
+        # 索引在用户文件之后写入，若中途出错，下次读取索引时会发现较新的用户文件并更正
+        self.__write_index(self.index)
+
+
+STORAGES = {
+    "json": JsonStorage,
+    "journal": JournalStorage,
+    "sqlite": SqliteStorage,
+    "sharded": ShardedStorage
+}
+'''存储方式名称与存储后端类的对应关系'''
+
+
+def create_storage() -> Storage:
+    """
+    根据配置中的 `STORAGE` 创建存储后端
+    """
+    try:
+        return STORAGES[conf.STORAGE]()
+    except KeyError:
+        logger.error(f"{conf.LOG_HEAD}用户数据 - 不支持的存储方式 {conf.STORAGE}，将使用 json")
+        return JsonStorage()
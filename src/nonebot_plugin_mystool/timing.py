@@ -4,20 +4,25 @@
 import asyncio
 import os
 import time
-from typing import List
+import traceback
+from typing import List, Set, Tuple
 
 import nonebot_plugin_apscheduler
 from nonebot import get_bot, get_driver, on_command
 from nonebot.adapters.onebot.v11 import (Bot, MessageSegment,
                                          PrivateMessageEvent)
 
+from .asset import asset_cache
 from .bbsAPI import GameInfo, GameRecord, get_game_record
+from .circuitBreaker import rejection_count, track_rejections
 from .config import mysTool_config as conf
-from .data import UserData
-from .exchange import game_list_to_image, get_good_list
+from .data import UserAccount, UserData
+from .exchange import game_list_to_image
 from .gameSign import GameSign, Info
+from .goodCatalog import good_catalog
 from .mybMission import Action, get_missions_state
-from .utils import get_file, logger
+from .session import AccountSession
+from .utils import logger
 
 driver = get_driver()
 COMMAND = list(driver.config.command_start)[0] + conf.COMMAND_START
@@ -56,148 +61,202 @@ async def _(event: PrivateMessageEvent):
     await perform_bbs_sign(bot=bot, qq=event.user_id, isAuto=False)
 
 
-async def perform_game_sign(bot: Bot, qq: str, isAuto: bool):
+async def perform_game_sign(bot: Bot, qq: str, isAuto: bool, accounts: List[UserAccount] = None,
+                            done: Set[str] = None, defer: bool = False):
     """
     执行游戏签到函数。并发送给用户签到消息。
 
     参数:
         `isAuto`: `True`为当日自动签到，`False`为用户手动调用签到功能
+        `accounts`: (可选)要签到的帐号，默认为该用户的所有帐号
+        `done`: (可选)已完成的游戏账号，执行时跳过，并加入新完成的游戏账号(用于重新执行时避免重复签到和通知)
+        `defer`: 是否暂不通知因接口熔断而失败的签到(之后会重新执行)
     """
-    accounts = UserData.read_account_all(qq)
+    await UserData.load_user(qq)
+    if accounts is None:
+        accounts = UserData.read_account_all(qq)
+    if done is None:
+        done = set()
     for account in accounts:
-        gamesign = GameSign(account)
-        record_list: List[GameRecord] = await get_game_record(account)
-        if isinstance(record_list, int):
-            if record_list == -1:
-                await bot.send_private_msg(user_id=qq, message=f"⚠️账户 {account.phone} 登录失效，请重新登录")
-                continue
-            else:
-                await bot.send_private_msg(user_id=qq, message=f"⚠️账户 {account.phone} 获取游戏账号信息失败，请重新尝试")
-                continue
-        if not record_list and not isAuto:
-            await bot.send_private_msg(user_id=qq, message=f"⚠️账户 {account.phone} 没有绑定任何游戏账号，跳过游戏签到")
-            continue
-        for record in record_list:
-            if GameInfo.ABBR_TO_ID[record.gameID][0] not in GameSign.SUPPORTED_GAMES:
-                logger.info(
-                    conf.LOG_HEAD + "执行游戏签到 - {} 暂不支持".format(GameInfo.ABBR_TO_ID[record.gameID][1]))
-                continue
-            else:
-                sign_game = GameInfo.ABBR_TO_ID[record.gameID][0]
-                sign_info = await gamesign.info(sign_game, record.uid)
-                game_name = GameInfo.ABBR_TO_ID[record.gameID][1]
-
-                if sign_info == -1:
+        async with AccountSession(account):
+            gamesign = GameSign(account)
+            before = rejection_count()
+            record_list: List[GameRecord] = await get_game_record(account)
+            if isinstance(record_list, int):
+                if defer and rejection_count() > before:
+                    continue
+                if record_list == -1:
                     await bot.send_private_msg(user_id=qq, message=f"⚠️账户 {account.phone} 登录失效，请重新登录")
                     continue
-
-                # 自动签到时，要求用户打开了签到功能；手动签到时都可以调用执行。若没签到，则进行签到功能。
-                # 若获取今日签到情况失败，但不是登录失效的情况，仍可继续
-                if ((account.gameSign and isAuto) or not isAuto) and (isinstance(sign_info, Info) and not sign_info.isSign) or (isinstance(sign_info, int) and sign_info != -1):
-                    sign_flag = await gamesign.sign(sign_game, record.uid, account.platform)
-                    if sign_flag != 1:
-                        if sign_flag == -1:
-                            message = "⚠️账户 {0} 🎮『{1}』签到时服务器返回登录失效，请尝试重新登录绑定账户".format(
-                                account.phone, game_name)
-                        elif sign_flag == -5:
-                            message = "⚠️账户 {0} 🎮『{1}』签到时可能遇到验证码拦截，请尝试使用命令『/账户设置』更改设备平台，若仍失败请手动前往米游社签到".format(
-                                account.phone, game_name)
-                        else:
-                            message = "⚠️账户 {0} 🎮『{1}』签到失败，请稍后再试".format(
-                                account.phone, game_name)
-                        await bot.send_msg(
-                            message_type="private",
-                            user_id=qq,
-                            message=message
-                        )
-                        await asyncio.sleep(conf.SLEEP_TIME)
-                        continue
-                elif isinstance(sign_info, int):
-                    await bot.send_private_msg(user_id=qq, message="账户 {0} 🎮『{1}』已尝试签到，但获取签到结果失败".format(
-                        account.phone, game_name))
+                else:
+                    await bot.send_private_msg(user_id=qq, message=f"⚠️账户 {account.phone} 获取游戏账号信息失败，请重新尝试")
                     continue
-                # 用户打开通知或手动签到时，进行通知
-                if UserData.isNotice(qq) or not isAuto:
-                    img = ""
-                    sign_info = await gamesign.info(sign_game, record.uid)
-                    month_sign_award = await gamesign.reward(sign_game)
-                    if isinstance(sign_info, int) or isinstance(month_sign_award, int):
-                        msg = "⚠️账户 {0} 🎮『{1}』获取签到结果失败！请手动前往米游社查看".format(
-                            account.phone, game_name)
-                    else:
-                        sign_award = month_sign_award[sign_info.totalDays-1]
-                        if sign_info.isSign:
-                            msg = f"""\
-                                \n{'📱账户 {}'.format(account.phone)}\
-                                \n{'🎮『{}』今日签到成功！'.format(game_name)}\
-                                \n{record.nickname}·{record.regionName}·{record.level}\
-                                \n🎁今日签到奖励：\
-                                \n{sign_award.name} * {sign_award.count}\
-                                \n\n📅本月签到次数：{sign_info.totalDays}\
-                            """.strip()
-                            img_file = await get_file(sign_award.icon)
-                            img = MessageSegment.image(img_file)
-                        else:
-                            msg = "⚠️账户 {0} 🎮『{1}』签到失败！请尝试重新签到，若多次失败请尝试重新登录绑定账户".format(
-                                account.phone, game_name)
-                    await bot.send_msg(
-                        message_type="private",
-                        user_id=qq,
-                        message=msg + img
-                    )
-                await asyncio.sleep(conf.SLEEP_TIME)
+            if not record_list and not isAuto:
+                await bot.send_private_msg(user_id=qq, message=f"⚠️账户 {account.phone} 没有绑定任何游戏账号，跳过游戏签到")
+                continue
+            for record in record_list:
+                if GameInfo.ABBR_TO_ID[record.gameID][0] not in GameSign.SUPPORTED_GAMES:
+                    logger.info(
+                        conf.LOG_HEAD + "执行游戏签到 - {} 暂不支持".format(GameInfo.ABBR_TO_ID[record.gameID][1]))
+                    continue
+                key = f"{account.phone}:{record.gameID}:{record.uid}"
+                if key in done:
+                    continue
+                before = rejection_count()
+                message = await sign_record(gamesign, qq, account, record, isAuto)
+                # 因接口熔断而失败时先不通知，重新执行后再通知结果
+                if defer and rejection_count() > before:
+                    continue
+                done.add(key)
+                if message:
+                    await bot.send_private_msg(user_id=qq, message=message)
 
 
-async def perform_bbs_sign(bot: Bot, qq: str, isAuto: bool):
+async def sign_record(gamesign: GameSign, qq: str, account: UserAccount, record: GameRecord, isAuto: bool):
+    """
+    签到某个游戏账号，返回需要发送给用户的消息，无需通知时返回`None`
+
+    参数:
+        `gamesign`: 帐号的游戏签到对象
+        `qq`: 帐号所属的QQ
+        `account`: 米游社帐号
+        `record`: 要签到的游戏账号
+        `isAuto`: `True`为当日自动签到，`False`为用户手动调用签到功能
+    """
+    sign_game = GameInfo.ABBR_TO_ID[record.gameID][0]
+    sign_info = await gamesign.info(sign_game, record.uid)
+    game_name = GameInfo.ABBR_TO_ID[record.gameID][1]
+
+    if sign_info == -1:
+        return f"⚠️账户 {account.phone} 登录失效，请重新登录"
+
+    # 自动签到时，要求用户打开了签到功能；手动签到时都可以调用执行。若没签到，则进行签到功能。
+    # 若获取今日签到情况失败，但不是登录失效的情况，仍可继续
+    if ((account.gameSign and isAuto) or not isAuto) and (isinstance(sign_info, Info) and not sign_info.isSign) or (isinstance(sign_info, int) and sign_info != -1):
+        sign_flag = await gamesign.sign(sign_game, record.uid, account.platform)
+        if sign_flag != 1:
+            if sign_flag == -1:
+                return "⚠️账户 {0} 🎮『{1}』签到时服务器返回登录失效，请尝试重新登录绑定账户".format(
+                    account.phone, game_name)
+            elif sign_flag == -5:
+                return "⚠️账户 {0} 🎮『{1}』签到时可能遇到验证码拦截，请尝试使用命令『/账户设置』更改设备平台，若仍失败请手动前往米游社签到".format(
+                    account.phone, game_name)
+            else:
+                return "⚠️账户 {0} 🎮『{1}』签到失败，请稍后再试".format(
+                    account.phone, game_name)
+    elif isinstance(sign_info, int):
+        return "账户 {0} 🎮『{1}』已尝试签到，但获取签到结果失败".format(
+            account.phone, game_name)
+    # 用户打开通知或手动签到时，进行通知
+    if UserData.isNotice(qq) or not isAuto:
+        img = ""
+        sign_info = await gamesign.info(sign_game, record.uid)
+        month_sign_award = await gamesign.reward(sign_game)
+        if isinstance(sign_info, int) or isinstance(month_sign_award, int):
+            msg = "⚠️账户 {0} 🎮『{1}』获取签到结果失败！请手动前往米游社查看".format(
+                account.phone, game_name)
+        else:
+            if sign_info.totalDays > len(month_sign_award):
+                # 缓存的奖励列表已过时(如奖励已更新)，重新获取
+                month_sign_award = await gamesign.reward(sign_game, refresh=True) or month_sign_award
+            sign_award = month_sign_award[sign_info.totalDays-1]
+            if sign_info.isSign:
+                msg = f"""\
+                \n{'📱账户 {}'.format(account.phone)}\
+                \n{'🎮『{}』今日签到成功！'.format(game_name)}\
+                \n{record.nickname}·{record.regionName}·{record.level}\
+                \n🎁今日签到奖励：\
+                \n{sign_award.name} * {sign_award.count}\
+                \n\n📅本月签到次数：{sign_info.totalDays}\
+                """.strip()
+                img_bytes = await asset_cache.read(sign_award.icon)
+                if img_bytes is not None:
+                    img = MessageSegment.image(img_bytes)
+            else:
+                msg = "⚠️账户 {0} 🎮『{1}』签到失败！请尝试重新签到，若多次失败请尝试重新登录绑定账户".format(
+                    account.phone, game_name)
+        return msg + img
+    return None
+
+
+async def perform_bbs_sign(bot: Bot, qq: str, isAuto: bool, accounts: List[UserAccount] = None,
+                           done: Set[str] = None, defer: bool = False):
     """
     执行米游币任务函数。并发送给用户任务执行消息。
 
     参数:
         `IsAuto`: True为当日自动执行任务，False为用户手动调用任务功能
+        `accounts`: (可选)要执行任务的帐号，默认为该用户的所有帐号
+        `done`: (可选)已完成的帐号和任务，执行时跳过，并加入新完成的帐号和任务(用于重新执行时避免重复执行和通知)
+        `defer`: 是否暂不通知受接口熔断影响的帐号(之后会重新执行)
     """
-    accounts = UserData.read_account_all(qq)
+    await UserData.load_user(qq)
+    if accounts is None:
+        accounts = UserData.read_account_all(qq)
+    if done is None:
+        done = set()
     for account in accounts:
-        missions_state = await get_missions_state(account)
-        mybmission = await Action(account).async_init()
-        if isinstance(missions_state, int):
-            if mybmission == -1:
-                await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 登录失效，请重新登录')
-                continue
-            await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 获取任务完成情况请求失败，你可以手动前往App查看')
-            continue
-        if isinstance(mybmission, int):
-            if mybmission == -1:
-                await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 登录失效，请重新登录')
-            await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 请求失败，请重新尝试')
+        if account.phone in done:
             continue
-        # 自动执行米游币任务时，要求用户打开了任务功能；手动执行时都可以调用执行。
-        if (account.mybMission and isAuto) or not isAuto:
-            if not isAuto:
-                await bot.send_private_msg(user_id=qq, message=f'📱账户 {account.phone} ⏳开始执行米游币任务...')
-
-            # 执行任务
-            for mission_state in missions_state[0]:
-                if mission_state[1] < mission_state[0].totalTimes:
-                    for gameID in account.missionGame:
-                        await mybmission.NAME_TO_FUNC[mission_state[0].keyName](mybmission, gameID)
-
-            # 用户打开通知或手动任务时，进行通知
-            if UserData.isNotice(qq) or not isAuto:
-                missions_state = await get_missions_state(account)
-                if isinstance(missions_state, int):
-                    if mybmission == -1:
-                        await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 登录失效，请重新登录')
-                        continue
-                    await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 获取任务完成情况请求失败，你可以手动前往App查看')
+        async with AccountSession(account):
+            before = rejection_count()
+            missions_state = await get_missions_state(account)
+            mybmission = await Action(account).async_init()
+            if isinstance(missions_state, int) or isinstance(mybmission, int):
+                if defer and rejection_count() > before:
                     continue
-                if missions_state[0][0][1] >= missions_state[0][0][0].totalTimes and\
-                        missions_state[0][1][1] >= missions_state[0][1][0].totalTimes and\
-                        missions_state[0][2][1] >= missions_state[0][2][0].totalTimes and\
-                        missions_state[0][3][1] >= missions_state[0][3][0].totalTimes:
-                    notice_string = "🎉已完成今日米游币任务"
-                else:
-                    notice_string = "⚠️今日米游币任务未全部完成"
-                msg = f"""\
+                done.add(account.phone)
+            if isinstance(missions_state, int):
+                if mybmission == -1:
+                    await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 登录失效，请重新登录')
+                    continue
+                await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 获取任务完成情况请求失败，你可以手动前往App查看')
+                continue
+            if isinstance(mybmission, int):
+                if mybmission == -1:
+                    await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 登录失效，请重新登录')
+                await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 请求失败，请重新尝试')
+                continue
+            # 自动执行米游币任务时，要求用户打开了任务功能；手动执行时都可以调用执行。
+            if (account.mybMission and isAuto) or not isAuto:
+                if not isAuto:
+                    await bot.send_private_msg(user_id=qq, message=f'📱账户 {account.phone} ⏳开始执行米游币任务...')
+
+                # 执行任务
+                for mission_state in missions_state[0]:
+                    if mission_state[1] < mission_state[0].totalTimes:
+                        for gameID in account.missionGame:
+                            key = f"{account.phone}:{mission_state[0].keyName}:{gameID}"
+                            if key in done:
+                                continue
+                            step_before = rejection_count()
+                            await mybmission.NAME_TO_FUNC[mission_state[0].keyName](mybmission, gameID)
+                            if rejection_count() == step_before:
+                                done.add(key)
+
+                # 用户打开通知或手动任务时，进行通知
+                notice = UserData.isNotice(qq) or not isAuto
+                if notice:
+                    missions_state = await get_missions_state(account)
+                # 受到接口熔断影响时先不通知，重新执行后再通知结果
+                if defer and rejection_count() > before:
+                    continue
+                done.add(account.phone)
+                if notice:
+                    if isinstance(missions_state, int):
+                        if mybmission == -1:
+                            await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 登录失效，请重新登录')
+                            continue
+                        await bot.send_private_msg(user_id=qq, message=f'⚠️账户 {account.phone} 获取任务完成情况请求失败，你可以手动前往App查看')
+                        continue
+                    if missions_state[0][0][1] >= missions_state[0][0][0].totalTimes and\
+                            missions_state[0][1][1] >= missions_state[0][1][0].totalTimes and\
+                            missions_state[0][2][1] >= missions_state[0][2][0].totalTimes and\
+                            missions_state[0][3][1] >= missions_state[0][3][0].totalTimes:
+                        notice_string = "🎉已完成今日米游币任务"
+                    else:
+                        notice_string = "⚠️今日米游币任务未全部完成"
+                    msg = f"""\
                     \n{notice_string}\
                     \n📱账户 {account.phone}\
                     \n- 签到 {'✓' if missions_state[0][0][1] >= missions_state[0][0][0].totalTimes else '✕'}\
@@ -205,13 +264,12 @@ async def perform_bbs_sign(bot: Bot, qq: str, isAuto: bool):
                     \n- 点赞 {'✓' if missions_state[0][2][1] >= missions_state[0][2][0].totalTimes else '✕'}\
                     \n- 转发 {'✓' if missions_state[0][3][1] >= missions_state[0][3][0].totalTimes else '✕'}\
                 \n💰米游币: {missions_state[1]}
-                """.strip()
-                await bot.send_msg(
-                    message_type="private",
-                    user_id=qq,
-                    message=msg
-                )
-            await asyncio.sleep(conf.SLEEP_TIME)
+                    """.strip()
+                    await bot.send_msg(
+                        message_type="private",
+                        user_id=qq,
+                        message=msg
+                    )
 
 
 async def generate_image(isAuto=True):
@@ -226,7 +284,7 @@ async def generate_image(isAuto=True):
             if name.endswith('.jpg'):
                 os.remove(os.path.join(root, name))
     for game in ("bh3", "ys", "bh2", "wd", "bbs"):
-        good_list = await get_good_list(game)
+        good_list = await good_catalog.get_list(game, refresh=True)
         if good_list:
             img_path = time.strftime(
                 f'{conf.goodListImage.SAVE_PATH}/%m-%d-{game}.jpg', time.localtime())
@@ -250,11 +308,80 @@ async def daily_schedule():
     """
     自动米游币任务、游戏签到函数
     """
-    qq_accounts = UserData.read_all().keys()
     bot = get_bot()
-    for qq in qq_accounts:
-        await perform_bbs_sign(bot=bot, qq=qq, isAuto=True)
-        await perform_game_sign(bot=bot, qq=qq, isAuto=True)
+    parked: List[Tuple[int, UserAccount, List[str], Set[str]]] = []
+    semaphore = asyncio.Semaphore(conf.TASK_CONCURRENCY)
+    running: Set[asyncio.Task] = set()
+    passes = conf.CIRCUIT_BREAKER_RETRY_PASSES
+
+    async def run(qq: int, account: UserAccount, tasks: List[str], done: Set[str], defer: bool):
+        try:
+            tasks = await perform_daily_tasks(bot, qq, account, tasks, done, defer)
+            if tasks:
+                parked.append((qq, account, tasks, done))
+        except Exception:
+            # 单个帐号出错不影响其他帐号的任务
+            logger.error(conf.LOG_HEAD + "每日自动任务 - 帐号 {} 执行任务时出错".format(account.phone))
+            logger.debug(conf.LOG_HEAD + traceback.format_exc())
+        finally:
+            semaphore.release()
+
+    async def start(qq: int, account: UserAccount, tasks: List[str], done: Set[str], defer: bool):
+        # 同时最多执行 TASK_CONCURRENCY 个帐号，操作节奏由限速器控制
+        await semaphore.acquire()
+        task = asyncio.create_task(run(qq, account, tasks, done, defer))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    async for qq, account in UserData.iter_accounts():
+        tasks = []
+        if account.mybMission:
+            tasks.append("bbs")
+        if account.gameSign:
+            tasks.append("game")
+        if tasks:
+            await start(qq, account, tasks, set(), passes > 0)
+    await asyncio.gather(*running)
+
+    # 因接口熔断而搁置的帐号，等待熔断结束后重新执行(跳过已完成的部分)
+    for i in range(passes):
+        if not parked:
+            break
+        logger.info(conf.LOG_HEAD + "每日自动任务 - {} 个帐号因接口熔断被搁置，{} 秒后重新执行".format(
+            len(parked), conf.CIRCUIT_BREAKER_OPEN_TIME))
+        await asyncio.sleep(conf.CIRCUIT_BREAKER_OPEN_TIME)
+        retry_list, parked = parked, []
+        for qq, account, tasks, done in retry_list:
+            # 最后一次重新执行时，仍失败的任务照常通知用户
+            await start(qq, account, tasks, done, i < passes - 1)
+        await asyncio.gather(*running)
+    if parked:
+        logger.warning(conf.LOG_HEAD + "每日自动任务 - 接口持续熔断，{} 个帐号的任务未能完成，已通知用户".format(len(parked)))
+
+
+async def perform_daily_tasks(bot: Bot, qq: int, account: UserAccount, tasks: List[str],
+                              done: Set[str], defer: bool) -> List[str]:
+    """
+    执行帐号的每日自动任务，返回因接口熔断而需要稍后重新执行的任务
+
+    参数:
+        `qq`: 帐号所属的QQ
+        `account`: 米游社帐号
+        `tasks`: 要执行的任务，`bbs`为米游币任务，`game`为游戏签到
+        `done`: 帐号已完成的部分，重新执行时跳过
+        `defer`: 是否暂不通知因接口熔断而失败的部分(之后会重新执行)
+    """
+    parked = []
+    for task in tasks:
+        # 只根据任务实际请求的接口是否被熔断拒绝来决定是否搁置
+        rejected = track_rejections()
+        if task == "bbs":
+            await perform_bbs_sign(bot=bot, qq=qq, isAuto=True, accounts=[account], done=done, defer=defer)
+        else:
+            await perform_game_sign(bot=bot, qq=qq, isAuto=True, accounts=[account], done=done, defer=defer)
+        if rejected:
+            parked.append(task)
+    return parked
 
 # 启动时，自动生成当日米游社商品图片
 driver.on_startup(generate_image)
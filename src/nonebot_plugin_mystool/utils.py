@@ -2,7 +2,6 @@
 ### 工具函数
 """
 import hashlib
-import json
 import random
 import string
 import time
@@ -18,7 +17,10 @@ import ntplib
 import tenacity
 from nonebot.log import logger
 
+from .codec import JSONDecodeError, dumps_compatible, loads
 from .config import mysTool_config as conf
+from .httpClient import shared_get
+from .retry import request_retrying
 
 if TYPE_CHECKING:
     from loguru import Logger
@@ -155,7 +157,7 @@ def generateDS(data: Union[str, dict, list] = "", params: Union[str, dict] = "",
         return f"{t},{a},{re}"
     else:
         if not isinstance(data, str):
-            data = json.dumps(data)
+            data = dumps_compatible(data)
         if not isinstance(params, str):
             params = urlencode(params)
         t = str(int(NtpTime.time()))
@@ -174,16 +176,85 @@ async def get_file(url: str, retry: bool = True):
         `retry`: 是否允许重试
     """
     try:
-        async for attempt in tenacity.AsyncRetrying(stop=custom_attempt_times(retry), wait=tenacity.wait_fixed(conf.SLEEP_TIME_RETRY)):
+        async for attempt in request_retrying(retry):
             with attempt:
-                async with httpx.AsyncClient() as client:
-                    res = await client.get(url, timeout=conf.TIME_OUT, follow_redirects=True)
+                res = await shared_get(url, timeout=conf.TIME_OUT, follow_redirects=True)
                 return res.content
     except tenacity.RetryError:
         logger.error(conf.LOG_HEAD + "下载文件 - {} 失败".format(url))
         logger.debug(conf.LOG_HEAD + traceback.format_exc())
 
 
+LOGIN_EXPIRED_MESSAGES = ("Please login", "登录失效", "尚未登录")
+'''返回信息中表示登录失效的字符串'''
+
+
+class ApiResponse:
+    """
+    米游社API的返回数据，返回内容只解析一次
+
+    >>> res = ApiResponse(await session.get(...))
+    >>> if res.login_expired:
+    >>>     return -1
+    >>> return res.data["list"]
+
+    返回内容不是JSON时，初始化会抛出 `ValueError`；
+    访问 `retcode`、`message`、`data` 时若返回内容中没有该项，会抛出 `KeyError`
+    """
+    __slots__ = ("response", "body", "content")
+
+    def __init__(self, response: httpx.Response, body: bytes = None) -> None:
+        """
+        参数:
+            `response`: 网络请求返回
+            `body`: (可选)以流的方式读取时，已读取的返回内容
+        """
+        self.response = response
+        '''原始的网络请求返回'''
+        self.body: bytes = response.content if body is None else body
+        '''原始的返回内容'''
+        self.content: dict = loads(self.body)
+        '''解析后的全部返回内容'''
+
+    @property
+    def retcode(self) -> int:
+        """
+        返回码
+        """
+        return self.content["retcode"]
+
+    @property
+    def message(self) -> str:
+        """
+        返回信息
+        """
+        return self.content["message"]
+
+    @property
+    def data(self):
+        """
+        返回数据
+        """
+        return self.content["data"]
+
+    @property
+    def login_expired(self) -> bool:
+        """
+        是否登录失效
+        """
+        message = self.content.get("message") if isinstance(self.content, dict) else None
+        if not isinstance(message, str):
+            return False
+        return any(string in message for string in LOGIN_EXPIRED_MESSAGES)
+
+    @property
+    def text(self) -> str:
+        """
+        原始的返回内容(文本)
+        """
+        return self.body.decode(self.response.encoding or "utf-8", errors="replace")
+
+
 def check_login(response: str):
     """
     通过网络请求返回的数据，检查是否登录失效
@@ -193,12 +264,12 @@ def check_login(response: str):
     try:
         if response is None:
             return True
-        res_dict = json.loads(response)
+        res_dict = loads(response)
         if "message" in res_dict:
             response: str = res_dict["message"]
-            for string in ("Please login", "登录失效", "尚未登录"):
+            for string in LOGIN_EXPIRED_MESSAGES:
                 if response.find(string) != -1:
                     return False
             return True
-    except json.JSONDecodeError and KeyError:
+    except JSONDecodeError and KeyError:
         return True